@@ -3,5 +3,6 @@ Common utilities and shared code for Claude playground projects
 """
 from .config import Config
 from .claude_client import ClaudeClient
+from .async_client import AsyncClaudeClient
 
-__all__ = ['Config', 'ClaudeClient']
+__all__ = ['Config', 'ClaudeClient', 'AsyncClaudeClient']
@@ -0,0 +1,234 @@
+import asyncio
+import contextlib
+import anthropic
+from .config import Config
+from .cache import AsyncReplayStream, CachingStreamManager, request_key
+from .claude_client import ClaudeClient, SendResult, append_message, normalize_request
+from .history import History
+from .priority import SlotStreamManager
+from .transport import get_registry
+
+class AsyncClaudeClient(ClaudeClient):
+    """Asyncio wrapper for Claude API client built on anthropic.AsyncAnthropic
+    
+    Mirrors the ClaudeClient surface, but requests are awaited instead of
+    blocking a thread, so a single event loop can keep many conversations
+    in flight at once.
+    """
+    
+    def _create_client(self):
+        """Create the underlying async SDK client"""
+        return anthropic.AsyncAnthropic(
+            api_key=Config.ANTHROPIC_API_KEY,
+            http_client=get_registry().async_http_client()
+        )
+    
+    def send_message(self, messages, system=None, tools=None, stream=False):
+        """Send a message to Claude
+        
+        Returns an awaitable for regular requests and an async context
+        manager when stream=True:
+        
+            response = await client.send_message(messages)
+            async with client.send_message(messages, stream=True) as stream:
+                async for text in stream.text_stream:
+                    ...
+        """
+        params = self._prepare_params(messages, system=system, tools=tools)
+        
+        if stream:
+            return self._stream(params)
+        else:
+            return self._create(params)
+    
+    def _stream(self, params):
+        """Open a message stream, replaying a cached response if enabled"""
+        key, response = self._cached_response(params)
+        if response is not None:
+            return AsyncReplayStream(response)
+        
+        hooks = (self.cache, self.semantic_cache, self.prompt_cache, self.rate_limiter)
+        if all(hook is None for hook in hooks):
+            return self._open_stream(params)
+        return self._stream_with_hooks(key, params)
+    
+    @contextlib.asynccontextmanager
+    async def _stream_with_hooks(self, key, params):
+        reservation = None
+        if self.rate_limiter is not None:
+            reservation = await self.rate_limiter.acquire_async(params)
+        
+        manager = CachingStreamManager(
+            self._open_stream(params),
+            lambda message: self._finish_stream(key, params, reservation, message)
+        )
+        async with manager as stream:
+            yield stream
+    
+    async def _create(self, params):
+        """Create a message, consulting the response caches if enabled"""
+        key, response = self._cached_response(params)
+        if response is not None:
+            return response
+        
+        if self.coalescer is not None:
+            return await self.coalescer.acall(
+                key or request_key(params),
+                lambda: self._fetch(key, params)
+            )
+        return await self._fetch(key, params)
+    
+    async def _fetch(self, key, params):
+        """Call the API and record the fresh response
+        
+        With a router the request may go to several models in turn; each
+        attempt waits for a slot in this client's lane if a dispatcher is
+        set, and is hedged if a hedging policy is set.
+        """
+        if self.router is None:
+            response = await self._call_upstream(params)
+        else:
+            response = await self.router.arun(self._call_upstream, params)
+        self._record_response(key, params, response)
+        return response
+    
+    def _open_stream(self, params):
+        """SDK stream manager, held on a key pool member and in a dispatcher lane if enabled
+        
+        A stream holds its lane slot until it is closed. Streams do not go
+        through the router, hedging or circuit breakers: they cannot be
+        re-sent once text has reached the consumer.
+        """
+        if self.key_pool is None:
+            manager = self.client.messages.stream(**params)
+        else:
+            manager = self.key_pool.stream(lambda member: member.async_client.messages.stream(**params))
+        if self.dispatcher is None:
+            return manager
+        return SlotStreamManager(self.dispatcher, self.lane, manager)
+    
+    async def _call_upstream(self, params):
+        if self.dispatcher is None:
+            return await self._call_hedged(params)
+        async with self.dispatcher.aslot(self.lane):
+            return await self._call_hedged(params)
+    
+    async def _call_hedged(self, params):
+        if self.hedging is None:
+            return await self._call_api(params)
+        return await self.hedging.arun(self._call_api, params)
+    
+    async def _call_api(self, params):
+        """Make one upstream call, through the model's circuit breaker if enabled"""
+        if self.circuit_breakers is None:
+            return await self._call_model(params)
+        return await self.circuit_breakers.acall(self._call_model, params)
+    
+    async def _call_model(self, params):
+        """Make one messages.create call, on a key pool member if enabled"""
+        if self.key_pool is None:
+            return await self._call_sdk(self.client, params)
+        return await self.key_pool.acall(
+            lambda member, params: self._call_sdk(member.async_client, params, member),
+            params
+        )
+    
+    async def _call_sdk(self, client, params, member=None):
+        """Call messages.create, reading the response headers when something uses them"""
+        client = self._single_attempt(client)
+        reservation = None
+        if self.rate_limiter is not None:
+            reservation = await self.rate_limiter.acquire_async(params)
+        if reservation is None and member is None:
+            return await self._post_message(client, params)
+        
+        try:
+            raw = await self._post_message(client, params, raw=True)
+        except anthropic.APIStatusError as e:
+            self._observe_headers(e.response.headers, member)
+            raise
+        self._observe_headers(raw.headers, member)
+        response = await raw.parse()
+        if reservation is not None:
+            self.rate_limiter.settle(reservation, response.usage)
+        return response
+    
+    async def _send_one(self, index, request, semaphore):
+        """Send one send_many item, capturing any error on the result"""
+        async with semaphore:
+            try:
+                return SendResult(index, response=await self.send_message(**request))
+            except Exception as e:
+                return SendResult(index, error=e)
+    
+    def send_many(self, requests, concurrency=8, as_completed=False):
+        """Send many independent requests with at most `concurrency` in flight
+        
+        Awaiting the result gives a list of SendResult in input order. With
+        as_completed=True an async iterator is returned instead, yielding
+        each SendResult as soon as it finishes.
+        """
+        requests = [normalize_request(request) for request in requests]
+        
+        if as_completed:
+            return self._iter_many(requests, concurrency)
+        return self._gather_many(requests, concurrency)
+    
+    async def _gather_many(self, requests, concurrency):
+        """Collect SendResults in input order"""
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        return await asyncio.gather(
+            *(self._send_one(index, request, semaphore)
+              for index, request in enumerate(requests))
+        )
+    
+    async def _iter_many(self, requests, concurrency):
+        """Yield SendResults in completion order"""
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        tasks = [
+            asyncio.ensure_future(self._send_one(index, request, semaphore))
+            for index, request in enumerate(requests)
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def chat(self, user_message, conversation_history=None, system=None, session_id=None):
+        """Simple chat interface
+        
+        With session_id the history is kept in the client's SessionStore
+        instead of being passed in and out.
+        """
+        if session_id is not None:
+            conversation_history = self._session_history(session_id)
+        if conversation_history is None:
+            conversation_history = []
+        
+        # A History is immutable, so it is never compacted in place
+        compact = self.compaction is not None and not isinstance(conversation_history, History)
+        conversation_history = self._budgeted_history(conversation_history, compact)
+        if compact:
+            self.compaction.apply(conversation_history)
+        
+        conversation_history = append_message(conversation_history, {
+            "role": "user",
+            "content": user_message
+        })
+        
+        response = await self.send_message(conversation_history, system=system)
+        assistant_message = response.content[0].text
+        
+        conversation_history = append_message(conversation_history, {
+            "role": "assistant",
+            "content": assistant_message
+        })
+        
+        if compact:
+            self.compaction.schedule_async(self, conversation_history)
+        if session_id is not None:
+            self.sessions.save(session_id, conversation_history)
+        
+        return assistant_message, conversation_history
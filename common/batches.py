@@ -0,0 +1,88 @@
+"""Message Batches offload for non-interactive workloads"""
+import time
+from .claude_client import SendResult, normalize_request
+
+class BatchRequestError(Exception):
+    """A request inside a message batch did not succeed"""
+    
+    def __init__(self, result_type, detail=None):
+        self.result_type = result_type
+        self.detail = detail
+        message = f"batch request {result_type}"
+        if detail is not None:
+            message += f": {detail}"
+        super().__init__(message)
+
+class MessageBatch:
+    """Submit requests through the Message Batches API and collect results
+    
+    Batched requests are billed at a discount and do not count against the
+    interactive rate limit, at the cost of asynchronous completion. The
+    batch is polled with exponential backoff until it ends, then results
+    are streamed back and mapped to the caller's custom IDs.
+    """
+    
+    def __init__(self, client, poll_interval=1.0, max_poll_interval=60.0,
+                 backoff=2.0, timeout=None, sleep=time.sleep):
+        self.client = client
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.sleep = sleep
+    
+    @property
+    def batches(self):
+        return self.client.client.messages.batches
+    
+    def submit(self, requests, custom_ids=None):
+        """Create a batch and return (batch, custom_ids)"""
+        requests = [normalize_request(request) for request in requests]
+        if custom_ids is None:
+            custom_ids = [f"request-{index}" for index in range(len(requests))]
+        custom_ids = list(custom_ids)
+        
+        if len(custom_ids) != len(requests):
+            raise ValueError("custom_ids must match the number of requests")
+        if len(set(custom_ids)) != len(custom_ids):
+            raise ValueError("custom_ids must be unique")
+        
+        batch = self.batches.create(requests=[
+            {"custom_id": custom_id, "params": self.client._prepare_params(**request)}
+            for custom_id, request in zip(custom_ids, requests)
+        ])
+        return batch, custom_ids
+    
+    def wait(self, batch_id):
+        """Poll a batch with backoff until it has ended"""
+        interval = self.poll_interval
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        
+        while True:
+            batch = self.batches.retrieve(batch_id)
+            if batch.processing_status == "ended":
+                return batch
+            if deadline is not None and time.monotonic() + interval > deadline:
+                raise TimeoutError(f"message batch {batch_id} still running")
+            self.sleep(interval)
+            interval = min(interval * self.backoff, self.max_poll_interval)
+    
+    def results(self, batch_id, custom_ids=None):
+        """Yield a SendResult per request as results are streamed back"""
+        index_of = {custom_id: index for index, custom_id in enumerate(custom_ids or [])}
+        
+        for entry in self.batches.results(batch_id):
+            result = entry.result
+            index = index_of.get(entry.custom_id)
+            
+            if result.type == "succeeded":
+                yield SendResult(index, response=result.message, custom_id=entry.custom_id)
+            else:
+                error = BatchRequestError(result.type, getattr(result, "error", None))
+                yield SendResult(index, error=error, custom_id=entry.custom_id)
+    
+    def run(self, requests, custom_ids=None):
+        """Submit, wait for and stream back a whole batch"""
+        batch, custom_ids = self.submit(requests, custom_ids)
+        self.wait(batch.id)
+        yield from self.results(batch.id, custom_ids)
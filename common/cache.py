@@ -0,0 +1,275 @@
+"""Opt-in response cache for ClaudeClient"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from anthropic.types import Message
+
+from .utils import to_jsonable
+
+CACHE_KEY_FIELDS = ("model", "max_tokens", "system", "tools", "messages")
+
+def request_key(params):
+    """Canonical hash of the request fields that determine a response"""
+    canonical = json.dumps(
+        {field: to_jsonable(params.get(field)) for field in CACHE_KEY_FIELDS},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class MemoryCache:
+    """In-process LRU tier with size and TTL eviction"""
+    
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def __len__(self):
+        return len(self._entries)
+
+class DiskCache:
+    """SQLite tier that several processes can share
+    
+    Values are JSON text. WAL mode lets readers in other processes proceed
+    while one process writes.
+    """
+    
+    def __init__(self, path, ttl=None):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+    
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        if self.ttl is not None and created + self.ttl <= time.time():
+            return None
+        return value
+    
+    def set(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created) VALUES (?, ?, ?)",
+                (key, value, time.time())
+            )
+    
+    def clear(self, prefix=None):
+        """Delete every entry, or only those whose key starts with prefix"""
+        with self._lock, self._conn:
+            if prefix is None:
+                self._conn.execute("DELETE FROM responses")
+            else:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+                )
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ResponseCache:
+    """Two-tier response cache keyed on a canonical hash of the request
+    
+    Lookups try the in-memory LRU first, then the optional on-disk tier;
+    disk hits are promoted into memory.
+    """
+    
+    def __init__(self, max_size=1024, ttl=None, path=None, disk_ttl=None):
+        self.memory = MemoryCache(max_size=max_size, ttl=ttl)
+        self.disk = DiskCache(path, ttl=disk_ttl if disk_ttl is not None else ttl) if path else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+    
+    def key(self, params):
+        return request_key(params)
+    
+    def get(self, key):
+        """Return the cached Message for key, or None"""
+        response = self.memory.get(key)
+        if response is not None:
+            self._count("memory_hits")
+            return response
+        
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                response = Message.model_validate_json(value)
+                self.memory.set(key, response)
+                self._count("disk_hits")
+                return response
+        
+        self._count("misses")
+        return None
+    
+    def set(self, key, response):
+        self.memory.set(key, response)
+        if self.disk is not None and hasattr(response, "model_dump_json"):
+            self.disk.set(key, response.model_dump_json())
+    
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+    
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+    
+    def stats(self):
+        """Hit/miss counters"""
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_size": len(self.memory)
+        }
+
+class ReplayStream:
+    """Replays a cached Message through the MessageStream surface"""
+    
+    def __init__(self, message):
+        self._message = message
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        return False
+    
+    @property
+    def text_stream(self):
+        for block in self._message.content:
+            if block.type == "text":
+                yield block.text
+    
+    @property
+    def current_message_snapshot(self):
+        return self._message
+    
+    def until_done(self):
+        pass
+    
+    def get_final_message(self):
+        return self._message
+    
+    def get_final_text(self):
+        return "".join(self.text_stream)
+    
+    def close(self):
+        pass
+
+class AsyncReplayStream(ReplayStream):
+    """Replays a cached Message through the AsyncMessageStream surface"""
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        return False
+    
+    @property
+    async def text_stream(self):
+        for text in ReplayStream.text_stream.fget(self):
+            yield text
+    
+    async def until_done(self):
+        pass
+    
+    async def get_final_message(self):
+        return self._message
+    
+    async def get_final_text(self):
+        return "".join(ReplayStream.text_stream.fget(self))
+    
+    async def close(self):
+        pass
+
+def stream_snapshot(stream):
+    """The message a stream has accumulated so far, or None before its first event"""
+    try:
+        return stream.current_message_snapshot
+    except (AssertionError, AttributeError):
+        # The SDK asserts that message_start has arrived
+        return None
+
+class CachingStreamManager:
+    """Wraps a message stream manager and hands its message to `store` on exit
+    
+    Works as a sync or async context manager, matching the wrapped one.
+    store(message) gets the message as far as the consumer read it (None
+    if no event arrived); the rest of an abandoned stream is not drained.
+    Nothing is stored when the block raises.
+    """
+    
+    def __init__(self, manager, store):
+        self._manager = manager
+        self._store = store
+        self._stream = None
+    
+    def __enter__(self):
+        self._stream = self._manager.__enter__()
+        return self._stream
+    
+    def __exit__(self, exc_type, exc, tb):
+        suppress = self._manager.__exit__(exc_type, exc, tb)
+        if exc_type is None:
+            self._store(stream_snapshot(self._stream))
+        return suppress
+    
+    async def __aenter__(self):
+        self._stream = await self._manager.__aenter__()
+        return self._stream
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        suppress = await self._manager.__aexit__(exc_type, exc, tb)
+        if exc_type is None:
+            self._store(stream_snapshot(self._stream))
+        return suppress
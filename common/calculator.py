@@ -0,0 +1,228 @@
+"""Safe arithmetic for calculator tools
+
+Expressions are parsed to an AST, checked against a small whitelist of
+nodes and functions, and compiled once; compiled expressions are cached
+by their text. Powers go through a checked helper so `pow(10, 10**10)`
+fails fast with CalculationError instead of hanging the worker.
+
+evaluate_many() runs one compiled expression over NumPy arrays of
+variable bindings, for bulk numeric tool calls.
+"""
+import ast
+import functools
+import math
+import operator
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only without NumPy
+    np = None
+
+from .cache import MemoryCache
+
+class CalculationError(ValueError):
+    """Expression is invalid, too expensive, or fails to evaluate"""
+
+OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.UAdd, ast.USub)
+NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load,
+         ast.Call, ast.Tuple, ast.List) + OPERATORS
+
+CONSTANTS = {"pi": math.pi, "e": math.e}
+
+# The only calls that take a list, e.g. sum([1, 2, 3]); anywhere else a
+# list could be repeated with * into something huge
+SEQUENCE_FUNCTIONS = ("sum", "min", "max")
+
+# Syntax tree depth; the compiler and _CheckPowers recurse per level
+MAX_DEPTH = 100
+
+def _round(number, ndigits=None):
+    # round(5, -10**100) would build 10**(10**100) internally
+    if ndigits is not None and abs(ndigits) > 1000:
+        raise CalculationError("round() ndigits out of range")
+    return round(number, ndigits)
+
+FUNCTIONS = {
+    "abs": abs, "round": _round, "min": min, "max": max, "sum": sum,
+    "sqrt": math.sqrt, "log": math.log, "exp": math.exp, "floor": math.floor, "ceil": math.ceil,
+    "sin": math.sin, "cos": math.cos, "tan": math.tan
+}
+
+def _reduce(function):
+    """min/max over arguments or over one iterable, elementwise on arrays"""
+    def reduce(*args):
+        return functools.reduce(function, args[0] if len(args) == 1 else args)
+    return reduce
+
+def _vector_functions():
+    return {
+        "abs": np.abs, "round": np.round, "min": _reduce(np.minimum), "max": _reduce(np.maximum),
+        "sum": lambda values: functools.reduce(operator.add, values),
+        "sqrt": np.sqrt, "log": np.log, "exp": np.exp, "floor": np.floor, "ceil": np.ceil,
+        "sin": np.sin, "cos": np.cos, "tan": np.tan
+    }
+
+class _CheckPowers(ast.NodeTransformer):
+    """Route `a ** b` and pow(a, b) through the checked _pow helper"""
+    
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Pow):
+            return ast.Call(func=ast.Name(id="_pow", ctx=ast.Load()), args=[node.left, node.right], keywords=[])
+        return node
+    
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if node.func.id == "pow":
+            node.func = ast.Name(id="_pow", ctx=ast.Load())
+        return node
+
+class CompiledExpression:
+    """A validated, compiled expression and the variables it reads"""
+    
+    def __init__(self, text, code, variables):
+        self.text = text
+        self.code = code
+        self.variables = variables
+    
+    def __repr__(self):
+        return f"CompiledExpression({self.text!r})"
+
+class Calculator:
+    """Compiles and evaluates arithmetic with cost limits
+    
+    Integer powers are refused when the exponent exceeds max_exponent or
+    the result would exceed max_int_bits; integer literals and results are
+    held to max_int_bits too, and expressions to max_length characters.
+    Up to cache_size compiled expressions are kept.
+    """
+    
+    def __init__(self, max_exponent=10000, max_int_bits=4096, max_length=1000, cache_size=1024):
+        self.max_exponent = max_exponent
+        self.max_int_bits = max_int_bits
+        self.max_length = max_length
+        self._compiled = MemoryCache(max_size=cache_size)
+        self._scalar = {"__builtins__": {}, **CONSTANTS, **FUNCTIONS, "_pow": self._pow}
+        self._vector = None
+    
+    def _pow(self, base, exponent):
+        if isinstance(base, int) and isinstance(exponent, int) and abs(base) > 1:
+            if exponent > self.max_exponent or exponent * base.bit_length() > self.max_int_bits:
+                raise CalculationError(f"power too large: {base} ** {exponent}")
+        elif abs(exponent) > self.max_exponent:
+            raise CalculationError(f"exponent too large: {exponent}")
+        return base ** exponent
+    
+    def _vector_pow(self, base, exponent):
+        if np.any(np.abs(exponent) > self.max_exponent):
+            raise CalculationError("exponent too large")
+        return np.power(base, exponent)
+    
+    def compile(self, text):
+        """CompiledExpression for text, from the cache when seen before"""
+        compiled = self._compiled.get(text)
+        if compiled is not None:
+            return compiled
+        if len(text) > self.max_length:
+            raise CalculationError(f"expression longer than {self.max_length} characters")
+        try:
+            tree = ast.parse(text.strip(), mode="eval")
+        except SyntaxError as e:
+            raise CalculationError(f"invalid expression: {e.msg}") from None
+        except (RecursionError, MemoryError):
+            raise CalculationError("expression nested too deeply") from None
+        
+        # Lists and function names are only valid in these exact positions
+        sequences = set()
+        callees = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call):
+                callees.add(node.func)
+                if (isinstance(node.func, ast.Name) and node.func.id in SEQUENCE_FUNCTIONS
+                        and len(node.args) == 1 and isinstance(node.args[0], (ast.List, ast.Tuple))):
+                    sequences.add(node.args[0])
+        
+        variables = set()
+        stack = [(tree, 0)]
+        while stack:
+            node, depth = stack.pop()
+            if depth > MAX_DEPTH:
+                raise CalculationError("expression nested too deeply")
+            stack.extend((child, depth + 1) for child in ast.iter_child_nodes(node))
+            if not isinstance(node, NODES):
+                raise CalculationError(f"unsupported syntax: {type(node).__name__}")
+            if isinstance(node, (ast.List, ast.Tuple)) and node not in sequences:
+                raise CalculationError("lists are only allowed as the argument of sum, min or max")
+            if isinstance(node, ast.Constant):
+                if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                    raise CalculationError(f"unsupported constant: {node.value!r}")
+                if isinstance(node.value, int) and node.value.bit_length() > self.max_int_bits:
+                    raise CalculationError("integer literal too large")
+            elif isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS and node.func.id != "pow":
+                    raise CalculationError("unsupported function call")
+                if node.keywords:
+                    raise CalculationError("keyword arguments are not supported")
+            elif isinstance(node, ast.Name) and node.id not in CONSTANTS:
+                if node.id in FUNCTIONS or node.id == "pow":
+                    if node not in callees:
+                        raise CalculationError(f"function {node.id} must be called")
+                    continue
+                if node.id.startswith("_"):
+                    raise CalculationError(f"unsupported name: {node.id}")
+                variables.add(node.id)
+        
+        tree = ast.fix_missing_locations(_CheckPowers().visit(tree))
+        compiled = CompiledExpression(text, compile(tree, "<calculator>", "eval"), frozenset(variables))
+        self._compiled.set(text, compiled)
+        return compiled
+    
+    def _run(self, compiled, namespace, variables):
+        missing = compiled.variables - variables.keys()
+        if missing:
+            raise CalculationError(f"unbound variables: {', '.join(sorted(missing))}")
+        try:
+            return eval(compiled.code, namespace, variables)
+        except CalculationError:
+            raise
+        except (ArithmeticError, ValueError, TypeError) as e:
+            raise CalculationError(str(e)) from None
+        except (MemoryError, RecursionError):
+            raise CalculationError("expression too expensive to evaluate") from None
+    
+    def evaluate(self, text, **variables):
+        """Value of the expression with the given variable bindings"""
+        for name, value in variables.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise CalculationError(f"variable {name} must be a number")
+        result = self._run(self.compile(text), self._scalar, variables)
+        if isinstance(result, bool) or not isinstance(result, (int, float)):
+            raise CalculationError("result is not a real number")
+        if isinstance(result, int) and result.bit_length() > self.max_int_bits:
+            raise CalculationError("result too large")
+        return result
+    
+    def evaluate_many(self, text, **arrays):
+        """Evaluate the expression elementwise over arrays of bindings
+        
+        Bindings are converted to float64 arrays and broadcast together;
+        returns a NumPy array.
+        """
+        if np is None:
+            raise RuntimeError("evaluate_many requires NumPy")
+        if self._vector is None:
+            self._vector = {
+                "__builtins__": {}, **CONSTANTS, **_vector_functions(), "_pow": self._vector_pow
+            }
+        bindings = {name: np.asarray(values, dtype=np.float64) for name, values in arrays.items()}
+        with np.errstate(all="ignore"):
+            return np.asarray(self._run(self.compile(text), self._vector, bindings), dtype=np.float64)
+    
+    def stats(self):
+        return {"compiled_cached": len(self._compiled)}
+
+default_calculator = Calculator()
+
+def evaluate(text, **variables):
+    """Evaluate with the shared default Calculator"""
+    return default_calculator.evaluate(text, **variables)
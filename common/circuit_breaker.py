@@ -0,0 +1,227 @@
+"""Per-model circuit breakers for upstream overload"""
+import asyncio
+import random
+import threading
+import time
+from collections import Counter
+
+import anthropic
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a model whose circuit is open"""
+    
+    def __init__(self, model, retry_after):
+        self.model = model
+        self.retry_after = retry_after
+        super().__init__(f"circuit open for {model}; retry in {retry_after:.1f}s")
+
+def is_overload_error(error):
+    """Errors that indicate upstream trouble: 529/overloaded, 5xx, connection failures"""
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code >= 500
+    return isinstance(error, anthropic.APIConnectionError)
+
+def should_retry(error):
+    """Errors worth another attempt, as the SDK's own retry logic decides"""
+    if isinstance(error, anthropic.APIStatusError):
+        header = error.response.headers.get("x-should-retry")
+        if header in ("true", "false"):
+            return header == "true"
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return isinstance(error, anthropic.APIConnectionError)
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one model
+    
+    After `failure_threshold` consecutive overload errors the circuit opens
+    and calls are refused for `reset_timeout` seconds. It then half-opens to
+    let up to `half_open_max_calls` trial calls through: a success closes it,
+    a failure opens it again.
+    """
+    
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, half_open_max_calls=1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_calls = 0
+        self.transitions = Counter()
+        self.rejected = 0
+        self._lock = threading.Lock()
+    
+    def _transition(self, state):
+        self.transitions[f"{self.state}->{state}"] += 1
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        self.trial_calls = 0
+    
+    def allow(self):
+        """Whether a call may go upstream now"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self.trial_calls >= self.half_open_max_calls:
+                    self.rejected += 1
+                    return False
+                self.trial_calls += 1
+            return True
+    
+    def retry_after(self):
+        """Seconds until an open circuit half-opens"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+    
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self._transition(OPEN)
+    
+    def release(self):
+        """Free a half-open trial slot used by a call that neither failed nor succeeded"""
+        with self._lock:
+            if self.state == HALF_OPEN and self.trial_calls:
+                self.trial_calls -= 1
+    
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "rejected": self.rejected,
+            "transitions": dict(self.transitions)
+        }
+
+class ModelCircuitBreakers:
+    """One CircuitBreaker per model, with optional fallback models
+    
+    While a model's circuit is open, calls fail fast with CircuitOpenError,
+    or go to `fallbacks[model]` if one is configured (fallbacks can chain).
+    
+    The clients make a single SDK attempt per call under the breakers, and
+    the breakers do the retrying instead (up to max_retries, backing off
+    from retry_delay seconds), so every failed attempt counts toward
+    opening a circuit and a retry can already go to the fallback.
+    """
+    
+    def __init__(self, fallbacks=None, max_retries=2, retry_delay=0.5, **breaker_options):
+        self.fallbacks = dict(fallbacks or {})
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.breaker_options = breaker_options
+        self.breakers = {}
+        self.fallback_calls = Counter()
+        self._lock = threading.Lock()
+    
+    def get(self, model):
+        with self._lock:
+            breaker = self.breakers.get(model)
+            if breaker is None:
+                breaker = self.breakers[model] = CircuitBreaker(**self.breaker_options)
+            return breaker
+    
+    def _route(self, params):
+        """Pick the first model in the fallback chain whose circuit allows a call"""
+        model = params["model"]
+        seen = set()
+        while True:
+            breaker = self.get(model)
+            if breaker.allow():
+                if model != params["model"]:
+                    self.fallback_calls[model] += 1
+                    params = {**params, "model": model}
+                return breaker, params
+            seen.add(model)
+            fallback = self.fallbacks.get(model)
+            if fallback is None or fallback in seen:
+                raise CircuitOpenError(model, breaker.retry_after())
+            model = fallback
+    
+    def _record(self, breaker, error):
+        if error is None:
+            breaker.record_success()
+        elif is_overload_error(error):
+            breaker.record_failure()
+        else:
+            breaker.release()
+    
+    def _backoff(self, attempt, error):
+        """Seconds before retry number `attempt`, honoring a short Retry-After"""
+        response = getattr(error, "response", None)
+        try:
+            retry_after = float(response.headers.get("retry-after"))
+        except (AttributeError, TypeError, ValueError):
+            retry_after = None
+        if retry_after is not None and 0 <= retry_after <= 60:
+            return retry_after
+        return min(self.retry_delay * 2 ** attempt, 8.0) * (1 - 0.25 * random.random())
+    
+    def _retry_route(self, params, error):
+        """Route a retry; with every circuit in the chain open, re-raise the error"""
+        try:
+            return self._route(params)
+        except CircuitOpenError:
+            raise error from None
+    
+    def call(self, fn, params):
+        """Run fn(params) through the breaker for params["model"], retrying failures"""
+        breaker, routed = self._route(params)
+        attempt = 0
+        while True:
+            try:
+                response = fn(routed)
+            except BaseException as e:
+                self._record(breaker, e)
+                if attempt >= self.max_retries or not should_retry(e):
+                    raise
+                time.sleep(self._backoff(attempt, e))
+                attempt += 1
+                breaker, routed = self._retry_route(params, e)
+                continue
+            self._record(breaker, None)
+            return response
+    
+    async def acall(self, fn, params):
+        """Asyncio variant of call(); fn(params) must return an awaitable"""
+        breaker, routed = self._route(params)
+        attempt = 0
+        while True:
+            try:
+                response = await fn(routed)
+            except BaseException as e:
+                self._record(breaker, e)
+                if attempt >= self.max_retries or not should_retry(e):
+                    raise
+                await asyncio.sleep(self._backoff(attempt, e))
+                attempt += 1
+                breaker, routed = self._retry_route(params, e)
+                continue
+            self._record(breaker, None)
+            return response
+    
+    def stats(self):
+        """Breaker state and transition counters per model"""
+        with self._lock:
+            breakers = dict(self.breakers)
+        return {
+            "models": {model: breaker.stats() for model, breaker in breakers.items()},
+            "fallback_calls": dict(self.fallback_calls)
+        }
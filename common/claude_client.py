@@ -1,17 +1,96 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed as futures_as_completed
+import weakref
 import anthropic
+from anthropic.types import Message
 from .config import Config
+from .cache import CachingStreamManager, ReplayStream, request_key
+from .history import History
+from .priority import SlotStreamManager
+from .tokens import BudgetedHistory, history_tally
+from .transport import get_registry
+
+# Header the SDK's with_raw_response wrappers set; honoured by client.post too
+RAW_RESPONSE_HEADER = "X-Stainless-Raw-Response"
+
+try:
+    from anthropic._constants import DEFAULT_TIMEOUT, MODEL_NONSTREAMING_TOKENS
+except ImportError:  # pragma: no cover - exercised only with SDKs that lack them
+    DEFAULT_TIMEOUT = MODEL_NONSTREAMING_TOKENS = None
+
+class SendResult:
+    """Outcome of one request in a send_many batch"""
+    
+    def __init__(self, index, response=None, error=None, custom_id=None):
+        self.index = index
+        self.response = response
+        self.error = error
+        self.custom_id = custom_id
+    
+    @property
+    def ok(self):
+        return self.error is None
+    
+    def __repr__(self):
+        status = "ok" if self.ok else f"error={self.error!r}"
+        return f"SendResult(index={self.index}, {status})"
+
+def normalize_request(request):
+    """Turn a send_many item into send_message keyword arguments
+    
+    Items may be a messages list, a single prompt string, or a dict of
+    send_message keyword arguments (messages, system, tools).
+    """
+    if isinstance(request, str):
+        return {"messages": [{"role": "user", "content": request}]}
+    if isinstance(request, dict) and "messages" in request:
+        return dict(request)
+    return {"messages": request}
+
+def append_message(history, message):
+    """Append message to history; an immutable History yields a new one"""
+    if isinstance(history, History):
+        return history.append(message)
+    history.append(message)
+    return history
 
 class ClaudeClient:
     """Wrapper for Claude API client with common functionality"""
     
-    def __init__(self, model=None, max_tokens=None):
+    def __init__(self, model=None, max_tokens=None, cache=None, semantic_cache=None,
+                 prompt_cache=None, coalescer=None, rate_limiter=None, hedging=None,
+                 circuit_breakers=None, key_pool=None, dispatcher=None, lane="default",
+                 router=None, context_budget=None, compaction=None, encoder=None,
+                 sessions=None):
         Config.validate()
-        self.client = anthropic.Anthropic(api_key=Config.ANTHROPIC_API_KEY)
+        self.client = self._create_client()
         self.model = model or Config.DEFAULT_MODEL
         self.max_tokens = max_tokens or Config.MAX_TOKENS
+        self.cache = cache
+        self.semantic_cache = semantic_cache
+        self.prompt_cache = prompt_cache
+        self.coalescer = coalescer
+        self.rate_limiter = rate_limiter
+        self.hedging = hedging
+        self.circuit_breakers = circuit_breakers
+        self.key_pool = key_pool
+        self.dispatcher = dispatcher
+        self.lane = lane
+        self.router = router
+        self.context_budget = context_budget
+        self.compaction = compaction
+        self.encoder = encoder
+        self.sessions = sessions
+        self._single_attempt_clients = weakref.WeakKeyDictionary()
     
-    def send_message(self, messages, system=None, tools=None, stream=False):
-        """Send a message to Claude"""
+    def _create_client(self):
+        """Create the underlying SDK client"""
+        return anthropic.Anthropic(
+            api_key=Config.ANTHROPIC_API_KEY,
+            http_client=get_registry().http_client()
+        )
+    
+    def _build_params(self, messages, system=None, tools=None):
+        """Build the keyword arguments for a messages request"""
         params = {
             "model": self.model,
             "max_tokens": self.max_tokens,
@@ -22,18 +101,310 @@ class ClaudeClient:
             params["system"] = system
         if tools:
             params["tools"] = tools
+        if self.prompt_cache is not None:
+            params = self.prompt_cache.apply(params)
+        
+        return params
+    
+    def _prepare_params(self, messages, system=None, tools=None):
+        """Apply the context budget, then build the request parameters"""
+        if self.context_budget is not None:
+            messages = self.context_budget.enforce(
+                messages, system=system, tools=tools, max_tokens=self.max_tokens
+            )
+        return self._build_params(messages, system=system, tools=tools)
+    
+    def send_message(self, messages, system=None, tools=None, stream=False):
+        """Send a message to Claude"""
+        params = self._prepare_params(messages, system=system, tools=tools)
         
         if stream:
-            return self.client.messages.stream(**params)
+            return self._stream(params)
         else:
-            return self.client.messages.create(**params)
+            return self._create(params)
+    
+    def _cached_response(self, params):
+        """Look up params in the enabled caches; returns (key, response)"""
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(params)
+            response = self.cache.get(key)
+            if response is not None:
+                return key, response
+        if self.semantic_cache is not None:
+            response = self.semantic_cache.get(params)
+            if response is not None:
+                return key, response
+        return key, None
+    
+    def _record_response(self, key, params, response):
+        """Record a fresh response in the enabled caches and usage stats"""
+        if self.prompt_cache is not None:
+            self.prompt_cache.record(getattr(response, "usage", None))
+        if self.cache is not None:
+            self.cache.set(key, response)
+        if self.semantic_cache is not None:
+            self.semantic_cache.set(params, response)
+    
+    def _create(self, params):
+        """Create a message, consulting the response caches if enabled"""
+        key, response = self._cached_response(params)
+        if response is not None:
+            return response
+        
+        if self.coalescer is not None:
+            return self.coalescer.call(
+                key or request_key(params),
+                lambda: self._fetch(key, params)
+            )
+        return self._fetch(key, params)
+    
+    def _fetch(self, key, params):
+        """Call the API and record the fresh response
+        
+        With a router the request may go to several models in turn; each
+        attempt waits for a slot in this client's lane if a dispatcher is
+        set, and is hedged if a hedging policy is set.
+        """
+        if self.router is None:
+            response = self._call_upstream(params)
+        else:
+            response = self.router.run(self._call_upstream, params)
+        self._record_response(key, params, response)
+        return response
+    
+    def _call_upstream(self, params):
+        if self.dispatcher is None:
+            return self._call_hedged(params)
+        with self.dispatcher.slot(self.lane):
+            return self._call_hedged(params)
+    
+    def _call_hedged(self, params):
+        if self.hedging is None:
+            return self._call_api(params)
+        return self.hedging.run(self._call_api, params)
+    
+    def _call_api(self, params):
+        """Make one upstream call, through the model's circuit breaker if enabled"""
+        if self.circuit_breakers is None:
+            return self._call_model(params)
+        return self.circuit_breakers.call(self._call_model, params)
+    
+    def _call_model(self, params):
+        """Make one messages.create call, on a key pool member if enabled"""
+        if self.key_pool is None:
+            return self._call_sdk(self.client, params)
+        return self.key_pool.call(
+            lambda member, params: self._call_sdk(member.client, params, member),
+            params
+        )
+    
+    def _call_sdk(self, client, params, member=None):
+        """Call messages.create, reading the response headers when something uses them"""
+        client = self._single_attempt(client)
+        reservation = None
+        if self.rate_limiter is not None:
+            reservation = self.rate_limiter.acquire(params)
+        if reservation is None and member is None:
+            return self._post_message(client, params)
+        
+        try:
+            raw = self._post_message(client, params, raw=True)
+        except anthropic.APIStatusError as e:
+            self._observe_headers(e.response.headers, member)
+            raise
+        self._observe_headers(raw.headers, member)
+        response = raw.parse()
+        if reservation is not None:
+            self.rate_limiter.settle(reservation, response.usage)
+        return response
     
-    def chat(self, user_message, conversation_history=None, system=None):
-        """Simple chat interface"""
+    def _single_attempt(self, client):
+        """With circuit breakers, a copy of the SDK client that does not retry
+        
+        The breakers retry themselves, so that each failed attempt counts
+        toward opening the circuit rather than only the last of a cycle.
+        """
+        if self.circuit_breakers is None or not hasattr(client, "with_options"):
+            return client
+        single = self._single_attempt_clients.get(client)
+        if single is None:
+            single = self._single_attempt_clients[client] = client.with_options(max_retries=0)
+        return single
+    
+    def _post_message(self, client, params, raw=False):
+        """POST a messages request, sending a pre-encoded body if an encoder is set"""
+        if self.encoder is None:
+            create = client.messages.with_raw_response.create if raw else client.messages.create
+            return create(**params)
+        headers = {"Content-Type": "application/json"}
+        if raw:
+            headers[RAW_RESPONSE_HEADER] = "raw"
+        options = {"headers": headers}
+        # The same check messages.create makes: refuse a request too long
+        # to run without streaming, else use its non-streaming timeout
+        if DEFAULT_TIMEOUT is not None and client.timeout == DEFAULT_TIMEOUT:
+            options["timeout"] = client._calculate_nonstreaming_timeout(
+                params["max_tokens"], MODEL_NONSTREAMING_TOKENS.get(params["model"])
+            )
+        return client.post(
+            "/v1/messages",
+            cast_to=Message,
+            content=self.encoder.encode(params),
+            options=options
+        )
+    
+    def _observe_headers(self, headers, member):
+        """Feed rate-limit headers to the key pool member, or else to the rate limiter
+        
+        With a key pool each member has its own limits, so the process-wide
+        limiter keeps the limits it was configured with.
+        """
+        if member is not None:
+            self.key_pool.observe_headers(member, headers)
+        elif self.rate_limiter is not None:
+            self.rate_limiter.update_from_headers(headers)
+    
+    def _open_stream(self, params):
+        """SDK stream manager, held on a key pool member and in a dispatcher lane if enabled
+        
+        A stream holds its lane slot until it is closed. Streams do not go
+        through the router, hedging or circuit breakers: they cannot be
+        re-sent once text has reached the consumer.
+        """
+        if self.key_pool is None:
+            manager = self.client.messages.stream(**params)
+        else:
+            manager = self.key_pool.stream(lambda member: member.client.messages.stream(**params))
+        if self.dispatcher is None:
+            return manager
+        return SlotStreamManager(self.dispatcher, self.lane, manager)
+    
+    def _stream(self, params):
+        """Open a message stream, replaying a cached response if enabled"""
+        key, response = self._cached_response(params)
+        if response is not None:
+            return ReplayStream(response)
+        
+        reservation = None
+        if self.rate_limiter is not None:
+            reservation = self.rate_limiter.acquire(params)
+        
+        manager = self._open_stream(params)
+        hooks = (self.cache, self.semantic_cache, self.prompt_cache, reservation)
+        if all(hook is None for hook in hooks):
+            return manager
+        
+        return CachingStreamManager(
+            manager, lambda message: self._finish_stream(key, params, reservation, message)
+        )
+    
+    def _finish_stream(self, key, params, reservation, message):
+        """Settle and record a stream once its consumer is done with it
+        
+        A stream left before message_stop has no stop_reason; its partial
+        usage still settles the rate limiter, but it is not cached.
+        """
+        if message is None:
+            return
+        if reservation is not None:
+            self.rate_limiter.settle(reservation, message.usage)
+        if message.stop_reason is not None:
+            self._record_response(key, params, message)
+    
+    def _send_one(self, index, request):
+        """Send one send_many item, capturing any error on the result"""
+        try:
+            return SendResult(index, response=self.send_message(**request))
+        except Exception as e:
+            return SendResult(index, error=e)
+    
+    def send_many(self, requests, concurrency=8, as_completed=False,
+                  batch=False, custom_ids=None, **batch_options):
+        """Send many independent requests over a bounded worker pool
+        
+        At most `concurrency` requests are in flight at once. Returns a list
+        of SendResult in input order, or with as_completed=True an iterator
+        yielding each SendResult as soon as it finishes. A failed request
+        sets SendResult.error instead of failing the whole batch.
+        
+        With batch=True the requests are offloaded to the Message Batches
+        API instead (see common.batches.MessageBatch); custom_ids and any
+        polling options are passed through.
+        """
+        requests = [normalize_request(request) for request in requests]
+        
+        if batch:
+            from .batches import MessageBatch
+            iterator = MessageBatch(self, **batch_options).run(requests, custom_ids)
+        else:
+            iterator = self._iter_many(requests, concurrency)
+        
+        if as_completed:
+            return iterator
+        
+        results = [None] * len(requests)
+        for result in iterator:
+            results[result.index] = result
+        return results
+    
+    def _iter_many(self, requests, concurrency):
+        """Yield SendResults in completion order"""
+        pool = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        try:
+            futures = [
+                pool.submit(self._send_one, index, request)
+                for index, request in enumerate(requests)
+            ]
+            for future in futures_as_completed(futures):
+                yield future.result()
+        finally:
+            # A caller that stops iterating early must not send the rest
+            pool.shutdown(wait=False, cancel_futures=True)
+    
+    def _session_history(self, session_id):
+        if self.sessions is None:
+            raise ValueError("chat(session_id=...) needs a client created with sessions=SessionStore(...)")
+        return self.sessions.get(session_id)
+    
+    def _budgeted_history(self, history, compact):
+        """Keep a running token total for history when something reads it
+        
+        Compaction keeps per-history state and token totals, and a context
+        budget reads the total instead of re-estimating every message. A
+        plain list is still appended to in place, its total kept beside it
+        (see tokens.history_tally); another sequence being compacted, such
+        as a MessageStore, is copied into an editable BudgetedHistory.
+        """
+        if isinstance(history, BudgetedHistory):
+            return history
+        estimator = self.context_budget.estimator if self.context_budget is not None else None
+        if type(history) is list:
+            if compact or self.context_budget is not None:
+                history_tally(history, estimator)
+            return history
+        if compact:
+            return BudgetedHistory(history, estimator=estimator)
+        return history
+    
+    def chat(self, user_message, conversation_history=None, system=None, session_id=None):
+        """Simple chat interface
+        
+        With session_id the history is kept in the client's SessionStore
+        instead of being passed in and out.
+        """
+        if session_id is not None:
+            conversation_history = self._session_history(session_id)
         if conversation_history is None:
             conversation_history = []
         
-        conversation_history.append({
+        # A History is immutable, so it is never compacted in place
+        compact = self.compaction is not None and not isinstance(conversation_history, History)
+        conversation_history = self._budgeted_history(conversation_history, compact)
+        if compact:
+            self.compaction.apply(conversation_history)
+        
+        conversation_history = append_message(conversation_history, {
             "role": "user",
             "content": user_message
         })
@@ -41,9 +412,14 @@ class ClaudeClient:
         response = self.send_message(conversation_history, system=system)
         assistant_message = response.content[0].text
         
-        conversation_history.append({
+        conversation_history = append_message(conversation_history, {
             "role": "assistant",
             "content": assistant_message
         })
         
+        if compact:
+            self.compaction.schedule(self, conversation_history)
+        if session_id is not None:
+            self.sessions.save(session_id, conversation_history)
+        
         return assistant_message, conversation_history
@@ -0,0 +1,87 @@
+"""Single-flight coalescing of identical in-flight requests"""
+import asyncio
+import threading
+
+class _Call:
+    """An in-flight call that other threads can wait on"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class RequestCoalescer:
+    """Lets identical concurrent requests share one upstream call
+    
+    The first caller for a key (the leader) runs the request; callers that
+    arrive with the same key while it is in flight wait for and receive the
+    leader's result, or its exception. Nothing is kept once the call
+    finishes, so this complements rather than replaces a response cache.
+    Threaded callers use call(); asyncio callers use acall().
+    """
+    
+    def __init__(self):
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+    
+    def call(self, key, fn):
+        """Run fn() for key, or wait for the identical call already running"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+    
+    async def acall(self, key, fn):
+        """Await fn() for key, or the identical call already running
+        
+        fn must return an awaitable. Tasks are tracked per event loop, and a
+        waiter being cancelled does not cancel the shared call.
+        """
+        task_key = (asyncio.get_running_loop(), key)
+        with self._lock:
+            task = self._tasks.get(task_key)
+            if task is not None:
+                self.coalesced += 1
+            else:
+                task = self._tasks[task_key] = asyncio.ensure_future(fn())
+                task.add_done_callback(lambda _: self._forget(task_key))
+                self.leaders += 1
+        return await asyncio.shield(task)
+    
+    def _forget(self, task_key):
+        with self._lock:
+            self._tasks.pop(task_key, None)
+    
+    def stats(self):
+        """Leader and coalesced call counts"""
+        total = self.leaders + self.coalesced
+        return {
+            "upstream_calls": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": self.coalesced / total if total else 0.0
+        }
@@ -0,0 +1,190 @@
+"""Incremental conversation compaction via background summarization"""
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .tokens import history_tally, starts_turn
+from .utils import to_jsonable
+
+SUMMARY_SYSTEM = (
+    "You condense conversation transcripts. Keep facts, decisions, open "
+    "questions, tool results and user preferences; drop pleasantries."
+)
+SUMMARY_PROMPT = "Summarize this earlier part of our conversation:\n\n"
+SUMMARY_PREFIX = "[Summary of earlier conversation]\n"
+
+def render_transcript(messages):
+    """Plain-text transcript of messages, including tool calls and results"""
+    lines = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            lines.append(f"{message['role']}: {content}")
+            continue
+        for block in content:
+            block = to_jsonable(block)
+            kind = block.get("type")
+            if kind == "text":
+                lines.append(f"{message['role']}: {block['text']}")
+            elif kind == "tool_use":
+                lines.append(f"{message['role']} called {block['name']}({json.dumps(block['input'])})")
+            elif kind == "tool_result":
+                result = block.get("content")
+                if not isinstance(result, str):
+                    result = render_transcript([{"role": "tool", "content": result or []}])
+                lines.append(f"tool result: {result}")
+    return "\n".join(lines)
+
+def merge_summary(summary_text, message):
+    """The user turn `message` with the summary placed ahead of its content"""
+    text = SUMMARY_PREFIX + summary_text
+    content = message["content"]
+    if isinstance(content, str):
+        content = f"{text}\n\n{content}"
+    else:
+        content = [{"type": "text", "text": text}, *content]
+    return {"role": "user", "content": content}
+
+class _Job:
+    """A summary being computed for history[start:stop]; history[stop] is kept"""
+    
+    def __init__(self, start, stop, boundary, tokens):
+        self.start = start
+        self.stop = stop
+        self.boundary = boundary
+        self.tokens = tokens
+        self.future = None
+
+class CompactionPolicy:
+    """Replaces older turns with a model-written summary once history grows
+    
+    After a chat() turn pushes the history past `threshold` estimated
+    tokens, a summary of everything except the first `pinned` messages and
+    the most recent `keep_recent` messages is requested in the background.
+    The current turn isn't delayed; the summary is swapped in before the
+    next request, at the start of the first user turn kept, so roles
+    still alternate. Both ends of the summarized range are plain user
+    turns, so tool_use / tool_result pairs are never split, even at the
+    edge of the pinned messages. The summary request goes straight to the
+    client's upstream path (lanes, hedging, breakers, key pool) under its
+    context budget, skipping the response caches, coalescer and router.
+    Token totals and the
+    pending summary are kept on the history's tally (see
+    tokens.history_tally), so token totals are already at hand.
+    """
+    
+    def __init__(self, threshold=50000, keep_recent=6, pinned=0,
+                 summary_model=None, summary_max_tokens=1024, max_workers=4):
+        self.threshold = threshold
+        self.keep_recent = keep_recent
+        self.pinned = pinned
+        self.summary_model = summary_model
+        self.summary_max_tokens = summary_max_tokens
+        self.compactions = 0
+        self.tokens_saved = 0
+        self.failures = 0
+        self._max_workers = max_workers
+        self._pool = None
+        self._lock = threading.Lock()
+    
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self._max_workers, thread_name_prefix="compaction"
+                )
+            return self._pool
+    
+    def _plan(self, history):
+        """Choose history[start:stop] to summarize, or None"""
+        tally = history_tally(history)
+        if getattr(tally, "compaction_job", None) is not None or tally.tokens <= self.threshold:
+            return None
+        last = len(history) - max(self.keep_recent, 1)
+        start = min(self.pinned, len(history))
+        while start < last and not starts_turn(history[start]):
+            start += 1
+        for stop in range(last, start + 1, -1):
+            if starts_turn(history[stop]):
+                tokens = sum(tally.message_tokens[start:stop])
+                return _Job(start, stop, history[stop], tokens)
+        return None
+    
+    def _summary_params(self, client, transcript):
+        # May raise ContextBudgetExceeded, so it runs inside the background job
+        params = client._prepare_params(
+            [{"role": "user", "content": SUMMARY_PROMPT + transcript}],
+            system=SUMMARY_SYSTEM
+        )
+        params["max_tokens"] = self.summary_max_tokens
+        if self.summary_model:
+            params["model"] = self.summary_model
+        return params
+    
+    def _summarize(self, client, transcript):
+        return client._call_upstream(self._summary_params(client, transcript))
+    
+    async def _summarize_async(self, client, transcript):
+        return await client._call_upstream(self._summary_params(client, transcript))
+    
+    def schedule(self, client, history):
+        """Start a background summary if the history has crossed the threshold"""
+        job = self._plan(history)
+        if job is None:
+            return
+        transcript = render_transcript(history[job.start:job.stop])
+        job.future = self._executor().submit(self._summarize, client, transcript)
+        history_tally(history).compaction_job = job
+    
+    def schedule_async(self, client, history):
+        """Asyncio variant of schedule() for AsyncClaudeClient"""
+        job = self._plan(history)
+        if job is None:
+            return
+        transcript = render_transcript(history[job.start:job.stop])
+        job.future = asyncio.ensure_future(self._summarize_async(client, transcript))
+        history_tally(history).compaction_job = job
+    
+    def apply(self, history):
+        """Swap in a finished summary; returns True if the history was compacted"""
+        tally = history_tally(history)
+        job = getattr(tally, "compaction_job", None)
+        if job is None or not job.future.done():
+            return False
+        tally.compaction_job = None
+        
+        if job.future.cancelled() or job.future.exception() is not None:
+            self.failures += 1
+            return False
+        if len(history) <= job.stop or history[job.stop] is not job.boundary:
+            return False
+        
+        response = job.future.result()
+        summary_text = "".join(b.text for b in response.content if b.type == "text")
+        before = tally.tokens
+        tally.replace_range(job.start, job.stop + 1, [merge_summary(summary_text, history[job.stop])])
+        saved = before - tally.tokens
+        
+        tally.compactions = getattr(tally, "compactions", 0) + 1
+        tally.tokens_saved = getattr(tally, "tokens_saved", 0) + saved
+        with self._lock:
+            self.compactions += 1
+            self.tokens_saved += saved
+        return True
+    
+    def stats(self):
+        return {
+            "compactions": self.compactions,
+            "tokens_saved": self.tokens_saved,
+            "failures": self.failures
+        }
+
+def session_stats(history):
+    """Compaction counters for one conversation history"""
+    tally = history_tally(history)
+    return {
+        "compactions": getattr(tally, "compactions", 0),
+        "tokens_saved": getattr(tally, "tokens_saved", 0),
+        "tokens": tally.tokens
+    }
@@ -6,9 +6,29 @@ load_dotenv()
 class Config:
     """Configuration management for Claude SDK"""
     
-    ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+    # Comma-separated pools for common.key_pool.KeyPool
+    ANTHROPIC_API_KEYS = [k.strip() for k in os.getenv("ANTHROPIC_API_KEYS", "").split(",") if k.strip()]
+    ANTHROPIC_BASE_URLS = [u.strip() for u in os.getenv("ANTHROPIC_BASE_URLS", "").split(",") if u.strip()]
+    
+    ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY") or next(iter(ANTHROPIC_API_KEYS), None)
     DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "claude-sonnet-4-20250514")
     MAX_TOKENS = int(os.getenv("MAX_TOKENS", "4096"))
+    RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH")
+    TOOL_CACHE_PATH = os.getenv("TOOL_CACHE_PATH")
+    
+    # Run agent tools in worker processes (see common.tool_sandbox)
+    TOOL_SANDBOX = os.getenv("TOOL_SANDBOX", "false").lower() == "true"
+    TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "10"))
+    
+    # Comma-separated models for common.routing.ModelCascade, fastest first
+    CASCADE_MODELS = [m.strip() for m in os.getenv("CASCADE_MODELS", "").split(",") if m.strip()]
+    
+    # Shared HTTP transport (see common.transport)
+    HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+    HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+    HTTP2 = os.getenv("HTTP2", "true").lower() == "true"
+    HTTP_WARMUP_CONNECTIONS = int(os.getenv("HTTP_WARMUP_CONNECTIONS", "0"))
     
     @classmethod
     def validate(cls):
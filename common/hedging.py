@@ -0,0 +1,182 @@
+"""Hedged requests to cut tail latency"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+class HedgingPolicy:
+    """Sends a backup request when the first one is slow and uses whichever wins
+    
+    The hedge fires after `delay` seconds, or when delay is None after the
+    observed `percentile` latency of recent successful requests (once
+    `min_samples` have been seen). Hedges are capped at `max_hedge_ratio`
+    of all requests so the extra load stays bounded. A hedge can target a
+    faster `hedge_model` instead of repeating the same request. The losing
+    asyncio task is cancelled; a losing thread's result is discarded.
+    
+    In run() the primary request gets a thread of its own, so concurrency
+    is not capped by a pool and the delay counts from when the request
+    actually starts; only hedges share the pool of max_workers threads.
+    A primary that loses to a hedge still has its latency recorded when it
+    finishes (arun() cancels it, and records the time it had run), so slow
+    requests keep their weight in the percentile.
+    """
+    
+    def __init__(self, delay=None, percentile=0.95, min_samples=20, window=1000,
+                 max_hedge_ratio=0.05, hedge_model=None, max_workers=32):
+        self.delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.hedge_model = hedge_model
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+        self._max_workers = max_workers
+        self._pool = None
+    
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None to not hedge"""
+        if self.delay is not None:
+            return self.delay
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))]
+    
+    def _start(self):
+        with self._lock:
+            self.requests += 1
+    
+    def _take_hedge(self):
+        """Reserve one hedge if the load cap allows it"""
+        with self._lock:
+            if self.hedges + 1 > self.max_hedge_ratio * self.requests:
+                return False
+            self.hedges += 1
+            return True
+    
+    def _observe(self, started):
+        with self._lock:
+            self.latencies.append(time.monotonic() - started)
+    
+    def _hedge_won(self):
+        with self._lock:
+            self.hedge_wins += 1
+    
+    def _hedge_params(self, params):
+        if self.hedge_model:
+            return {**params, "model": self.hedge_model}
+        return params
+    
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self._max_workers, thread_name_prefix="hedge"
+                )
+            return self._pool
+    
+    def _run_primary(self, call, params):
+        """Start call(params) on its own thread; returns its future and start time"""
+        primary = Future()
+        primary.set_running_or_notify_cancel()
+        started = []
+        began = threading.Event()
+        
+        def run_primary():
+            started.append(time.monotonic())
+            began.set()
+            try:
+                response = call(params)
+            except BaseException as e:
+                primary.set_exception(e)
+                return
+            # Recorded even if a hedge already won, so slow requests still count
+            self._observe(started[0])
+            primary.set_result(response)
+        
+        threading.Thread(target=run_primary, name="hedge-primary", daemon=True).start()
+        began.wait()
+        return primary, started[0]
+    
+    def run(self, call, params):
+        """Run call(params), hedging it if it outlives the hedge delay"""
+        self._start()
+        delay = self.hedge_delay()
+        
+        if delay is None:
+            started = time.monotonic()
+            response = call(params)
+            self._observe(started)
+            return response
+        
+        primary, started = self._run_primary(call, params)
+        done, _ = wait([primary], timeout=max(0.0, started + delay - time.monotonic()))
+        if done or not self._take_hedge():
+            return primary.result()
+        
+        hedge = self._executor().submit(call, self._hedge_params(params))
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._hedge_won()
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+        return primary.result()
+    
+    async def arun(self, call, params):
+        """Asyncio variant of run(); call(params) must return an awaitable"""
+        self._start()
+        started = time.monotonic()
+        delay = self.hedge_delay()
+        
+        if delay is None:
+            response = await call(params)
+            self._observe(started)
+            return response
+        
+        primary = asyncio.ensure_future(call(params))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done or not self._take_hedge():
+                response = await primary
+                self._observe(started)
+                return response
+            
+            hedge = asyncio.ensure_future(call(self._hedge_params(params)))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._hedge_won()
+                        if task is primary or primary in pending:
+                            # A primary that lost is cancelled below; it ran at least this long
+                            self._observe(started)
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    def stats(self):
+        """Hedge rate and win statistics"""
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_ratio": self.hedges / self.requests if self.requests else 0.0,
+            "hedge_win_ratio": self.hedge_wins / self.hedges if self.hedges else 0.0,
+            "current_delay": self.hedge_delay()
+        }
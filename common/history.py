@@ -0,0 +1,106 @@
+"""Persistent conversation history with structural sharing
+
+A History is an immutable linked list of messages, newest last. append()
+returns a new History that points at the old one, so forking a
+conversation (retries, what-if branches) is O(1) and every branch shares
+its common prefix: a thousand forks of a long history cost only their own
+suffixes. Messages are stored as read-only MessageStore records, so no
+branch can change a message another branch sees.
+"""
+from collections.abc import Sequence
+
+from .message_store import TextPool, compact_message
+
+class History(Sequence):
+    """Immutable message sequence; append() and extend() return new histories
+    
+    Iteration and len() are cheap; history[i] walks back from the newest
+    message, so it is O(len - i). history[:n] returns the ancestor holding
+    the first n messages without copying.
+    
+        base = History([{"role": "user", "content": "Plan a trip"}])
+        retry = base.append(first_reply)
+        what_if = base.append(other_reply)   # shares base with retry
+    """
+    
+    __slots__ = ("_parent", "_message", "_len", "pool")
+    
+    def __init__(self, messages=(), pool=None):
+        self._parent = None
+        self._message = None
+        self._len = 0
+        self.pool = pool if pool is not None else TextPool()
+        if messages:
+            tail = History(pool=self.pool).extend(messages)
+            self._parent, self._message, self._len = tail._parent, tail._message, tail._len
+    
+    @classmethod
+    def _node(cls, parent, message):
+        node = cls.__new__(cls)
+        node._parent = parent
+        node._message = message
+        node._len = parent._len + 1
+        node.pool = parent.pool
+        return node
+    
+    def append(self, message):
+        """New history with message added; self is unchanged"""
+        return self._node(self, compact_message(message, self.pool))
+    
+    def extend(self, messages):
+        """New history with messages added; self is unchanged"""
+        history = self
+        for message in messages:
+            history = history.append(message)
+        return history
+    
+    @property
+    def parent(self):
+        """History without the newest message"""
+        if self._len == 0:
+            raise IndexError("empty history has no parent")
+        return self._parent
+    
+    def _ancestor(self, length):
+        node = self
+        while node._len > length:
+            node = node._parent
+        return node
+    
+    def __len__(self):
+        return self._len
+    
+    def __iter__(self):
+        messages = [None] * self._len
+        node = self
+        while node._len:
+            messages[node._len - 1] = node._message
+            node = node._parent
+        return iter(messages)
+    
+    def __reversed__(self):
+        node = self
+        while node._len:
+            yield node._message
+            node = node._parent
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if start == 0 and step == 1:
+                return self._ancestor(max(stop, 0))
+            return tuple(self)[index]
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("history index out of range")
+        return self._ancestor(index + 1)._message
+    
+    def __copy__(self):
+        return self
+    
+    def __deepcopy__(self, memo):
+        return self
+    
+    def __repr__(self):
+        return f"History({self._len} messages)"
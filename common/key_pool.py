@@ -0,0 +1,305 @@
+"""Load balancing across several API keys and base URLs"""
+import threading
+import time
+from datetime import datetime, timezone
+
+import anthropic
+
+from .cache import stream_snapshot
+from .circuit_breaker import is_overload_error
+from .config import Config
+from .transport import get_registry
+
+def _seconds_until(reset):
+    """Seconds until an RFC 3339 reset timestamp from a rate-limit header"""
+    try:
+        reset_at = datetime.fromisoformat(reset.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    return max(0.0, (reset_at - datetime.now(timezone.utc)).total_seconds())
+
+class PoolMember:
+    """One API key / base URL pair with its health and throughput counters"""
+    
+    def __init__(self, api_key, base_url=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.outstanding = 0
+        self.requests = 0
+        self.completed = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.consecutive_errors = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.busy_time = 0.0
+        self.first_request_at = None
+        self._client = None
+        self._async_client = None
+    
+    @property
+    def name(self):
+        return f"...{self.api_key[-4:]}@{self.base_url or 'default'}"
+    
+    @property
+    def client(self):
+        """SDK client for this member on the shared transport"""
+        if self._client is None:
+            self._client = anthropic.Anthropic(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=get_registry().http_client()
+            )
+        return self._client
+    
+    @property
+    def async_client(self):
+        """Async SDK client for this member on the shared transport"""
+        if self._async_client is None:
+            self._async_client = anthropic.AsyncAnthropic(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=get_registry().async_http_client()
+            )
+        return self._async_client
+    
+    def healthy(self, now):
+        return self.ejected_until <= now
+    
+    def stats(self):
+        finished = self.completed + self.errors + self.cancelled
+        elapsed = time.monotonic() - self.first_request_at if self.first_request_at else 0.0
+        return {
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "completed": self.completed,
+            "errors": self.errors,
+            "cancelled": self.cancelled,
+            "ejections": self.ejections,
+            "ejected": self.ejected_until > time.monotonic(),
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "mean_latency": self.busy_time / finished if finished else 0.0,
+            # Completions per second of wall-clock time since the first request
+            "requests_per_second": self.completed / elapsed if elapsed else 0.0
+        }
+
+class KeyPool:
+    """Least-outstanding-requests balancing over API keys and base URLs
+    
+    Each request goes to the healthy member with the fewest requests in
+    flight. A member is ejected for `eject_seconds` after `eject_after`
+    consecutive overload/connection errors, until the reset time after a
+    429 or an exhausted rate-limit header, and for `auth_eject_seconds`
+    after an authentication error. If every member is ejected, the one
+    that recovers soonest is used anyway rather than failing.
+    """
+    
+    def __init__(self, members, eject_after=3, eject_seconds=30.0, auth_eject_seconds=3600.0):
+        if not members:
+            raise ValueError("KeyPool needs at least one member")
+        self.members = list(members)
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.auth_eject_seconds = auth_eject_seconds
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls, **options):
+        """Build a pool from Config.ANTHROPIC_API_KEYS and ANTHROPIC_BASE_URLS
+        
+        Keys and URLs are paired in order; a single key or URL is shared by
+        every member.
+        """
+        keys = Config.ANTHROPIC_API_KEYS or [Config.ANTHROPIC_API_KEY]
+        urls = Config.ANTHROPIC_BASE_URLS or [None]
+        if len(keys) == 1:
+            keys = keys * len(urls)
+        if len(urls) == 1:
+            urls = urls * len(keys)
+        if len(keys) != len(urls):
+            raise ValueError("ANTHROPIC_API_KEYS and ANTHROPIC_BASE_URLS must pair up")
+        return cls([PoolMember(key, url) for key, url in zip(keys, urls)], **options)
+    
+    def acquire(self):
+        """Pick a member and count the request against it"""
+        with self._lock:
+            now = time.monotonic()
+            healthy = [member for member in self.members if member.healthy(now)]
+            if healthy:
+                member = min(healthy, key=lambda m: (m.outstanding, m.requests))
+            else:
+                member = min(self.members, key=lambda m: m.ejected_until)
+            member.outstanding += 1
+            member.requests += 1
+            if member.first_request_at is None:
+                member.first_request_at = time.monotonic()
+            return member
+    
+    def _eject(self, member, seconds):
+        now = time.monotonic()
+        if member.healthy(now):
+            member.ejections += 1
+        member.ejected_until = max(member.ejected_until, now + seconds)
+    
+    def release(self, member, elapsed, response=None, error=None, cancelled=False):
+        """Finish a request, updating health and throughput counters
+        
+        A cancelled request (e.g. the losing side of a hedge) frees its
+        slot without counting as completed or as an error.
+        """
+        with self._lock:
+            member.outstanding -= 1
+            member.busy_time += elapsed
+            if cancelled:
+                member.cancelled += 1
+                return
+            if error is None:
+                member.completed += 1
+                member.consecutive_errors = 0
+                usage = getattr(response, "usage", None)
+                if usage is not None:
+                    member.input_tokens += usage.input_tokens
+                    member.output_tokens += usage.output_tokens
+                return
+            
+            member.errors += 1
+            if isinstance(error, anthropic.RateLimitError):
+                retry_after = error.response.headers.get("retry-after")
+                self._eject(member, float(retry_after) if retry_after else self.eject_seconds)
+            elif isinstance(error, (anthropic.AuthenticationError, anthropic.PermissionDeniedError)):
+                self._eject(member, self.auth_eject_seconds)
+            elif is_overload_error(error):
+                member.consecutive_errors += 1
+                if member.consecutive_errors >= self.eject_after:
+                    member.consecutive_errors = 0
+                    self._eject(member, self.eject_seconds)
+    
+    def observe_headers(self, member, headers):
+        """Eject a member whose rate-limit headers report an exhausted budget"""
+        for bucket in ("requests", "input-tokens", "output-tokens", "tokens"):
+            if headers.get(f"anthropic-ratelimit-{bucket}-remaining") == "0":
+                seconds = _seconds_until(headers.get(f"anthropic-ratelimit-{bucket}-reset"))
+                with self._lock:
+                    self._eject(member, self.eject_seconds if seconds is None else seconds)
+                return
+    
+    def call(self, fn, params):
+        """Run fn(member, params) on the chosen member"""
+        member = self.acquire()
+        started = time.monotonic()
+        try:
+            response = fn(member, params)
+        except Exception as e:
+            self.release(member, time.monotonic() - started, error=e)
+            raise
+        except BaseException:
+            self.release(member, time.monotonic() - started, cancelled=True)
+            raise
+        self.release(member, time.monotonic() - started, response=response)
+        return response
+    
+    async def acall(self, fn, params):
+        """Asyncio variant of call(); fn(member, params) must return an awaitable"""
+        member = self.acquire()
+        started = time.monotonic()
+        try:
+            response = await fn(member, params)
+        except Exception as e:
+            self.release(member, time.monotonic() - started, error=e)
+            raise
+        except BaseException:
+            # asyncio.CancelledError, e.g. a hedge that lost the race
+            self.release(member, time.monotonic() - started, cancelled=True)
+            raise
+        self.release(member, time.monotonic() - started, response=response)
+        return response
+    
+    def stream(self, open_stream):
+        """Stream manager on the chosen member; open_stream(member) returns the SDK's"""
+        return PooledStreamManager(self, open_stream)
+    
+    def stats(self):
+        """Per-member health and throughput"""
+        with self._lock:
+            return {member.name: member.stats() for member in self.members}
+
+class PooledStreamManager:
+    """Holds a pool member for the life of a message stream
+    
+    Works as a sync or async context manager, matching what open_stream
+    returns (MessageStreamManager or AsyncMessageStreamManager). The
+    stream's rate-limit headers, or those of the error that refused it,
+    go to KeyPool.observe_headers like a regular request's.
+    """
+    
+    def __init__(self, pool, open_stream):
+        self._pool = pool
+        self._open_stream = open_stream
+        self._member = None
+        self._manager = None
+        self._stream = None
+        self._started = 0.0
+    
+    def _open(self):
+        self._member = self._pool.acquire()
+        self._started = time.monotonic()
+        try:
+            self._manager = self._open_stream(self._member)
+        except BaseException as e:
+            self._release(type(e), e)
+            raise
+    
+    def _release(self, exc_type, exc):
+        elapsed = time.monotonic() - self._started
+        if exc_type is None:
+            self._pool.release(self._member, elapsed, response=stream_snapshot(self._stream))
+        elif issubclass(exc_type, Exception):
+            self._pool.release(self._member, elapsed, error=exc)
+        else:
+            self._pool.release(self._member, elapsed, cancelled=True)
+    
+    def _observe(self, error=None):
+        """Pass the stream's response headers (or the error's) to the pool"""
+        response = getattr(error if error is not None else self._stream, "response", None)
+        headers = getattr(response, "headers", None)
+        if headers is not None:
+            self._pool.observe_headers(self._member, headers)
+    
+    def __enter__(self):
+        self._open()
+        try:
+            self._stream = self._manager.__enter__()
+        except BaseException as e:
+            if isinstance(e, anthropic.APIStatusError):
+                self._observe(e)
+            self._release(type(e), e)
+            raise
+        self._observe()
+        return self._stream
+    
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            return self._manager.__exit__(exc_type, exc, tb)
+        finally:
+            self._release(exc_type, exc)
+    
+    async def __aenter__(self):
+        self._open()
+        try:
+            self._stream = await self._manager.__aenter__()
+        except BaseException as e:
+            if isinstance(e, anthropic.APIStatusError):
+                self._observe(e)
+            self._release(type(e), e)
+            raise
+        self._observe()
+        return self._stream
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            return await self._manager.__aexit__(exc_type, exc, tb)
+        finally:
+            self._release(exc_type, exc)
@@ -0,0 +1,183 @@
+"""Compact, memory-efficient conversation history
+
+Messages are stored as __slots__ records instead of dicts or SDK pydantic
+models. Role and block type strings are interned and repeated text is
+stored once per TextPool. Records are read-only Mappings shaped exactly
+like Messages API params, so a MessageStore can be passed straight to
+send_message; nothing is copied into intermediate dicts on our side.
+"""
+import sys
+from collections.abc import Mapping, Sequence
+
+ROLES = {role: sys.intern(role) for role in ("user", "assistant")}
+
+class TextPool:
+    """Deduplicates text so identical strings share one object
+    
+    Share a pool between stores to deduplicate across sessions, e.g. a
+    system-like preamble or tool result repeated in many conversations.
+    A pool holds every text it has seen unless max_size bounds it; a
+    shared pool should be bounded, and the oldest texts are then dropped
+    from the pool (messages using them keep them alive).
+    """
+    
+    __slots__ = ("_texts", "min_length", "max_size")
+    
+    def __init__(self, min_length=16, max_size=None):
+        self._texts = {}
+        self.min_length = min_length
+        self.max_size = max_size
+    
+    def __call__(self, text):
+        if len(text) < self.min_length:
+            return sys.intern(text) if len(text) < 8 else text
+        pooled = self._texts.setdefault(text, text)
+        if self.max_size is not None and len(self._texts) > self.max_size:
+            self._texts.pop(next(iter(self._texts)), None)
+        return pooled
+    
+    def __len__(self):
+        return len(self._texts)
+
+class _Record(Mapping):
+    """Read-only Mapping over __slots__ fields; `type` is a class constant"""
+    
+    __slots__ = ()
+    type = None
+    _keys = ()
+    
+    def __getitem__(self, key):
+        if key == "type" and self.type is not None:
+            return self.type
+        if key in self.__slots__:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        raise KeyError(key)
+    
+    def __iter__(self):
+        for key in self._keys:
+            if key == "type" or getattr(self, key) is not None:
+                yield key
+    
+    def __len__(self):
+        return sum(1 for _ in self)
+    
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+class TextRecord(_Record):
+    __slots__ = ("text",)
+    type = "text"
+    _keys = ("type", "text")
+    
+    def __init__(self, text):
+        self.text = text
+
+class ToolUseRecord(_Record):
+    __slots__ = ("id", "name", "input")
+    type = "tool_use"
+    _keys = ("type", "id", "name", "input")
+    
+    def __init__(self, id, name, input):
+        self.id = id
+        self.name = name
+        self.input = input
+
+class ToolResultRecord(_Record):
+    __slots__ = ("tool_use_id", "content", "is_error")
+    type = "tool_result"
+    _keys = ("type", "tool_use_id", "content", "is_error")
+    
+    def __init__(self, tool_use_id, content, is_error=None):
+        self.tool_use_id = tool_use_id
+        self.content = content
+        self.is_error = is_error or None
+
+class MessageRecord(_Record):
+    __slots__ = ("role", "content")
+    _keys = ("role", "content")
+    
+    def __init__(self, role, content):
+        self.role = role
+        self.content = content
+
+def _field(block, name, default=None):
+    if isinstance(block, Mapping):
+        return block.get(name, default)
+    return getattr(block, name, default)
+
+def compact_block(block, pool):
+    """Record for a content block given as a dict or SDK model"""
+    if isinstance(block, _Record):
+        return block
+    kind = _field(block, "type")
+    if kind == "text" and not _field(block, "citations") and not _field(block, "cache_control"):
+        return TextRecord(pool(block["text"] if isinstance(block, Mapping) else block.text))
+    if kind == "tool_use" and not _field(block, "cache_control"):
+        return ToolUseRecord(_field(block, "id"), sys.intern(_field(block, "name")), _field(block, "input"))
+    if kind == "tool_result" and not _field(block, "cache_control"):
+        content = _field(block, "content")
+        if isinstance(content, str):
+            content = pool(content)
+        elif content is not None:
+            content = tuple(compact_block(item, pool) for item in content)
+        return ToolResultRecord(_field(block, "tool_use_id"), content, _field(block, "is_error"))
+    # Anything else (images, thinking, cache_control, ...) is kept verbatim
+    if hasattr(block, "model_dump"):
+        return block.model_dump(mode="json", exclude_none=True)
+    return block
+
+def compact_message(message, pool):
+    """MessageRecord for a message dict"""
+    if isinstance(message, MessageRecord):
+        return message
+    role = ROLES.get(message["role"]) or sys.intern(message["role"])
+    content = message["content"]
+    if isinstance(content, str):
+        content = pool(content)
+    else:
+        content = tuple(compact_block(block, pool) for block in content)
+    return MessageRecord(role, content)
+
+class MessageStore(Sequence):
+    """Conversation history of compact message records
+    
+    Append message dicts (including assistant turns whose content is the
+    SDK's response.content) and they are converted on the way in. The
+    store itself is the view handed to send_message.
+    """
+    
+    __slots__ = ("_messages", "pool")
+    
+    def __init__(self, messages=(), pool=None):
+        self._messages = []
+        self.pool = pool if pool is not None else TextPool()
+        self.extend(messages)
+    
+    def append(self, message):
+        self._messages.append(compact_message(message, self.pool))
+    
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+    
+    def pop(self, index=-1):
+        return self._messages.pop(index)
+    
+    def clear(self):
+        self._messages.clear()
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return MessageStore(self._messages[index], pool=self.pool)
+        return self._messages[index]
+    
+    def __len__(self):
+        return len(self._messages)
+    
+    def __iter__(self):
+        return iter(self._messages)
+    
+    def __repr__(self):
+        return f"MessageStore({len(self)} messages)"
@@ -0,0 +1,227 @@
+"""Priority lanes for sharing upstream capacity between kinds of traffic"""
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+class Lane:
+    """A named class of traffic with a scheduling weight and concurrency cap"""
+    
+    def __init__(self, name, weight=1, max_concurrency=None):
+        self.name = name
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.queue = deque()
+        self.in_flight = 0
+        self.granted = 0
+        self.vtime = 0.0
+        self.waits = deque(maxlen=1000)
+    
+    def can_run(self):
+        return bool(self.queue) and (
+            self.max_concurrency is None or self.in_flight < self.max_concurrency
+        )
+    
+    def stats(self):
+        waits = sorted(self.waits)
+        
+        def percentile(p):
+            return waits[min(len(waits) - 1, int(len(waits) * p))] if waits else 0.0
+        
+        return {
+            "in_flight": self.in_flight,
+            "queued": len(self.queue),
+            "granted": self.granted,
+            "average_wait": sum(waits) / len(waits) if waits else 0.0,
+            "p50_wait": percentile(0.5),
+            "p99_wait": percentile(0.99)
+        }
+
+class _Waiter:
+    """A queued request; grant() wakes it from any thread"""
+    
+    def __init__(self, loop=None):
+        self.enqueued = time.monotonic()
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+    
+    def grant(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+    
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+class PriorityDispatcher:
+    """Admits upstream calls by lane, within a shared concurrency limit
+    
+    When capacity frees up the next waiter is chosen by lane: in strict
+    mode the first lane listed always goes first; otherwise lanes share
+    capacity in proportion to their weights. A lane never exceeds its own
+    max_concurrency. Any request that has waited longer than `aging`
+    seconds goes next regardless of lane, so background work keeps moving
+    under sustained interactive load. Works for threads and asyncio tasks.
+    """
+    
+    def __init__(self, lanes, max_concurrency=16, strict=False, aging=10.0):
+        self.lanes = {lane.name: lane for lane in lanes}
+        self.order = [lane.name for lane in lanes]
+        self.max_concurrency = max_concurrency
+        self.strict = strict
+        self.aging = aging
+        self.in_flight = 0
+        self._vtime = 0.0
+        self._lock = threading.Lock()
+    
+    def _lane(self, name):
+        try:
+            return self.lanes[name]
+        except KeyError:
+            raise ValueError(f"unknown lane {name!r}; expected one of {self.order}") from None
+    
+    def _next_lane(self, now):
+        runnable = [self.lanes[name] for name in self.order if self.lanes[name].can_run()]
+        if not runnable:
+            return None
+        oldest = min(runnable, key=lambda lane: lane.queue[0].enqueued)
+        if now - oldest.queue[0].enqueued >= self.aging:
+            return oldest
+        if self.strict:
+            return runnable[0]
+        return min(runnable, key=lambda lane: lane.vtime)
+    
+    def _dispatch(self):
+        """Grant queued waiters while capacity allows; caller holds the lock"""
+        now = time.monotonic()
+        while self.in_flight < self.max_concurrency:
+            lane = self._next_lane(now)
+            if lane is None:
+                return
+            waiter = lane.queue.popleft()
+            self._start(lane, now - waiter.enqueued)
+            waiter.grant()
+    
+    def _start(self, lane, waited):
+        lane.in_flight += 1
+        lane.granted += 1
+        lane.waits.append(waited)
+        self._vtime = lane.vtime
+        lane.vtime += 1.0 / lane.weight
+        self.in_flight += 1
+    
+    def _enqueue(self, lane, loop=None):
+        """Start immediately if possible; otherwise return a queued waiter"""
+        with self._lock:
+            idle = not any(self.lanes[name].queue for name in self.order)
+            if idle and self.in_flight < self.max_concurrency and (
+                lane.max_concurrency is None or lane.in_flight < lane.max_concurrency
+            ):
+                lane.vtime = max(lane.vtime, self._vtime)
+                self._start(lane, 0.0)
+                return None
+            if not lane.queue:
+                lane.vtime = max(lane.vtime, self._vtime)
+            waiter = _Waiter(loop)
+            lane.queue.append(waiter)
+            self._dispatch()
+            return waiter
+    
+    def _cancel(self, lane, waiter):
+        """Withdraw a waiter, or give back its slot if it was granted meanwhile"""
+        with self._lock:
+            try:
+                lane.queue.remove(waiter)
+                return
+            except ValueError:
+                pass
+        self._release(lane)
+    
+    def _release(self, lane):
+        with self._lock:
+            lane.in_flight -= 1
+            self.in_flight -= 1
+            self._dispatch()
+    
+    @contextmanager
+    def slot(self, lane_name):
+        """Block until the lane may send a request, and hold that slot"""
+        lane = self._lane(lane_name)
+        waiter = self._enqueue(lane)
+        if waiter is not None:
+            waiter.event.wait()
+        try:
+            yield
+        finally:
+            self._release(lane)
+    
+    @asynccontextmanager
+    async def aslot(self, lane_name):
+        """Asyncio variant of slot()"""
+        lane = self._lane(lane_name)
+        waiter = self._enqueue(lane, asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                self._cancel(lane, waiter)
+                raise
+        try:
+            yield
+        finally:
+            self._release(lane)
+    
+    def stats(self):
+        """Queue time and throughput per lane"""
+        with self._lock:
+            return {name: self.lanes[name].stats() for name in self.order}
+
+class SlotStreamManager:
+    """Holds a dispatcher slot for the life of a message stream
+    
+    Works as a sync or async context manager, matching the stream manager
+    it wraps; the slot is taken before the request is sent and released
+    when the stream is closed.
+    """
+    
+    def __init__(self, dispatcher, lane_name, manager):
+        self._dispatcher = dispatcher
+        self._lane_name = lane_name
+        self._manager = manager
+        self._slot = None
+    
+    def __enter__(self):
+        self._slot = self._dispatcher.slot(self._lane_name)
+        self._slot.__enter__()
+        try:
+            return self._manager.__enter__()
+        except BaseException as e:
+            self._slot.__exit__(type(e), e, e.__traceback__)
+            raise
+    
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            return self._manager.__exit__(exc_type, exc, tb)
+        finally:
+            self._slot.__exit__(None, None, None)
+    
+    async def __aenter__(self):
+        self._slot = self._dispatcher.aslot(self._lane_name)
+        await self._slot.__aenter__()
+        try:
+            return await self._manager.__aenter__()
+        except BaseException as e:
+            await self._slot.__aexit__(type(e), e, e.__traceback__)
+            raise
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            return await self._manager.__aexit__(exc_type, exc, tb)
+        finally:
+            await self._slot.__aexit__(None, None, None)
@@ -0,0 +1,123 @@
+"""Automatic prompt-caching breakpoint placement"""
+import threading
+
+from .tool_registry import ToolSchemas
+from .utils import to_jsonable
+
+MAX_BREAKPOINTS = 4
+EPHEMERAL = {"type": "ephemeral"}
+
+def _mark_block(block):
+    """Copy of a content block with a cache breakpoint"""
+    block = dict(to_jsonable(block))
+    block["cache_control"] = EPHEMERAL
+    return block
+
+def _mark_content(content):
+    """Copy of message/system content with a breakpoint on its last block"""
+    if isinstance(content, str):
+        return [{"type": "text", "text": content, "cache_control": EPHEMERAL}]
+    content = list(content)
+    if content:
+        content[-1] = _mark_block(content[-1])
+    return content
+
+def _mark_tools(tools):
+    """Copy of a tools list with a breakpoint on its last schema
+    
+    A ToolSchemas keeps its marked copy (itself a ToolSchemas), so the
+    copy's cached JSON payload and the marked schema's identity carry over
+    from one request to the next.
+    """
+    marked = getattr(tools, "_marked", None)
+    if marked is not None:
+        return marked
+    marked = list(tools)
+    marked[-1] = _mark_block(marked[-1])
+    if isinstance(tools, ToolSchemas):
+        marked = ToolSchemas(marked)
+        tools._marked = marked
+    return marked
+
+class PromptCachePolicy:
+    """Places cache_control breakpoints on the stable prefix of a request
+    
+    The prefix order is tools, then system, then messages, so a breakpoint
+    on the last tool caches every tool schema, one on the system prompt
+    caches tools + system, and one on a user turn caches the conversation
+    up to that turn. The newest user turn is marked so the next request can
+    read it back; earlier user turns are marked too so that a read still
+    hits after the conversation grows past the 20-block lookback window.
+    Caller data is never mutated; marked messages are shallow copies.
+    
+    Per-call and total cache token counts are taken from response usage.
+    """
+    
+    def __init__(self, tools=True, system=True, turns=2):
+        self.tools = tools
+        self.system = system
+        self.turns = turns
+        self.last_usage = None
+        self.calls = 0
+        self.cache_read_input_tokens = 0
+        self.cache_creation_input_tokens = 0
+        self.input_tokens = 0
+        self._lock = threading.Lock()
+    
+    def apply(self, params):
+        """Return a copy of params with breakpoints inserted"""
+        params = dict(params)
+        budget = MAX_BREAKPOINTS
+        
+        if self.tools and params.get("tools"):
+            params["tools"] = _mark_tools(params["tools"])
+            budget -= 1
+        
+        if self.system and params.get("system"):
+            params["system"] = _mark_content(params["system"])
+            budget -= 1
+        
+        turns = min(self.turns, budget)
+        if turns > 0:
+            messages = list(params["messages"])
+            for index in range(len(messages) - 1, -1, -1):
+                if turns == 0:
+                    break
+                message = messages[index]
+                if message["role"] != "user" or not message["content"]:
+                    continue
+                messages[index] = {**message, "content": _mark_content(message["content"])}
+                turns -= 1
+            params["messages"] = messages
+        
+        return params
+    
+    def record(self, usage):
+        """Record the cache token counts reported for one call"""
+        if usage is None:
+            return
+        last = {
+            "input_tokens": usage.input_tokens or 0,
+            "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+            "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0
+        }
+        with self._lock:
+            self.last_usage = last
+            self.calls += 1
+            self.input_tokens += last["input_tokens"]
+            self.cache_read_input_tokens += last["cache_read_input_tokens"]
+            self.cache_creation_input_tokens += last["cache_creation_input_tokens"]
+    
+    def stats(self):
+        """Cache token totals across recorded calls"""
+        total_input = (
+            self.input_tokens + self.cache_read_input_tokens + self.cache_creation_input_tokens
+        )
+        return {
+            "calls": self.calls,
+            "input_tokens": self.input_tokens,
+            "cache_read_input_tokens": self.cache_read_input_tokens,
+            "cache_creation_input_tokens": self.cache_creation_input_tokens,
+            "cache_read_ratio": self.cache_read_input_tokens / total_input if total_input else 0.0,
+            "last_call": self.last_usage
+        }
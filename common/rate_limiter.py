@@ -0,0 +1,180 @@
+"""Adaptive client-side rate limiting driven by rate-limit response headers"""
+import asyncio
+import threading
+import time
+
+from .tokens import default_estimator
+
+HEADER_PREFIX = "anthropic-ratelimit-"
+BUCKETS = ("requests", "input_tokens", "output_tokens")
+
+class TokenBucket:
+    """Continuously refilling bucket sized as a per-minute limit
+    
+    reserve() deducts immediately, allowing the balance to go negative, and
+    returns how long the caller must wait for its share to refill. Later
+    callers queue behind earlier ones instead of racing for the same refill.
+    A bucket without a limit never waits.
+    """
+    
+    def __init__(self, limit_per_minute=None):
+        self.limit = limit_per_minute
+        self.tokens = float(limit_per_minute or 0)
+        self.updated = time.monotonic()
+    
+    def _refill(self, now):
+        if self.limit:
+            rate = self.limit / 60.0
+            self.tokens = min(self.limit, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+    
+    def reserve(self, amount, now):
+        """Deduct amount and return the wait in seconds before it is covered"""
+        self._refill(now)
+        if not self.limit:
+            return 0.0
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / (self.limit / 60.0)
+    
+    def adjust(self, amount, now):
+        """Return (positive) or charge (negative) tokens after the fact"""
+        self._refill(now)
+        if self.limit:
+            self.tokens = min(self.limit, self.tokens + amount)
+    
+    def sync(self, limit, remaining, now):
+        """Adopt the server's view of the limit and remaining budget"""
+        self._refill(now)
+        if limit is not None:
+            if not self.limit:
+                self.tokens = float(limit)
+            self.limit = limit
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining))
+
+class Reservation:
+    """Budget reserved for one request, settled against actual usage"""
+    
+    def __init__(self, input_tokens, output_tokens, wait):
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.wait = wait
+
+class RateLimiter:
+    """Token buckets for requests, input tokens and output tokens per minute
+    
+    Limits start from the arguments (None = unknown) and are then taken from
+    the anthropic-ratelimit-* headers of every response. Before dispatch the
+    request's input tokens are estimated and its output tokens are guessed
+    from a running average of observed usage capped at max_tokens; callers
+    sleep until all three buckets can cover the request. Thread-safe, and
+    the same instance can be used from threads and asyncio tasks.
+    """
+    
+    def __init__(self, requests_per_minute=None, input_tokens_per_minute=None,
+                 output_tokens_per_minute=None, estimate=default_estimator.request):
+        self.buckets = {
+            "requests": TokenBucket(requests_per_minute),
+            "input_tokens": TokenBucket(input_tokens_per_minute),
+            "output_tokens": TokenBucket(output_tokens_per_minute)
+        }
+        self.estimate = estimate
+        self.average_output_tokens = None
+        self.requests = 0
+        self.queued = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+    
+    def _reserve(self, params):
+        input_tokens = self.estimate(params)
+        output_tokens = params.get("max_tokens") or 0
+        
+        with self._lock:
+            if self.average_output_tokens is not None:
+                output_tokens = min(output_tokens, int(self.average_output_tokens) + 1)
+            now = time.monotonic()
+            wait = max(
+                self.buckets["requests"].reserve(1, now),
+                self.buckets["input_tokens"].reserve(input_tokens, now),
+                self.buckets["output_tokens"].reserve(output_tokens, now)
+            )
+            self.requests += 1
+            if wait > 0:
+                self.queued += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+        return Reservation(input_tokens, output_tokens, wait)
+    
+    def acquire(self, params):
+        """Block until the request fits the budget; returns a Reservation"""
+        reservation = self._reserve(params)
+        if reservation.wait > 0:
+            time.sleep(reservation.wait)
+        return reservation
+    
+    async def acquire_async(self, params):
+        """Asyncio variant of acquire()"""
+        reservation = self._reserve(params)
+        if reservation.wait > 0:
+            await asyncio.sleep(reservation.wait)
+        return reservation
+    
+    def settle(self, reservation, usage):
+        """Correct the reserved token counts with the response's usage"""
+        if usage is None:
+            return
+        input_tokens = (
+            usage.input_tokens
+            + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+        )
+        output_tokens = usage.output_tokens
+        
+        with self._lock:
+            now = time.monotonic()
+            self.buckets["input_tokens"].adjust(reservation.input_tokens - input_tokens, now)
+            self.buckets["output_tokens"].adjust(reservation.output_tokens - output_tokens, now)
+            if self.average_output_tokens is None:
+                self.average_output_tokens = float(output_tokens)
+            else:
+                self.average_output_tokens += 0.1 * (output_tokens - self.average_output_tokens)
+    
+    def update_from_headers(self, headers):
+        """Sync bucket limits and remaining budgets from response headers"""
+        with self._lock:
+            now = time.monotonic()
+            for name in BUCKETS:
+                prefix = HEADER_PREFIX + name.replace("_", "-")
+                limit = headers.get(prefix + "-limit")
+                remaining = headers.get(prefix + "-remaining")
+                if limit is None and remaining is None:
+                    continue
+                self.buckets[name].sync(
+                    int(limit) if limit is not None else None,
+                    int(remaining) if remaining is not None else None,
+                    now
+                )
+    
+    def stats(self):
+        """Queueing statistics and current bucket state"""
+        return {
+            "requests": self.requests,
+            "queued": self.queued,
+            "total_wait": self.total_wait,
+            "average_wait": self.total_wait / self.requests if self.requests else 0.0,
+            "max_wait": self.max_wait,
+            "limits": {name: bucket.limit for name, bucket in self.buckets.items()}
+        }
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_rate_limiter():
+    """The process-wide RateLimiter"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
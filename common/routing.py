@@ -0,0 +1,141 @@
+"""Model cascade routing: try a fast model first, escalate on demand"""
+import threading
+import time
+
+DEFAULT_UNSURE_PHRASES = (
+    "i'm not sure",
+    "i am not sure",
+    "i don't know",
+    "i do not know",
+    "i cannot determine",
+    "unclear",
+)
+
+def response_text(response):
+    return "".join(block.text for block in response.content if block.type == "text")
+
+def escalate_on_max_tokens(params, response):
+    """Escalate when the answer was cut off"""
+    return response.stop_reason == "max_tokens"
+
+def low_confidence(phrases=DEFAULT_UNSURE_PHRASES):
+    """Escalate when the answer hedges with one of `phrases`"""
+    phrases = tuple(phrase.lower() for phrase in phrases)
+    
+    def rule(params, response):
+        text = response_text(response).lower()
+        return any(phrase in text for phrase in phrases)
+    
+    return rule
+
+def invalid_output(validator):
+    """Escalate when validator(text) returns False or raises"""
+    def rule(params, response):
+        if response.stop_reason == "tool_use":
+            return False
+        try:
+            return not validator(response_text(response))
+        except Exception:
+            return True
+    
+    return rule
+
+def tools_start_at(tier):
+    """Route requests that carry tools straight to `tier`"""
+    def route(params):
+        return tier if params.get("tools") else 0
+    
+    return route
+
+class ModelCascade:
+    """Routes each request up an ordered list of models, fastest first
+    
+    `route(params)` may pick the starting tier before anything is sent.
+    After each response the escalation `rules` run in-process; if any of
+    them returns True the request is retried on the next model. The last
+    model's response is always accepted. No extra model calls are made
+    unless a request escalates.
+    """
+    
+    def __init__(self, models, rules=(escalate_on_max_tokens,), route=None):
+        if not models:
+            raise ValueError("ModelCascade needs at least one model")
+        self.models = list(models)
+        self.rules = list(rules)
+        self.route = route
+        self.served = [0] * len(self.models)
+        self.escalated = [0] * len(self.models)
+        self.latency = [0.0] * len(self.models)
+        self.calls = [0] * len(self.models)
+        self._lock = threading.Lock()
+    
+    def _start_tier(self, params):
+        if self.route is None:
+            return 0
+        return max(0, min(len(self.models) - 1, self.route(params)))
+    
+    def _should_escalate(self, tier, params, response):
+        if tier == len(self.models) - 1:
+            return False
+        return any(rule(params, response) for rule in self.rules)
+    
+    def _observe(self, tier, elapsed, escalate):
+        with self._lock:
+            self.calls[tier] += 1
+            self.latency[tier] += elapsed
+            if escalate:
+                self.escalated[tier] += 1
+            else:
+                self.served[tier] += 1
+    
+    def run(self, call, params):
+        """Send params via call(params) on each tier until a response is accepted"""
+        for tier in range(self._start_tier(params), len(self.models)):
+            tier_params = {**params, "model": self.models[tier]}
+            started = time.monotonic()
+            response = call(tier_params)
+            escalate = self._should_escalate(tier, tier_params, response)
+            self._observe(tier, time.monotonic() - started, escalate)
+            if not escalate:
+                return response
+    
+    async def arun(self, call, params):
+        """Asyncio variant of run(); call(params) must return an awaitable"""
+        for tier in range(self._start_tier(params), len(self.models)):
+            tier_params = {**params, "model": self.models[tier]}
+            started = time.monotonic()
+            response = await call(tier_params)
+            escalate = self._should_escalate(tier, tier_params, response)
+            self._observe(tier, time.monotonic() - started, escalate)
+            if not escalate:
+                return response
+    
+    def stats(self):
+        """Share of traffic served per tier and estimated latency saved
+        
+        Savings compare each response served below the top tier with the
+        top tier's observed average latency; escalations count against it.
+        """
+        with self._lock:
+            total = sum(self.served)
+            averages = [
+                latency / calls if calls else None
+                for latency, calls in zip(self.latency, self.calls)
+            ]
+            top = averages[-1]
+            saved = 0.0
+            if top is not None:
+                for tier in range(len(self.models) - 1):
+                    saved += self.served[tier] * top - self.latency[tier]
+            return {
+                "tiers": {
+                    model: {
+                        "served": self.served[tier],
+                        "share": self.served[tier] / total if total else 0.0,
+                        "escalated": self.escalated[tier],
+                        "average_latency": averages[tier]
+                    }
+                    for tier, model in enumerate(self.models)
+                },
+                "estimated_latency_saved": saved if top is not None else None
+            }
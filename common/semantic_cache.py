@@ -0,0 +1,206 @@
+"""Approximate response cache for near-duplicate prompts
+
+Prompts are normalized (case, whitespace, sentence punctuation), split
+into character shingles and reduced to a MinHash signature. Numbers and
+symbols such as operators must match exactly, since a one-character
+change there changes the question. A banded LSH index
+finds candidates in O(bands) dict lookups regardless of how many entries
+are stored, and the best candidate is returned when its estimated Jaccard
+similarity clears the threshold. Uses NumPy when available and falls back
+to pure Python otherwise.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only without NumPy
+    np = None
+
+from .utils import to_jsonable
+
+_MASK64 = (1 << 64) - 1
+# Sentence punctuation only; a '.' or ',' inside a number is kept
+_PUNCTUATION = re.compile(r"[!?;:'\"]+|[.,](?!\d)")
+_WHITESPACE = re.compile(r"\s+")
+_EXACT = re.compile(r"\d+(?:[.,]\d+)*|[^\w\s]")
+
+def normalize_text(text):
+    """Lowercase, drop sentence punctuation and collapse whitespace"""
+    text = _PUNCTUATION.sub(" ", text.lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+def prompt_text(messages):
+    """Flatten text-only messages into one string, or None if not text-only"""
+    parts = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            parts.append(f"{message['role']}: {content}")
+            continue
+        for block in to_jsonable(content):
+            if block.get("type") != "text":
+                return None
+            parts.append(f"{message['role']}: {block['text']}")
+    return "\n".join(parts)
+
+class MinHasher:
+    """MinHash signatures over character shingles using multiply-shift hashing"""
+    
+    def __init__(self, num_perm=64, shingle_size=4, seed=1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = random.Random(seed)
+        self._a = [rng.getrandbits(64) | 1 for _ in range(num_perm)]
+        self._b = [rng.getrandbits(64) for _ in range(num_perm)]
+        if np is not None:
+            self._a_np = np.array(self._a, dtype=np.uint64)[:, None]
+            self._b_np = np.array(self._b, dtype=np.uint64)[:, None]
+    
+    def shingles(self, text):
+        k = self.shingle_size
+        if len(text) <= k:
+            return {text}
+        return {text[i:i + k] for i in range(len(text) - k + 1)}
+    
+    def signature(self, text):
+        """MinHash signature of normalized text as a tuple of ints"""
+        hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in self.shingles(text)]
+        
+        if np is not None:
+            values = np.array(hashes, dtype=np.uint64)[None, :]
+            with np.errstate(over="ignore"):
+                mixed = (self._a_np * values + self._b_np) >> np.uint64(32)
+            return tuple(mixed.min(axis=1).tolist())
+        
+        return tuple(
+            min(((a * h + b) & _MASK64) >> 32 for h in hashes)
+            for a, b in zip(self._a, self._b)
+        )
+
+class SemanticCache:
+    """Near-duplicate response cache backed by a banded MinHash LSH index
+    
+    Only requests without tools are eligible. The model, max_tokens,
+    system prompt and the numbers and symbols in the messages must match
+    exactly; only the rest of the message text is compared approximately.
+    With the defaults (64 permutations in 8 bands of 8 rows) pairs above
+    roughly 0.77 Jaccard similarity become candidates. The oldest entries
+    are evicted past max_size (None for unbounded).
+    """
+    
+    def __init__(self, threshold=0.8, num_perm=64, bands=8, shingle_size=4,
+                 max_size=1024, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_size = max_size
+        self.hasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size, seed=seed)
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def _context(self, params):
+        """Exact-match part of the request, or None if not eligible"""
+        if params.get("tools"):
+            return None
+        text = prompt_text(params["messages"])
+        if text is None:
+            return None
+        text = normalize_text(text)
+        context = json.dumps(
+            [params.get("model"), params.get("max_tokens"), to_jsonable(params.get("system")),
+             _EXACT.findall(text)],
+            sort_keys=True
+        )
+        return hashlib.sha1(context.encode("utf-8")).hexdigest(), text
+    
+    def _bucket_keys(self, context, signature):
+        rows = self.rows
+        return [
+            hash((context, band, signature[band * rows:(band + 1) * rows]))
+            for band in range(self.bands)
+        ]
+    
+    def _similarity(self, a, b):
+        return sum(x == y for x, y in zip(a, b)) / len(a)
+    
+    def get(self, params):
+        """Return a cached response for a near-duplicate request, or None"""
+        eligible = self._context(params)
+        if eligible is None:
+            return None
+        context, text = eligible
+        signature = self.hasher.signature(text)
+        
+        best, best_score = None, self.threshold
+        with self._lock:
+            seen = set()
+            for bucket_key in self._bucket_keys(context, signature):
+                for entry_id in self._buckets.get(bucket_key, ()):
+                    if entry_id in seen:
+                        continue
+                    seen.add(entry_id)
+                    entry_context, entry_signature, response, _ = self._entries[entry_id]
+                    if entry_context != context:
+                        continue
+                    score = self._similarity(signature, entry_signature)
+                    if score >= best_score:
+                        best, best_score = response, score
+            
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best
+    
+    def set(self, params, response):
+        """Index a response under the request's prompt signature"""
+        eligible = self._context(params)
+        if eligible is None:
+            return
+        context, text = eligible
+        signature = self.hasher.signature(text)
+        bucket_keys = self._bucket_keys(context, signature)
+        
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (context, signature, response, bucket_keys)
+            for bucket_key in bucket_keys:
+                # Dicts keep insertion order and make eviction O(1) per band
+                self._buckets.setdefault(bucket_key, {})[entry_id] = None
+            
+            while self.max_size is not None and len(self._entries) > self.max_size:
+                self._evict_oldest()
+    
+    def _evict_oldest(self):
+        entry_id, (_, _, _, bucket_keys) = self._entries.popitem(last=False)
+        for bucket_key in bucket_keys:
+            bucket = self._buckets[bucket_key]
+            del bucket[entry_id]
+            if not bucket:
+                del self._buckets[bucket_key]
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def stats(self):
+        """Hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._entries)
+        }
@@ -0,0 +1,165 @@
+"""Incremental JSON encoding of Messages API request bodies
+
+The SDK copies and re-encodes the whole request on every call, so over a
+growing conversation the encoding cost is quadratic. RequestEncoder keeps
+the encoded JSON of each message and tool it has seen, keyed by object
+identity, and builds the body by joining cached fragments; only turns it
+has not seen before (normally the newest one or two) are encoded. For
+each array it also remembers the last encoded prefix and how much of it
+was itself reused. Between requests a history changes near its end (new
+turns, prompt-cache copies of the last few), so only the items after that
+settled run are compared, plus a walk back past any cut before it; a turn
+costs a few identity comparisons plus a copy of the settled messages'
+bytes, however long the history.
+
+Messages are treated as settled once sent: to change one, replace it in
+the history rather than mutating it in place, and replace or drop the
+messages after it too (compaction shortens the history, which does).
+Swapping a settled message for another while the one before the end of
+the settled run stays in place is not noticed. MessageStore records and
+prompt-cache copies already work this way.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised only without orjson
+    orjson = None
+
+from .utils import to_jsonable
+
+def dumps(value):
+    """Compact UTF-8 JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+def loads(data):
+    """Parse JSON bytes or text, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class RequestEncoder:
+    """Builds request bodies from cached per-message and per-tool JSON
+    
+    At most max_entries fragments and max_prefixes array prefixes (one per
+    live conversation, roughly) are kept, least recently used dropped
+    first. Entries hold references to their objects so the ids they are
+    keyed by cannot be reused while the entry is alive.
+    """
+    
+    ARRAYS = ("messages", "tools", "system")
+    
+    def __init__(self, max_entries=4096, max_prefixes=64):
+        self.max_entries = max_entries
+        self.max_prefixes = max_prefixes
+        self._fragments = OrderedDict()
+        self._prefixes = OrderedDict()
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.encoded = 0
+    
+    def _fragment(self, item):
+        key = id(item)
+        with self._lock:
+            entry = self._fragments.get(key)
+            if entry is not None and entry[0] is item:
+                self._fragments.move_to_end(key)
+                self.reused += 1
+                return entry[1]
+        
+        fragment = dumps(to_jsonable(item))
+        with self._lock:
+            self._fragments[key] = (item, fragment)
+            self._fragments.move_to_end(key)
+            self.encoded += 1
+            while len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+        return fragment
+    
+    def _array(self, items):
+        """Parts encoding items (without brackets), reusing the longest
+        cached run of identical leading items; also returns the end offset
+        of each item and the run's length so the result can be stored as
+        the next prefix
+        """
+        items = list(items)
+        if not items:
+            return items, [], [], 0
+        with self._lock:
+            prefix = self._prefixes.get(id(items[0]))
+        
+        shared, parts, ends = 0, [], []
+        if prefix is not None and prefix[0][0] is items[0]:
+            cached, limit = prefix[0], min(len(prefix[0]), len(items))
+            # Items that were already reused last time are taken as settled:
+            # walk back from there past any cut (compaction), then forward
+            # over the newer items (the last turns and prompt-cache copies)
+            shared = start = min(prefix[3], limit)
+            while shared and items[shared - 1] is not cached[shared - 1]:
+                shared -= 1
+            if shared == start:
+                while shared < limit and items[shared] is cached[shared]:
+                    shared += 1
+            ends = prefix[1][:shared]
+            parts.append(prefix[2][:ends[-1]])
+            with self._lock:
+                self.reused += shared
+        
+        offset = ends[-1] if ends else 0
+        for item in items[shared:]:
+            fragment = self._fragment(item)
+            if offset:
+                fragment = b"," + fragment
+            parts.append(fragment)
+            offset += len(fragment)
+            ends.append(offset)
+        return items, ends, parts, shared
+    
+    def encode(self, params):
+        """JSON bytes for a messages request, equal to encoding params whole"""
+        parts = [b"{"]
+        length = 1
+        arrays = []
+        for name, value in params.items():
+            head = (b"," if length > 1 else b"") + dumps(name) + b":"
+            if name in self.ARRAYS and not isinstance(value, str):
+                items, ends, array_parts, shared = self._array(value)
+                parts += [head, b"["] + array_parts + [b"]"]
+                arrays.append((items, ends, length + len(head) + 1, shared))
+                length += len(head) + (ends[-1] if ends else 0) + 2
+            else:
+                encoded = dumps(to_jsonable(value))
+                parts += [head, encoded]
+                length += len(head) + len(encoded)
+        parts.append(b"}")
+        body = b"".join(parts)
+        
+        # Later requests slice their shared prefix out of this body, uncopied
+        view = memoryview(body)
+        with self._lock:
+            for items, ends, start, shared in arrays:
+                # A one-item array (a marked system prompt copy) has no prefix to share
+                if len(items) < 2:
+                    continue
+                key = id(items[0])
+                self._prefixes[key] = (items, ends, view[start:start + ends[-1]], shared)
+                self._prefixes.move_to_end(key)
+            while len(self._prefixes) > self.max_prefixes:
+                self._prefixes.popitem(last=False)
+        return body
+    
+    def stats(self):
+        """Fragment reuse across encoded requests"""
+        total = self.reused + self.encoded
+        return {
+            "entries": len(self._fragments),
+            "prefixes": len(self._prefixes),
+            "reused": self.reused,
+            "encoded": self.encoded,
+            "reuse_ratio": self.reused / total if total else 0.0,
+            "backend": "orjson" if orjson is not None else "json"
+        }
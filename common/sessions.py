@@ -0,0 +1,151 @@
+"""Conversation histories by session id, for servers with many chats
+
+Hot sessions stay in an in-memory LRU; every message is also written
+through to an append-only SQLite log as soon as its turn is saved, so
+evicting a session costs nothing and memory stays bounded by max_sessions
+however many sessions exist. A cold session is reloaded with one range
+scan of its rows (the table is clustered by session and sequence).
+"""
+import operator
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .message_store import MessageStore, TextPool
+from .serialization import dumps, loads
+from .utils import to_jsonable
+
+class _Session:
+    __slots__ = ("history", "persisted")
+    
+    def __init__(self, history, persisted):
+        self.history = history
+        # Messages as of the last save, to find what changed since
+        self.persisted = persisted
+
+class SessionStore:
+    """LRU of hot histories over an on-disk message log
+    
+    get() returns the history for a session id (a MessageStore, or the
+    history last saved for it while it stays hot); save() appends the
+    messages added since the previous save. If earlier messages were
+    replaced (e.g. by compaction) the log is rewritten from the first
+    changed message on.
+    
+    Each loaded session gets its own TextPool, freed with the session on
+    eviction. Pass a bounded `pool` (TextPool(max_size=...)) to
+    deduplicate text across sessions instead.
+    """
+    
+    def __init__(self, path, max_sessions=1024, pool=None):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.pool = pool
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_messages ("
+                "session_id TEXT NOT NULL, seq INTEGER NOT NULL, message BLOB NOT NULL, "
+                "PRIMARY KEY (session_id, seq)) WITHOUT ROWID"
+            )
+        self.memory_hits = 0
+        self.disk_loads = 0
+        self.created = 0
+        self.load_seconds = 0.0
+    
+    def get(self, session_id):
+        """History for session_id, reloading it from disk if it went cold"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                self.memory_hits += 1
+                return session.history
+        
+        start = time.perf_counter()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT message FROM session_messages WHERE session_id = ? ORDER BY seq",
+                (session_id,)
+            ).fetchall()
+        pool = self.pool if self.pool is not None else TextPool()
+        history = MessageStore((loads(row[0]) for row in rows), pool=pool)
+        
+        with self._lock:
+            if rows:
+                self.disk_loads += 1
+                self.load_seconds += time.perf_counter() - start
+            else:
+                self.created += 1
+            # Another thread may have loaded it meanwhile; keep theirs
+            session = self._sessions.setdefault(session_id, _Session(history, list(history)))
+            self._sessions.move_to_end(session_id)
+            self._evict()
+            return session.history
+    
+    def save(self, session_id, history):
+        """Persist messages added to history since the last save and keep it hot"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+        persisted = session.persisted if session is not None else self._persisted(session_id)
+        
+        matches = list(map(operator.is_, persisted, history))
+        keep = matches.index(False) if False in matches else len(matches)
+        rows = [
+            (session_id, seq, dumps(to_jsonable(history[seq])))
+            for seq in range(keep, len(history))
+        ]
+        
+        with self._lock:
+            with self._conn:
+                if keep < len(persisted):
+                    self._conn.execute(
+                        "DELETE FROM session_messages WHERE session_id = ? AND seq >= ?",
+                        (session_id, keep)
+                    )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO session_messages (session_id, seq, message) VALUES (?, ?, ?)",
+                    rows
+                )
+            self._sessions[session_id] = _Session(history, list(history))
+            self._sessions.move_to_end(session_id)
+            self._evict()
+    
+    def _persisted(self, session_id):
+        # A cold session saved without get(): compare against nothing, so
+        # everything is rewritten
+        with self._lock:
+            count = self._conn.execute(
+                "SELECT COUNT(*) FROM session_messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+        return [None] * count
+    
+    def _evict(self):
+        # Every message is already on disk, so dropping a session is free
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+    
+    def delete(self, session_id):
+        """Forget a session in memory and on disk"""
+        with self._lock, self._conn:
+            self._sessions.pop(session_id, None)
+            self._conn.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+    
+    def stats(self):
+        """Hot-session counts and cold reload timing"""
+        return {
+            "hot_sessions": len(self._sessions),
+            "memory_hits": self.memory_hits,
+            "disk_loads": self.disk_loads,
+            "created": self.created,
+            "avg_load_ms": self.load_seconds / self.disk_loads * 1000 if self.disk_loads else 0.0
+        }
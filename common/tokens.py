@@ -0,0 +1,314 @@
+"""Local token estimation and context-window budgeting"""
+import json
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from .cache import request_key
+from .utils import to_jsonable
+
+MESSAGE_OVERHEAD = 4
+IMAGE_TOKENS = 1600
+DOCUMENT_TOKENS = 2000
+CONTEXT_WINDOW = 200000
+MAX_TALLIES = 256
+
+class ContextBudgetExceeded(ValueError):
+    """The request would not fit in the context window"""
+    
+    def __init__(self, estimated, limit):
+        self.estimated = estimated
+        self.limit = limit
+        super().__init__(f"estimated {estimated} input tokens exceeds budget of {limit}")
+
+class TokenEstimator:
+    """Fast character-based token estimate, optionally calibrated
+    
+    The estimate is len(text) / chars_per_token plus a small per-message
+    overhead. calibrate() compares it with the count_tokens endpoint and
+    nudges chars_per_token toward the observed ratio; endpoint results are
+    cached by request so repeated calibration is free.
+    """
+    
+    def __init__(self, chars_per_token=3.5):
+        self.chars_per_token = chars_per_token
+        self._counts = {}
+        self._lock = threading.Lock()
+        self.calibrations = 0
+    
+    def text(self, text):
+        return int(len(text) / self.chars_per_token) + 1
+    
+    def _block(self, block):
+        if not isinstance(block, Mapping):
+            block = to_jsonable(block)
+        kind = block.get("type")
+        if kind == "text":
+            return self.text(block["text"])
+        if kind == "image":
+            return IMAGE_TOKENS
+        if kind == "document":
+            return DOCUMENT_TOKENS
+        if kind == "tool_result":
+            return self.content(block.get("content") or "")
+        return self.text(json.dumps(block, default=str))
+    
+    def content(self, content):
+        if isinstance(content, str):
+            return self.text(content)
+        return sum(self._block(block) for block in content)
+    
+    def message(self, message):
+        """Estimated tokens for one message"""
+        return MESSAGE_OVERHEAD + self.content(message["content"])
+    
+    def messages(self, messages):
+        tally = tracked_tally(messages, self)
+        if tally is not None:
+            return tally.tokens
+        return sum(self.message(message) for message in messages)
+    
+    def request(self, params):
+        """Estimated input tokens for a whole request (system, tools, messages)"""
+        total = self.messages(params["messages"])
+        system = params.get("system")
+        if system:
+            total += self.content(system)
+        tools = params.get("tools")
+        if tools:
+            # A ToolRegistry payload carries its JSON already
+            payload = getattr(tools, "payload", None)
+            total += self.text(payload if payload is not None else json.dumps(to_jsonable(tools)))
+        return total
+    
+    def count_tokens(self, client, params):
+        """Exact count from the count_tokens endpoint, cached per request"""
+        fields = {key: params[key] for key in ("model", "messages", "system", "tools") if params.get(key)}
+        key = request_key(fields)
+        with self._lock:
+            if key in self._counts:
+                return self._counts[key]
+        count = client.messages.count_tokens(**fields).input_tokens
+        with self._lock:
+            self._counts[key] = count
+        return count
+    
+    def calibrate(self, client, params, weight=0.5):
+        """Move chars_per_token toward the ratio measured by count_tokens"""
+        estimated = self.request(params)
+        actual = self.count_tokens(client, params)
+        if actual > 0:
+            measured = self.chars_per_token * estimated / actual
+            self.chars_per_token += weight * (measured - self.chars_per_token)
+            self.calibrations += 1
+        return actual
+
+class BudgetedHistory(list):
+    """Conversation history list that keeps a running token estimate
+    
+    Behaves like the plain list ClaudeClient.chat() appends to, but
+    appending estimates only the new message, so the total stays O(1) to
+    read however long the conversation gets.
+    """
+    
+    def __init__(self, messages=(), estimator=None):
+        super().__init__()
+        self.estimator = estimator or default_estimator
+        self.message_tokens = []
+        self.tokens = 0
+        self.extend(messages)
+    
+    def append(self, message):
+        tokens = self.estimator.message(message)
+        super().append(message)
+        self.message_tokens.append(tokens)
+        self.tokens += tokens
+    
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+    
+    def __iadd__(self, messages):
+        self.extend(messages)
+        return self
+    
+    def pop(self, index=-1):
+        message = super().pop(index)
+        self.tokens -= self.message_tokens.pop(index)
+        return message
+    
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self._recount()
+    
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._recount()
+    
+    def insert(self, index, message):
+        super().insert(index, message)
+        self._recount()
+    
+    def remove(self, message):
+        super().remove(message)
+        self._recount()
+    
+    def clear(self):
+        super().clear()
+        self.message_tokens = []
+        self.tokens = 0
+    
+    def replace_range(self, start, stop, messages):
+        """Replace self[start:stop] with messages, re-estimating only those"""
+        tokens = [self.estimator.message(message) for message in messages]
+        super().__setitem__(slice(start, stop), messages)
+        self.tokens += sum(tokens) - sum(self.message_tokens[start:stop])
+        self.message_tokens[start:stop] = tokens
+    
+    def _recount(self):
+        self.message_tokens = [self.estimator.message(message) for message in self]
+        self.tokens = sum(self.message_tokens)
+    
+    def sync(self):
+        """Already current; for symmetry with TokenTally"""
+        return self
+
+class TokenTally:
+    """Running token estimate kept beside a plain history list
+    
+    The caller's list is left as it is and appended to in place; sync()
+    estimates only the messages appended since it last ran. A list changed
+    other than at its end (seen from its length and the identity of the
+    last counted message) is counted again from scratch. Compaction keeps
+    its per-history state here too.
+    """
+    
+    def __init__(self, history, estimator):
+        self.history = history
+        self.estimator = estimator
+        self.message_tokens = []
+        self.tokens = 0
+        self._last = None
+    
+    def sync(self):
+        """Count messages appended to the history since the last sync"""
+        history = self.history
+        counted = len(self.message_tokens)
+        if counted > len(history) or (counted and history[counted - 1] is not self._last):
+            self.message_tokens = []
+            self.tokens = 0
+            counted = 0
+        for message in history[counted:]:
+            tokens = self.estimator.message(message)
+            self.message_tokens.append(tokens)
+            self.tokens += tokens
+        self._last = history[-1] if history else None
+        return self
+    
+    def replace_range(self, start, stop, messages):
+        """Replace history[start:stop] with messages, re-estimating only those"""
+        self.sync()
+        tokens = [self.estimator.message(message) for message in messages]
+        self.history[start:stop] = messages
+        self.tokens += sum(tokens) - sum(self.message_tokens[start:stop])
+        self.message_tokens[start:stop] = tokens
+        self._last = self.history[-1] if self.history else None
+
+# Tallies for the most recently used plain-list histories, keyed by id;
+# entries hold their list so the id cannot be reused while they are alive
+_tallies = OrderedDict()
+_tallies_lock = threading.Lock()
+
+def history_tally(history, estimator=None):
+    """Current running token totals for a chat history
+    
+    A BudgetedHistory is its own tally. For a plain list, a TokenTally is
+    kept beside it for as long as it is one of the MAX_TALLIES most
+    recently used histories.
+    """
+    if isinstance(history, BudgetedHistory):
+        return history
+    key = id(history)
+    with _tallies_lock:
+        tally = _tallies.get(key)
+        if tally is None or tally.history is not history or (
+                estimator is not None and tally.estimator is not estimator):
+            tally = _tallies[key] = TokenTally(history, estimator or default_estimator)
+        _tallies.move_to_end(key)
+        while len(_tallies) > MAX_TALLIES:
+            _tallies.popitem(last=False)
+    return tally.sync()
+
+def tracked_tally(messages, estimator):
+    """The current tally of messages under estimator, or None if none is kept"""
+    if isinstance(messages, BudgetedHistory):
+        return messages if messages.estimator is estimator else None
+    with _tallies_lock:
+        tally = _tallies.get(id(messages))
+    if tally is None or tally.history is not messages or tally.estimator is not estimator:
+        return None
+    return tally.sync()
+
+def starts_turn(message):
+    """Whether a message can open the sent history: a user message that isn't tool results"""
+    if message["role"] != "user":
+        return False
+    content = message["content"]
+    if isinstance(content, str):
+        return True
+    return not any(to_jsonable(block).get("type") == "tool_result" for block in content)
+
+class ContextBudget:
+    """Checks a request against the context window before it is sent
+    
+    policy="reject" raises ContextBudgetExceeded; policy="trim" drops the
+    oldest turns (after the first `pinned` messages, which are always kept)
+    until the request fits. Trimming only cuts at a plain user message so
+    tool_use / tool_result pairs stay intact. The caller's list is never
+    modified; a trimmed copy is sent instead.
+    """
+    
+    def __init__(self, limit=None, policy="trim", pinned=0, estimator=None):
+        if policy not in ("reject", "trim"):
+            raise ValueError("policy must be 'reject' or 'trim'")
+        self.limit = limit
+        self.policy = policy
+        self.pinned = pinned
+        self.estimator = estimator or default_estimator
+        self.trimmed_messages = 0
+        self.rejected = 0
+    
+    def enforce(self, messages, system=None, tools=None, max_tokens=0):
+        """Return the messages to send, trimmed if needed"""
+        limit = self.limit if self.limit is not None else CONTEXT_WINDOW - max_tokens
+        fixed = self.estimator.request({"messages": [], "system": system, "tools": tools})
+        tally = tracked_tally(messages, self.estimator)
+        total = fixed + (tally.tokens if tally is not None else self.estimator.messages(messages))
+        if total <= limit:
+            return messages
+        
+        if self.policy == "reject":
+            self.rejected += 1
+            raise ContextBudgetExceeded(total, limit)
+        
+        if tally is not None:
+            sizes = tally.message_tokens
+        else:
+            sizes = [self.estimator.message(message) for message in messages]
+        
+        estimated = total
+        pinned = min(self.pinned, len(messages))
+        cut = None
+        for index in range(pinned, len(messages)):
+            if total <= limit and starts_turn(messages[index]):
+                cut = index
+                break
+            total -= sizes[index]
+        
+        if cut is None:
+            self.rejected += 1
+            raise ContextBudgetExceeded(estimated, limit)
+        self.trimmed_messages += cut - pinned
+        return list(messages[:pinned]) + list(messages[cut:])
+
+default_estimator = TokenEstimator()
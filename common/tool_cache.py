@@ -0,0 +1,161 @@
+"""Memoization of tool results across agent iterations and tasks"""
+import functools
+import hashlib
+import inspect
+import json
+import threading
+
+from .cache import DiskCache, MemoryCache
+
+def tool_key(name, function, args, kwargs):
+    """Canonical hash of a tool call: defaults applied, keys sorted"""
+    try:
+        bound = inspect.signature(function).bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = bound.arguments
+    except (TypeError, ValueError):
+        arguments = {"args": args, "kwargs": kwargs}
+    canonical = json.dumps(
+        arguments, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=repr
+    )
+    return f"tool:{name}:" + hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class _ToolEntry:
+    """Cache tiers and counters for one tool"""
+    
+    def __init__(self, ttl, max_size, cacheable, path):
+        self.cacheable = cacheable
+        self.memory = MemoryCache(max_size=max_size, ttl=ttl)
+        self.disk = DiskCache(path, ttl=ttl) if path and cacheable else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.uncached = 0
+
+class ToolCache:
+    """Memoizes tool functions by canonicalized arguments
+    
+    Each tool gets its own LRU tier (max_size entries, ttl seconds; None
+    keeps results until evicted) and, with `path`, a SQLite tier that
+    other processes can share. `tools` overrides the defaults per tool:
+    
+        ToolCache(ttl=300, tools={
+            "calculate": {"ttl": None},
+            "get_weather": {"ttl": 600},
+            "send_email": {"cacheable": False}
+        })
+    
+    Exceptions are never cached. Results that are not JSON-serializable
+    stay in memory only.
+    """
+    
+    def __init__(self, max_size=1024, ttl=300, path=None, tools=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.tools = tools or {}
+        self._entries = {}
+        self._lock = threading.Lock()
+    
+    def _entry(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                options = self.tools.get(name, {})
+                entry = _ToolEntry(
+                    ttl=options.get("ttl", self.ttl),
+                    max_size=options.get("max_size", self.max_size),
+                    cacheable=options.get("cacheable", True),
+                    path=self.path
+                )
+                self._entries[name] = entry
+            return entry
+    
+    def _count(self, entry, counter):
+        with self._lock:
+            setattr(entry, counter, getattr(entry, counter) + 1)
+    
+    def _lookup(self, entry, key):
+        """(True, result) on a hit, (False, None) on a miss"""
+        cached = entry.memory.get(key)
+        if cached is not None:
+            self._count(entry, "memory_hits")
+            return True, cached[0]
+        if entry.disk is not None:
+            value = entry.disk.get(key)
+            if value is not None:
+                result = json.loads(value)
+                entry.memory.set(key, (result,))
+                self._count(entry, "disk_hits")
+                return True, result
+        self._count(entry, "misses")
+        return False, None
+    
+    def _store(self, entry, key, result):
+        # Wrapped in a tuple so a None result is still a hit
+        entry.memory.set(key, (result,))
+        if entry.disk is not None:
+            try:
+                entry.disk.set(key, json.dumps(result, ensure_ascii=False))
+            except (TypeError, ValueError):
+                pass
+    
+    def wrap(self, name, function):
+        """Memoized version of function, registered under tool name"""
+        entry = self._entry(name)
+        
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def cached_tool(*args, **kwargs):
+                if not entry.cacheable:
+                    self._count(entry, "uncached")
+                    return await function(*args, **kwargs)
+                key = tool_key(name, function, args, kwargs)
+                hit, result = self._lookup(entry, key)
+                if not hit:
+                    result = await function(*args, **kwargs)
+                    self._store(entry, key, result)
+                return result
+        else:
+            @functools.wraps(function)
+            def cached_tool(*args, **kwargs):
+                if not entry.cacheable:
+                    self._count(entry, "uncached")
+                    return function(*args, **kwargs)
+                key = tool_key(name, function, args, kwargs)
+                hit, result = self._lookup(entry, key)
+                if not hit:
+                    result = function(*args, **kwargs)
+                    self._store(entry, key, result)
+                return result
+        
+        return cached_tool
+    
+    def wrap_all(self, functions):
+        """Memoized copy of a {tool name: function} map"""
+        return {name: self.wrap(name, function) for name, function in functions.items()}
+    
+    def clear(self):
+        """Drop every tool's cached results, leaving other disk entries alone"""
+        with self._lock:
+            entries = list(self._entries.items())
+        for name, entry in entries:
+            entry.memory.clear()
+            if entry.disk is not None:
+                entry.disk.clear(prefix=f"tool:{name}:")
+    
+    def stats(self):
+        """Hit rates per tool"""
+        stats = {}
+        with self._lock:
+            for name, entry in self._entries.items():
+                hits = entry.memory_hits + entry.disk_hits
+                lookups = hits + entry.misses
+                stats[name] = {
+                    "memory_hits": entry.memory_hits,
+                    "disk_hits": entry.disk_hits,
+                    "misses": entry.misses,
+                    "uncached": entry.uncached,
+                    "hit_rate": hits / lookups if lookups else 0.0
+                }
+        return stats
@@ -0,0 +1,156 @@
+"""Concurrent execution of the tool_use blocks in one assistant turn"""
+import asyncio
+import functools
+import threading
+import time
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+
+def _field(block, name):
+    if isinstance(block, Mapping):
+        return block[name]
+    return getattr(block, name)
+
+def tool_uses(content):
+    """The tool_use blocks in response content, in order"""
+    return [block for block in content if _field(block, "type") == "tool_use"]
+
+def _content_blocks(result):
+    return isinstance(result, list) and bool(result) and all(
+        isinstance(block, Mapping) and "type" in block for block in result
+    )
+
+def tool_result(tool_use_id, result=None, error=None):
+    """A tool_result block for a tool's return value or exception"""
+    if error is not None:
+        return {
+            "type": "tool_result",
+            "tool_use_id": tool_use_id,
+            "content": f"Error: {error}",
+            "is_error": True
+        }
+    # A list goes through only as content blocks; a plain list is text like any value
+    if not isinstance(result, str) and not _content_blocks(result):
+        result = str(result)
+    return {"type": "tool_result", "tool_use_id": tool_use_id, "content": result}
+
+class ToolExecutor:
+    """Runs a turn's tool calls concurrently and returns their tool_results
+    
+    `functions` maps tool names to plain or `async def` callables. run()
+    runs sync tools on a shared thread pool (and async tools on their own
+    event loop in a worker); arun() awaits async tools natively and sends
+    sync tools to the pool. At most max_concurrency calls of one turn run
+    at once. Results come back in tool_use order; a tool that raises, or
+    is unknown, yields an is_error tool_result instead of failing the turn.
+    """
+    
+    def __init__(self, functions, max_concurrency=8, max_workers=32):
+        self.functions = functions
+        self.max_concurrency = max_concurrency
+        self._max_workers = max_workers
+        self._pool = None
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.calls = 0
+        self.errors = 0
+        self.tool_seconds = 0.0
+        self.wall_seconds = 0.0
+    
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self._max_workers, thread_name_prefix="tool"
+                )
+            return self._pool
+    
+    def _function(self, block):
+        name = _field(block, "name")
+        function = self.functions.get(name)
+        if function is None:
+            raise ValueError(f"Unknown tool: {name}")
+        return function
+    
+    def _call(self, block):
+        """Run one tool to completion on the current thread"""
+        started = time.perf_counter()
+        try:
+            function = self._function(block)
+            result = function(**_field(block, "input"))
+            if asyncio.iscoroutine(result):
+                result = asyncio.run(result)
+            return tool_result(_field(block, "id"), result)
+        except Exception as e:
+            self._count(errors=1)
+            return tool_result(_field(block, "id"), error=e)
+        finally:
+            self._count(tool_seconds=time.perf_counter() - started)
+    
+    async def _acall(self, block, semaphore):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                function = self._function(block)
+                if asyncio.iscoroutinefunction(function):
+                    result = await function(**_field(block, "input"))
+                else:
+                    result = await asyncio.get_running_loop().run_in_executor(
+                        self._executor(), functools.partial(function, **_field(block, "input"))
+                    )
+                return tool_result(_field(block, "id"), result)
+            except Exception as e:
+                self._count(errors=1)
+                return tool_result(_field(block, "id"), error=e)
+            finally:
+                self._count(tool_seconds=time.perf_counter() - started)
+    
+    def run(self, blocks):
+        """tool_results for the tool_use blocks in blocks (e.g. response.content)"""
+        blocks = tool_uses(blocks)
+        started = time.perf_counter()
+        if len(blocks) <= 1 or self.max_concurrency <= 1:
+            results = [self._call(block) for block in blocks]
+        else:
+            slots = threading.BoundedSemaphore(self.max_concurrency)
+            pool = self._executor()
+            futures = []
+            for block in blocks:
+                slots.acquire()
+                future = pool.submit(self._call, block)
+                future.add_done_callback(lambda _: slots.release())
+                futures.append(future)
+            results = [future.result() for future in futures]
+        self._count(turns=1, calls=len(blocks), wall_seconds=time.perf_counter() - started)
+        return results
+    
+    async def arun(self, blocks):
+        """Asyncio variant of run()"""
+        blocks = tool_uses(blocks)
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+        results = await asyncio.gather(*(self._acall(block, semaphore) for block in blocks))
+        self._count(turns=1, calls=len(blocks), wall_seconds=time.perf_counter() - started)
+        return list(results)
+    
+    def _count(self, **deltas):
+        with self._lock:
+            for counter, delta in deltas.items():
+                setattr(self, counter, getattr(self, counter) + delta)
+    
+    def stats(self):
+        """Call counts and time saved by running calls side by side"""
+        return {
+            "turns": self.turns,
+            "calls": self.calls,
+            "errors": self.errors,
+            "tool_seconds": self.tool_seconds,
+            "wall_seconds": self.wall_seconds,
+            "seconds_saved": max(self.tool_seconds - self.wall_seconds, 0.0)
+        }
+    
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
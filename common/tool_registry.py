@@ -0,0 +1,204 @@
+"""Declarative tool definitions built from function signatures
+
+Registering a function derives its input_schema from the signature and
+type hints (the description defaults to the docstring), compiles an
+input validator, and adds it to the registry's tools list, all once.
+The tools list keeps the same schema objects from request to request and
+carries its JSON encoding, so nothing about the tools is rebuilt or
+re-serialized per call.
+
+    registry = ToolRegistry()
+
+    @registry.tool(params={"location": "The city name, e.g., San Francisco"})
+    def get_weather(location: str, units: Literal["C", "F"] = "F"):
+        ...
+
+    client.send_message(messages, tools=registry.tools)
+    ToolExecutor(registry.functions)
+"""
+import functools
+import inspect
+import json
+import threading
+import typing
+from collections.abc import Hashable, Mapping
+
+class ToolInputError(ValueError):
+    """Tool input from the model does not match the tool's schema"""
+
+class ToolSchemas(list):
+    """The tools payload; `payload` is its JSON text, encoded on first use"""
+    
+    def __init__(self, schemas=()):
+        super().__init__(schemas)
+        self._payload = None
+    
+    @property
+    def payload(self):
+        if self._payload is None:
+            self._payload = json.dumps(self, ensure_ascii=False)
+        return self._payload
+
+JSON_TYPES = {
+    str: ("string", lambda value: isinstance(value, str)),
+    int: ("integer", lambda value: isinstance(value, int) and not isinstance(value, bool)),
+    float: ("number", lambda value: isinstance(value, (int, float)) and not isinstance(value, bool)),
+    bool: ("boolean", lambda value: isinstance(value, bool)),
+    dict: ("object", lambda value: isinstance(value, dict)),
+    list: ("array", lambda value: isinstance(value, list))
+}
+
+def _accept(value):
+    return True
+
+def compile_type(hint):
+    """(JSON schema, check function) for a type hint"""
+    origin = typing.get_origin(hint)
+    args = typing.get_args(hint)
+    
+    if hint is inspect.Parameter.empty or hint is typing.Any:
+        return {}, _accept
+    if origin is typing.Literal:
+        allowed = frozenset(args)
+        kind = JSON_TYPES.get(type(args[0]), ("string",))[0]
+        return {"type": kind, "enum": list(args)}, lambda value: isinstance(value, Hashable) and value in allowed
+    if origin is typing.Union:
+        options = [arg for arg in args if arg is not type(None)]
+        if len(options) == 1:
+            schema, check = compile_type(options[0])
+            return schema, lambda value: value is None or check(value)
+        compiled = [compile_type(option) for option in options]
+        checks = [check for _, check in compiled]
+        return (
+            {"anyOf": [schema for schema, _ in compiled]},
+            lambda value: any(check(value) for check in checks)
+        )
+    if origin in (list, typing.List) or hint is list:
+        is_list = JSON_TYPES[list][1]
+        if not args:
+            return {"type": "array"}, is_list
+        item_schema, item_check = compile_type(args[0])
+        return (
+            {"type": "array", "items": item_schema},
+            lambda value: is_list(value) and all(item_check(item) for item in value)
+        )
+    if origin in (dict, typing.Dict) or hint is dict:
+        return {"type": "object"}, JSON_TYPES[dict][1]
+    if hint in JSON_TYPES:
+        kind, check = JSON_TYPES[hint]
+        return {"type": kind}, check
+    raise TypeError(f"Unsupported tool parameter type: {hint!r}")
+
+class Tool:
+    """One registered tool: its schema, validator and function"""
+    
+    def __init__(self, function, name=None, description=None, params=None):
+        self.function = function
+        self.name = name or function.__name__
+        self.description = description or inspect.getdoc(function) or self.name
+        params = params or {}
+        
+        hints = typing.get_type_hints(function)
+        signature = inspect.signature(function)
+        properties = {}
+        required = []
+        fields = []
+        self.open = False
+        for parameter in signature.parameters.values():
+            if parameter.kind is parameter.VAR_KEYWORD:
+                self.open = True
+                continue
+            if parameter.kind is parameter.VAR_POSITIONAL:
+                continue
+            schema, check = compile_type(hints.get(parameter.name, parameter.annotation))
+            if parameter.name in params:
+                schema = {**schema, "description": params[parameter.name]}
+            properties[parameter.name] = schema
+            is_required = parameter.default is parameter.empty
+            if is_required:
+                required.append(parameter.name)
+            fields.append((parameter.name, is_required, check, schema.get("type", "value")))
+        
+        self.schema = {
+            "name": self.name,
+            "description": self.description,
+            "input_schema": {"type": "object", "properties": properties, "required": required}
+        }
+        self._fields = tuple(fields)
+        self._names = frozenset(properties)
+        
+        @functools.wraps(function)
+        def validated(**tool_input):
+            self.validate(tool_input)
+            return function(**tool_input)
+        
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def validated(**tool_input):
+                self.validate(tool_input)
+                return await function(**tool_input)
+        
+        self.validated = validated
+    
+    def validate(self, tool_input):
+        """Raise ToolInputError unless tool_input matches the schema"""
+        if not isinstance(tool_input, Mapping):
+            raise ToolInputError(f"{self.name}: input must be an object")
+        if not self.open:
+            for key in tool_input:
+                if key not in self._names:
+                    raise ToolInputError(f"{self.name}: unexpected argument {key!r}")
+        for name, required, check, expected in self._fields:
+            if name in tool_input:
+                if not check(tool_input[name]):
+                    raise ToolInputError(
+                        f"{self.name}: argument {name!r} must be {expected}, got {tool_input[name]!r}"
+                    )
+            elif required:
+                raise ToolInputError(f"{self.name}: missing required argument {name!r}")
+
+class ToolRegistry:
+    """Tools registered by decorator; schemas and validators built once
+    
+    `tools` is the payload for send_message (the same ToolSchemas object
+    until another tool is registered) and `functions` maps tool names to
+    validating wrappers for ToolExecutor or ToolCache.
+    """
+    
+    def __init__(self):
+        self._tools = {}
+        self._lock = threading.Lock()
+        self.tools = ToolSchemas()
+        self.functions = {}
+    
+    def register(self, function, name=None, description=None, params=None):
+        tool = Tool(function, name=name, description=description, params=params)
+        with self._lock:
+            self._tools[tool.name] = tool
+            # A new list, so requests already holding the old one are unaffected
+            self.tools = ToolSchemas(entry.schema for entry in self._tools.values())
+            self.functions = {entry.name: entry.validated for entry in self._tools.values()}
+        return tool
+    
+    def tool(self, name=None, description=None, params=None):
+        """Decorator registering a function as a tool; returns it unchanged"""
+        def decorator(function):
+            self.register(function, name=name, description=description, params=params)
+            return function
+        return decorator
+    
+    def __getitem__(self, name):
+        return self._tools[name]
+    
+    def __contains__(self, name):
+        return name in self._tools
+    
+    def __len__(self):
+        return len(self._tools)
+    
+    def call(self, name, tool_input):
+        """Validate tool_input and call the tool"""
+        tool = self._tools.get(name)
+        if tool is None:
+            raise ToolInputError(f"Unknown tool: {name}")
+        return tool.validated(**tool_input)
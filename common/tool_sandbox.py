@@ -0,0 +1,360 @@
+"""Tool calls in a pool of worker processes with timeouts and rlimits
+
+A stuck or CPU-heavy tool called in-process holds up the agent loop and
+cannot be interrupted. ToolSandbox keeps warm worker processes, each
+holding the tool functions, and sends them calls over a pipe; only the
+arguments and the result are pickled, so a call costs well under a
+millisecond on top of the tool itself. A call that overruns its timeout
+has its worker killed and replaced, and raises ToolTimeoutError, which
+ToolExecutor turns into an is_error tool_result like any other failure.
+
+    sandbox = ToolSandbox(registry.functions, timeout=10, memory_mb=512)
+    executor = ToolExecutor(sandbox.functions)
+"""
+import asyncio
+import functools
+import math
+import multiprocessing
+import pickle
+import queue
+import signal
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - exercised only off Unix
+    resource = None
+
+class ToolTimeoutError(TimeoutError):
+    """A sandboxed tool call ran past its timeout and its worker was killed"""
+
+class ToolCrashedError(RuntimeError):
+    """A sandboxed tool's worker died (CPU or memory limit, or a crash)"""
+
+def _cpu_used():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def _limit_cpu(seconds):
+    # RLIMIT_CPU counts the whole process lifetime; allow `seconds` more
+    soft = math.ceil(_cpu_used() + seconds)
+    hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def _worker_main(conn, functions, cpu_seconds, memory_mb):
+    """Worker loop: receive (name, kwargs), send ("ok", result) or ("error", exception)"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if resource is not None and memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            return
+        if request is None:
+            return
+        name, kwargs = request
+        if resource is not None and cpu_seconds:
+            _limit_cpu(cpu_seconds)
+        try:
+            result = functions[name](**kwargs)
+            if asyncio.iscoroutine(result):
+                result = asyncio.run(result)
+            reply = ("ok", result)
+        except MemoryError:
+            reply = ("error", MemoryError(f"tool {name!r} ran out of memory"))
+        except Exception as e:
+            reply = ("error", e)
+        try:
+            conn.send(reply)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            # Unpicklable result or exception: report it as text
+            message = repr(reply[1]) if reply[0] == "error" else f"unpicklable result: {e}"
+            conn.send(("error", RuntimeError(message)))
+
+class _Worker:
+    """One worker process and the parent's end of its pipe"""
+    
+    def __init__(self, context, functions, cpu_seconds, memory_mb):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child, functions, cpu_seconds, memory_mb),
+            name="tool-sandbox", daemon=True
+        )
+        self.process.start()
+        child.close()
+        self.calls = 0
+    
+    def stop(self, kill=False):
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except OSError:
+                self.process.kill()
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+class ToolSandbox:
+    """Runs tool functions in recycled worker processes
+    
+    `functions` maps tool names to callables; they reach the workers by
+    fork, so closures and registry wrappers work where fork is available
+    (elsewhere they must be picklable module-level functions). Each call
+    gets `timeout` seconds of wall-clock time; `cpu_seconds` and
+    `memory_mb` set RLIMIT_CPU and RLIMIT_AS in the workers. Workers are
+    replaced after max_calls calls, on a timeout, or when they die. `tools`
+    overrides the timeout per tool:
+        
+        ToolSandbox(functions, timeout=10, tools={"search_web": {"timeout": 30}})
+    
+    `functions` on the sandbox are drop-in proxies for ToolExecutor and
+    ToolCache. Time spent waiting for a free worker counts against the
+    call's timeout.
+    
+    start() forks the whole pool on the calling thread; call it before the
+    process starts other threads. Workers started later (on first use
+    without start(), or to replace a dead, stuck or recycled one) are
+    forked from a dedicated spawner thread, never from a caller's thread,
+    but by then the process usually has other threads (ToolExecutor's pool,
+    HTTP clients). A child forked while another thread holds a lock only
+    inherits that lock held, so a tool that needs it (logging, a shared
+    connection pool) can hang until its timeout. Where the tools are
+    picklable module-level functions, context="forkserver" avoids forking
+    a threaded process altogether.
+    """
+    
+    def __init__(self, functions, workers=4, timeout=10, cpu_seconds=None, memory_mb=None,
+                 max_calls=1000, tools=None, context=None):
+        self._functions = dict(functions)
+        self.size = workers
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.max_calls = max_calls
+        self.tools = tools or {}
+        if context is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = "fork" if "fork" in methods else "spawn"
+        self._context = multiprocessing.get_context(context)
+        self._idle = queue.LifoQueue()
+        self._spawns = queue.Queue()
+        self._spawner = None
+        self._spawn_error = None
+        self._live = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.crashes = 0
+        self.recycled = 0
+        self.started = 0
+        self.call_seconds = 0.0
+        self.functions = {name: self._proxy(name, function) for name, function in self._functions.items()}
+    
+    def _proxy(self, name, function):
+        # Sync even for async tools, since the worker runs the coroutine;
+        # __wrapped__ keeps the tool's signature visible to ToolCache
+        @functools.wraps(function)
+        def sandboxed_tool(**kwargs):
+            return self.call(name, kwargs)
+        return sandboxed_tool
+    
+    def _spawn(self):
+        """Fork a worker into a slot already counted in _live"""
+        try:
+            worker = _Worker(self._context, self._functions, self.cpu_seconds, self.memory_mb)
+        except BaseException:
+            with self._lock:
+                self._live -= 1
+            raise
+        self._count(started=1)
+        return worker
+    
+    def _reserve(self):
+        """Claim a worker slot; False when the pool is full or closed"""
+        with self._lock:
+            if self._closed or self._live >= self.size:
+                return False
+            self._live += 1
+            return True
+    
+    def start(self):
+        """Fork the full pool now, e.g. before the process starts threads"""
+        if self._closed:
+            raise RuntimeError("ToolSandbox is closed")
+        while self._reserve():
+            self._park(self._spawn())
+        return self
+    
+    def _park(self, worker):
+        """Return a worker to the idle pool, or stop it if the sandbox closed"""
+        # Checked under the lock so close() cannot miss a worker parked meanwhile
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._idle.put(worker)
+        if closed:
+            self._retire(worker)
+    
+    def _request_spawn(self):
+        """Have the spawner thread fill a reserved slot"""
+        with self._lock:
+            if self._spawner is None:
+                self._spawner = threading.Thread(
+                    target=self._spawn_loop, name="tool-sandbox-spawner", daemon=True
+                )
+                self._spawner.start()
+        self._spawns.put(True)
+    
+    def _spawn_loop(self):
+        while self._spawns.get() is not None:
+            if self._closed:
+                # Requested before close(); give the slot back unfilled
+                with self._lock:
+                    self._live -= 1
+                continue
+            try:
+                worker = self._spawn()
+            except Exception as e:
+                self._spawn_error = e
+                continue
+            self._spawn_error = None
+            self._park(worker)
+    
+    def _checkout(self, deadline):
+        """An idle worker, or None if none frees up before deadline"""
+        while True:
+            if self._closed:
+                raise RuntimeError("ToolSandbox is closed")
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            if self._reserve():
+                self._request_spawn()
+            if self._spawn_error is not None:
+                raise ToolCrashedError(f"could not start a worker: {self._spawn_error}")
+            wait = 0.1
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return None
+            # Short waits, so a close() or a failed respawn is noticed
+            try:
+                return self._idle.get(timeout=wait)
+            except queue.Empty:
+                pass
+    
+    def _retire(self, worker, kill=False):
+        with self._lock:
+            self._live -= 1
+        worker.stop(kill=kill)
+    
+    def _checkin(self, worker):
+        if worker.calls >= self.max_calls and not self._closed:
+            self._count(recycled=1)
+            self._replace(worker, kill=False)
+        else:
+            self._park(worker)
+    
+    def _replace(self, worker, kill=True):
+        """Stop a worker (killing it if stuck) and put a fresh one in its place"""
+        self._retire(worker, kill=kill)
+        if self._reserve():
+            self._request_spawn()
+    
+    def call(self, name, kwargs):
+        """Run one tool in a worker; raises what the tool raised, or ToolTimeoutError"""
+        if name not in self._functions:
+            raise ValueError(f"Unknown tool: {name}")
+        timeout = self.tools.get(name, {}).get("timeout", self.timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        worker = self._checkout(deadline)
+        if worker is None:
+            self._count(timeouts=1, errors=1)
+            raise ToolTimeoutError(f"tool {name!r} timed out after {timeout}s waiting for a worker")
+        started = time.perf_counter()
+        try:
+            worker.calls += 1
+            worker.conn.send((name, kwargs))
+            if worker.conn.poll(None if deadline is None else max(deadline - time.monotonic(), 0)):
+                status, value = worker.conn.recv()
+            else:
+                status, value = "timeout", None
+        except (EOFError, OSError):
+            status, value = "crashed", None
+        except BaseException:
+            # Interrupted mid-call: the worker's state is unknown
+            self._replace(worker)
+            raise
+        finally:
+            self._count(calls=1, call_seconds=time.perf_counter() - started)
+        
+        if status == "timeout":
+            self._count(timeouts=1, errors=1)
+            self._replace(worker)
+            raise ToolTimeoutError(f"tool {name!r} timed out after {timeout}s")
+        if status == "crashed":
+            worker.process.join(timeout=1)
+            exitcode = worker.process.exitcode
+            self._count(crashes=1, errors=1)
+            self._replace(worker)
+            if exitcode == -getattr(signal, "SIGXCPU", 0):
+                raise ToolCrashedError(f"tool {name!r} exceeded its CPU limit")
+            raise ToolCrashedError(f"tool {name!r} worker exited with code {exitcode}")
+        self._checkin(worker)
+        if status == "error":
+            self._count(errors=1)
+            raise value
+        return value
+    
+    def _count(self, **deltas):
+        with self._lock:
+            for counter, delta in deltas.items():
+                setattr(self, counter, getattr(self, counter) + delta)
+    
+    def stats(self):
+        """Call, failure and worker counts"""
+        with self._lock:
+            return {
+                "workers": self._live,
+                "calls": self.calls,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+                "crashes": self.crashes,
+                "recycled": self.recycled,
+                "started": self.started,
+                "avg_call_ms": self.call_seconds / self.calls * 1000 if self.calls else 0.0
+            }
+    
+    def close(self):
+        """Stop idle workers; busy ones stop when their call returns"""
+        with self._lock:
+            self._closed = True
+            spawner = self._spawner
+        if spawner is not None:
+            self._spawns.put(None)
+            # A worker forked before the spawner saw close() is stopped as it parks
+            spawner.join()
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._retire(worker)
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,184 @@
+"""Process-wide HTTP transport shared by every ClaudeClient
+
+Building a fresh anthropic.Anthropic per client also builds a fresh
+connection pool, so keep-alive connections and TLS sessions are thrown
+away. The registry hands every client the same pooled httpx client
+(HTTP/2 when the h2 package is installed), can pre-open connections at
+startup, and counts how many requests reused an existing connection.
+"""
+import asyncio
+import importlib
+import importlib.util
+import logging
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import anthropic
+
+from .config import Config
+
+DEFAULT_BASE_URL = "https://api.anthropic.com"
+
+logger = logging.getLogger(__name__)
+
+# The HTTP library the SDK's clients are built on (httpx, or its httpx2 fork
+# in newer SDK releases); Limits and errors must come from the same one
+http = importlib.import_module(anthropic.DefaultHttpxClient.__mro__[1].__module__.partition(".")[0])
+
+def _close_async(client, loop):
+    """Close an async client from sync code, on the loop that owns its connections"""
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    loop = loop or running
+    if loop is None:
+        asyncio.run(client.aclose())
+    elif loop.is_closed():
+        # Its connections died with the loop and cannot be closed cleanly
+        pass
+    elif loop is running:
+        loop.create_task(client.aclose())
+    elif loop.is_running():
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+    else:
+        loop.run_until_complete(client.aclose())
+
+class TransportRegistry:
+    """Shared, instrumented httpx connection pools"""
+    
+    def __init__(self, max_connections=None, max_keepalive_connections=None,
+                 keepalive_expiry=None, http2=None):
+        self.limits = http.Limits(
+            max_connections=max_connections or Config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=max_keepalive_connections or Config.HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=keepalive_expiry or Config.HTTP_KEEPALIVE_EXPIRY
+        )
+        if http2 is None:
+            http2 = Config.HTTP2 and importlib.util.find_spec("h2") is not None
+        self.http2 = http2
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+        self._lock = threading.Lock()
+        self._sync_client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._async_default = None
+    
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+    
+    def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            self._count("new_connections")
+        elif event_name == "connection.start_tls.complete":
+            self._count("tls_handshakes")
+    
+    async def _atrace(self, event_name, info):
+        self._trace(event_name, info)
+    
+    def _on_request(self, request):
+        request.extensions["trace"] = self._trace
+        self._count("requests")
+    
+    async def _on_request_async(self, request):
+        request.extensions["trace"] = self._atrace
+        self._count("requests")
+    
+    def http_client(self):
+        """The shared synchronous httpx client"""
+        with self._lock:
+            if self._sync_client is None:
+                self._sync_client = anthropic.DefaultHttpxClient(
+                    limits=self.limits,
+                    http2=self.http2,
+                    event_hooks={"request": [self._on_request]}
+                )
+            return self._sync_client
+    
+    def async_http_client(self):
+        """The shared async httpx client for the running event loop
+        
+        Async connections are bound to the loop that opened them, so each
+        event loop gets its own pool.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        
+        with self._lock:
+            client = self._async_default if loop is None else self._async_clients.get(loop)
+            if client is None:
+                client = anthropic.DefaultAsyncHttpxClient(
+                    limits=self.limits,
+                    http2=self.http2,
+                    event_hooks={"request": [self._on_request_async]}
+                )
+                if loop is None:
+                    self._async_default = client
+                else:
+                    self._async_clients[loop] = client
+            return client
+    
+    def warmup(self, base_url=None, connections=2):
+        """Open keep-alive connections ahead of the first API call
+        
+        Sends concurrent HEAD requests so that `connections` sockets finish
+        their TCP and TLS handshakes and park in the pool. The status code
+        doesn't matter; failures are logged and otherwise ignored, so an
+        unreachable API never stops a client from being built.
+        """
+        base_url = base_url or os.getenv("ANTHROPIC_BASE_URL") or DEFAULT_BASE_URL
+        client = self.http_client()
+        
+        def touch(_):
+            try:
+                client.head(base_url)
+            except http.HTTPError as e:
+                logger.warning("warmup request to %s failed: %r", base_url, e)
+        
+        with ThreadPoolExecutor(max_workers=max(1, connections)) as pool:
+            list(pool.map(touch, range(connections)))
+    
+    def stats(self):
+        """Connection reuse statistics"""
+        reused = max(0, self.requests - self.new_connections)
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "tls_handshakes": self.tls_handshakes,
+            "reused_connections": reused,
+            "reuse_ratio": reused / self.requests if self.requests else 0.0,
+            "http2": self.http2
+        }
+    
+    def close(self):
+        """Close the sync client and every event loop's async client"""
+        with self._lock:
+            sync_client, self._sync_client = self._sync_client, None
+            async_clients = list(self._async_clients.items())
+            if self._async_default is not None:
+                async_clients.append((None, self._async_default))
+            self._async_clients.clear()
+            self._async_default = None
+        if sync_client is not None:
+            sync_client.close()
+        for loop, client in async_clients:
+            _close_async(client, loop)
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    """The process-wide TransportRegistry, warmed up on first use if configured"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = TransportRegistry()
+            if Config.HTTP_WARMUP_CONNECTIONS:
+                _registry.warmup(connections=Config.HTTP_WARMUP_CONNECTIONS)
+        return _registry
@@ -1,4 +1,8 @@
 """Common utility functions"""
+from collections.abc import Mapping
+
+from .history import History
+from .message_store import MessageStore
 
 def print_message(role, content):
     """Pretty print a message"""
@@ -9,8 +13,24 @@ def print_message(role, content):
     print()
 
 def format_messages(conversation_history):
-    """Format conversation history for Claude API"""
+    """Format conversation history for Claude API
+    
+    A MessageStore or History is already in API shape and is returned
+    without copying.
+    """
+    if isinstance(conversation_history, (MessageStore, History)):
+        return conversation_history
     return [
         {"role": msg["role"], "content": msg["content"]}
         for msg in conversation_history
     ]
+
+def to_jsonable(value):
+    """Convert request/response values, including SDK models, to plain JSON data"""
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    if isinstance(value, Mapping):
+        return {key: to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    return value
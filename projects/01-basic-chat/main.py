@@ -5,6 +5,8 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
 from common.claude_client import ClaudeClient
+from common.cache import ResponseCache
+from common.config import Config
 from common.utils import print_message
 
 def main():
@@ -12,8 +14,12 @@ def main():
     
     print("\n🤖 Claude Basic Chat Example\n")
     
-    # Initialize Claude client
-    client = ClaudeClient()
+    # Initialize Claude client; reruns of these fixed prompts are served
+    # from the response cache when RESPONSE_CACHE_PATH is set
+    cache = None
+    if Config.RESPONSE_CACHE_PATH:
+        cache = ResponseCache(path=Config.RESPONSE_CACHE_PATH)
+    client = ClaudeClient(cache=cache)
     
     # Single message example
     print("Sending message to Claude...")
@@ -45,6 +51,9 @@ def main():
         conversation_history
     )
     print_message("Assistant", response2)
+    
+    if cache:
+        print(f"Cache stats: {cache.stats()}")
 
 if __name__ == "__main__":
     main()
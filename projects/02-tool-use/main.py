@@ -1,9 +1,14 @@
 import sys
 import os
+import asyncio
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
 from common.claude_client import ClaudeClient
+from common.async_client import AsyncClaudeClient
+from common.message_store import MessageStore
+from common.prompt_caching import PromptCachePolicy
+from common.tool_executor import ToolExecutor, tool_uses
 from common.utils import print_message
 from tools import TOOLS, TOOL_FUNCTIONS
 
@@ -12,14 +17,15 @@ def main():
     
     print("\n🛠️  Claude Tool Use Example\n")
     
-    client = ClaudeClient()
+    client = ClaudeClient(prompt_cache=PromptCachePolicy())
+    executor = ToolExecutor(TOOL_FUNCTIONS)
     
-    messages = [
+    messages = MessageStore([
         {
             "role": "user",
             "content": "What's the weather in San Francisco? Also, what's 15 * 24?"
         }
-    ]
+    ])
     
     print("User: What's the weather in San Francisco? Also, what's 15 * 24?\n")
     
@@ -29,9 +35,9 @@ def main():
     # Process tool use
     while response.stop_reason == "tool_use":
         # Extract tool use blocks
-        tool_uses = [block for block in response.content if block.type == "tool_use"]
+        calls = tool_uses(response.content)
         
-        print(f"Claude wants to use {len(tool_uses)} tool(s):\n")
+        print(f"Claude wants to use {len(calls)} tool(s):\n")
         
         # Add assistant's response to messages
         messages.append({
@@ -39,24 +45,12 @@ def main():
             "content": response.content
         })
         
-        # Execute tools and collect results
-        tool_results = []
-        for tool_use in tool_uses:
-            tool_name = tool_use.name
-            tool_input = tool_use.input
-            
-            print(f"  📌 Using tool: {tool_name}")
-            print(f"     Input: {tool_input}")
-            
-            # Execute the tool
-            result = TOOL_FUNCTIONS[tool_name](**tool_input)
-            print(f"     Result: {result}\n")
-            
-            tool_results.append({
-                "type": "tool_result",
-                "tool_use_id": tool_use.id,
-                "content": result
-            })
+        # Execute the tools side by side; results come back in call order
+        tool_results = executor.run(calls)
+        for tool_use, tool_result in zip(calls, tool_results):
+            print(f"  📌 Using tool: {tool_use.name}")
+            print(f"     Input: {tool_use.input}")
+            print(f"     Result: {tool_result['content']}\n")
         
         # Send tool results back to Claude
         messages.append({
@@ -76,5 +70,58 @@ def main():
     if final_text:
         print_message("Final Response", final_text)
 
+async def main_async():
+    """Tool use example with Claude using the asyncio client"""
+    
+    print("\n🛠️  Claude Tool Use Example (async)\n")
+    
+    client = AsyncClaudeClient(prompt_cache=PromptCachePolicy())
+    executor = ToolExecutor(TOOL_FUNCTIONS)
+    
+    messages = MessageStore([
+        {
+            "role": "user",
+            "content": "What's the weather in San Francisco? Also, what's 15 * 24?"
+        }
+    ])
+    
+    print("User: What's the weather in San Francisco? Also, what's 15 * 24?\n")
+    
+    response = await client.send_message(messages, tools=TOOLS)
+    
+    while response.stop_reason == "tool_use":
+        calls = tool_uses(response.content)
+        
+        print(f"Claude wants to use {len(calls)} tool(s):\n")
+        
+        messages.append({
+            "role": "assistant",
+            "content": response.content
+        })
+        
+        tool_results = await executor.arun(calls)
+        for tool_use, tool_result in zip(calls, tool_results):
+            print(f"  📌 Using tool: {tool_use.name}")
+            print(f"     Input: {tool_use.input}")
+            print(f"     Result: {tool_result['content']}\n")
+        
+        messages.append({
+            "role": "user",
+            "content": tool_results
+        })
+        
+        response = await client.send_message(messages, tools=TOOLS)
+    
+    final_text = next(
+        (block.text for block in response.content if hasattr(block, "text")),
+        None
+    )
+    
+    if final_text:
+        print_message("Final Response", final_text)
+
 if __name__ == "__main__":
-    main()
+    if "--async" in sys.argv:
+        asyncio.run(main_async())
+    else:
+        main()
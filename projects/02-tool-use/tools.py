@@ -1,6 +1,16 @@
 """Tool definitions for Claude"""
+from common.calculator import CalculationError, evaluate
+from common.config import Config
+from common.tool_cache import ToolCache
+from common.tool_registry import ToolRegistry
 
-def get_weather(location):
+registry = ToolRegistry()
+
+@registry.tool(
+    description="Get the current weather for a location",
+    params={"location": "The city name, e.g., San Francisco"}
+)
+def get_weather(location: str):
     """Simulated weather API"""
     # In real scenario, call actual weather API
     weather_data = {
@@ -11,49 +21,23 @@ def get_weather(location):
     }
     return weather_data.get(location, f"Weather data not available for {location}")
 
-def calculate(expression):
+@registry.tool(
+    description="Perform a mathematical calculation",
+    params={"expression": "The mathematical expression to evaluate, e.g., '2 + 2' or '10 * 5'"}
+)
+def calculate(expression: str):
     """Safe calculator"""
     try:
-        # Simple eval for demo - in production use safer alternatives
-        result = eval(expression, {"__builtins__": {}}, {})
-        return str(result)
-    except Exception as e:
+        return str(evaluate(expression))
+    except CalculationError as e:
         return f"Error calculating: {str(e)}"
 
-# Tool definitions for Claude
-TOOLS = [
-    {
-        "name": "get_weather",
-        "description": "Get the current weather for a location",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "location": {
-                    "type": "string",
-                    "description": "The city name, e.g., San Francisco"
-                }
-            },
-            "required": ["location"]
-        }
-    },
-    {
-        "name": "calculate",
-        "description": "Perform a mathematical calculation",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "expression": {
-                    "type": "string",
-                    "description": "The mathematical expression to evaluate, e.g., '2 + 2' or '10 * 5'"
-                }
-            },
-            "required": ["expression"]
-        }
-    }
-]
+# Tool definitions for Claude, built from the signatures above
+TOOLS = registry.tools
+
+# Repeated calls with the same arguments are answered from the cache;
+# arithmetic never goes stale, weather does
+TOOL_CACHE = ToolCache(ttl=600, path=Config.TOOL_CACHE_PATH, tools={"calculate": {"ttl": None}})
 
-# Map tool names to functions
-TOOL_FUNCTIONS = {
-    "get_weather": get_weather,
-    "calculate": calculate
-}
+# Map tool names to validating, memoized functions
+TOOL_FUNCTIONS = TOOL_CACHE.wrap_all(registry.functions)
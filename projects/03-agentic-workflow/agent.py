@@ -1,53 +1,66 @@
 import sys
 import os
+import asyncio
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
 from common.claude_client import ClaudeClient
+from common.async_client import AsyncClaudeClient
+from common.config import Config
+from common.message_store import MessageStore
+from common.prompt_caching import PromptCachePolicy
+from common.routing import ModelCascade, escalate_on_max_tokens, low_confidence
+from common.tool_cache import ToolCache
+from common.tool_registry import ToolRegistry
+from common.tool_executor import ToolExecutor, tool_uses
+from common.tool_sandbox import ToolSandbox
 from tools.web_search import search_web
 from tools.calculator import calculate
 
-TOOLS = [
-    {
-        "name": "search_web",
-        "description": "Search the web for information (simulated)",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "query": {
-                    "type": "string",
-                    "description": "The search query"
-                }
-            },
-            "required": ["query"]
-        }
-    },
-    {
-        "name": "calculate",
-        "description": "Perform mathematical calculations",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "expression": {
-                    "type": "string",
-                    "description": "Mathematical expression to evaluate"
-                }
-            },
-            "required": ["expression"]
-        }
-    }
-]
+registry = ToolRegistry()
+registry.register(
+    search_web,
+    description="Search the web for information (simulated)",
+    params={"query": "The search query"}
+)
+registry.register(
+    calculate,
+    description="Perform mathematical calculations",
+    params={"expression": "Mathematical expression to evaluate"}
+)
 
-TOOL_MAP = {
-    "search_web": search_web,
-    "calculate": calculate
-}
+TOOLS = registry.tools
+
+# Tasks often repeat searches and sums; reuse results across iterations and tasks
+TOOL_CACHE = ToolCache(ttl=3600, path=Config.TOOL_CACHE_PATH, tools={"calculate": {"ttl": None}})
+
+TOOL_FUNCTIONS = registry.functions
+SANDBOX = None
+if Config.TOOL_SANDBOX:
+    # Tools run in pre-forked workers, so a stuck call times out instead of stalling the loop
+    SANDBOX = ToolSandbox(TOOL_FUNCTIONS, timeout=Config.TOOL_TIMEOUT).start()
+    TOOL_FUNCTIONS = SANDBOX.functions
+
+TOOL_MAP = TOOL_CACHE.wrap_all(TOOL_FUNCTIONS)
+
+# Shared by every agent run; a turn's tool calls run concurrently
+executor = ToolExecutor(TOOL_MAP)
+
+def make_router():
+    """Cascade from CASCADE_MODELS, so simple steps like arithmetic stay on a fast model"""
+    if not Config.CASCADE_MODELS:
+        return None
+    return ModelCascade(
+        Config.CASCADE_MODELS,
+        rules=[escalate_on_max_tokens, low_confidence()]
+    )
 
 def run_agent(task, max_iterations=5):
     """Run the agent with a given task"""
     
-    client = ClaudeClient()
-    messages = [{"role": "user", "content": task}]
+    # Tool schemas and earlier turns are resent every iteration; cache them
+    client = ClaudeClient(prompt_cache=PromptCachePolicy(), router=make_router())
+    messages = MessageStore([{"role": "user", "content": task}])
     
     print(f"\n🤖 Agent Task: {task}\n")
     print("="*60)
@@ -65,28 +78,66 @@ def run_agent(task, max_iterations=5):
             )
             print(f"\n✅ Agent Complete!\n")
             print(f"Result: {final_text}")
+            print(f"Prompt cache: {client.prompt_cache.stats()}")
             break
         
         if response.stop_reason == "tool_use":
             messages.append({"role": "assistant", "content": response.content})
             
-            tool_results = []
-            for block in response.content:
-                if block.type == "tool_use":
-                    print(f"🔧 Tool: {block.name}")
-                    print(f"   Input: {block.input}")
-                    
-                    result = TOOL_MAP[block.name](**block.input)
-                    print(f"   Result: {result}\n")
-                    
-                    tool_results.append({
-                        "type": "tool_result",
-                        "tool_use_id": block.id,
-                        "content": str(result)
-                    })
+            calls = tool_uses(response.content)
+            tool_results = executor.run(calls)
+            for block, tool_result in zip(calls, tool_results):
+                print(f"🔧 Tool: {block.name}")
+                print(f"   Input: {block.input}")
+                print(f"   Result: {tool_result['content']}\n")
             
             messages.append({"role": "user", "content": tool_results})
 
+async def run_agent_async(task, max_iterations=5, client=None):
+    """Run the agent with a given task on the asyncio client
+    
+    Pass a shared AsyncClaudeClient to run many tasks on one event loop.
+    """
+    
+    client = client or AsyncClaudeClient(prompt_cache=PromptCachePolicy(), router=make_router())
+    messages = MessageStore([{"role": "user", "content": task}])
+    
+    print(f"\n🤖 Agent Task: {task}\n")
+    
+    for iteration in range(max_iterations):
+        response = await client.send_message(messages, tools=TOOLS)
+        
+        if response.stop_reason == "end_turn":
+            final_text = next(
+                (block.text for block in response.content if hasattr(block, "text")),
+                ""
+            )
+            print(f"\n✅ Agent Complete: {task}\n")
+            print(f"Result: {final_text}")
+            return final_text
+        
+        if response.stop_reason == "tool_use":
+            messages.append({"role": "assistant", "content": response.content})
+            
+            calls = tool_uses(response.content)
+            tool_results = await executor.arun(calls)
+            for block, tool_result in zip(calls, tool_results):
+                print(f"🔧 Tool: {block.name}")
+                print(f"   Input: {block.input}")
+                print(f"   Result: {tool_result['content']}\n")
+            
+            messages.append({"role": "user", "content": tool_results})
+    
+    return None
+
+async def main_async(tasks):
+    """Run agent tasks concurrently on a single event loop"""
+    
+    client = AsyncClaudeClient(prompt_cache=PromptCachePolicy(), router=make_router())
+    return await asyncio.gather(
+        *(run_agent_async(task, client=client) for task in tasks)
+    )
+
 def main():
     """Run example agent tasks"""
     
@@ -95,9 +146,16 @@ def main():
         "Find information about Claude AI and calculate how many days are in 3 years."
     ]
     
+    if "--async" in sys.argv:
+        asyncio.run(main_async(tasks))
+        return
+    
     for task in tasks:
         run_agent(task)
         print("\n" + "="*60 + "\n")
+    print(f"Tool cache: {TOOL_CACHE.stats()}")
+    if SANDBOX is not None:
+        print(f"Tool sandbox: {SANDBOX.stats()}")
 
 if __name__ == "__main__":
     main()
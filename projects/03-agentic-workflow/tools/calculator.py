@@ -1,12 +1,9 @@
-def calculate(expression):
+from common.calculator import CalculationError, evaluate
+
+def calculate(expression: str):
     """Safe calculator"""
     try:
-        # Simple eval - use safer alternatives in production
-        allowed_names = {
-            'abs': abs, 'round': round, 'min': min, 'max': max,
-            'sum': sum, 'pow': pow
-        }
-        result = eval(expression, {"__builtins__": {}}, allowed_names)
+        result = evaluate(expression)
         return f"{expression} = {result}"
-    except Exception as e:
+    except CalculationError as e:
         return f"Error: {str(e)}"
@@ -1,4 +1,4 @@
-def search_web(query):
+def search_web(query: str):
     """Simulated web search"""
     # In production, integrate with real search API
     results = {
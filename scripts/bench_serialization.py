@@ -0,0 +1,74 @@
+"""Per-turn request-body encoding time as a tool-use history grows
+
+Compares re-encoding the whole request every turn (with the same fast
+encoder; the SDK's own copy-and-encode path is slower still) with
+RequestEncoder, which only encodes turns it has not seen. Usage:
+
+    python scripts/bench_serialization.py [turns]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from common.prompt_caching import PromptCachePolicy
+from common.serialization import RequestEncoder, dumps
+from common.utils import to_jsonable
+
+TOOLS = [
+    {
+        "name": f"tool_{i}",
+        "description": "Looks something up. " * 10,
+        "input_schema": {"type": "object", "properties": {"query": {"type": "string"}}}
+    }
+    for i in range(8)
+]
+
+def add_turn(history, turn):
+    history.append({"role": "assistant", "content": [
+        {"type": "text", "text": f"Let me check that ({turn})."},
+        {"type": "tool_use", "id": f"toolu_{turn:020d}", "name": "tool_1", "input": {"query": "x" * 40}}
+    ]})
+    history.append({"role": "user", "content": [
+        {"type": "tool_result", "tool_use_id": f"toolu_{turn:020d}", "content": "result line\n" * 40}
+    ]})
+
+def time_per_turn(encode, params, repeat=20):
+    """Best of repeat runs, in microseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        encode(params)
+        best = min(best, time.perf_counter() - start)
+    return best * 1e6
+
+def main(turns=800):
+    policy = PromptCachePolicy()
+    encoder = RequestEncoder()
+    history = [{"role": "user", "content": "Start the task."}]
+    checkpoints = {50, 100, 200, 400, 800, turns}
+    
+    print(f"{'turns':>6} {'full (µs)':>12} {'incremental (µs)':>18} {'new turn only (µs)':>20}")
+    for turn in range(1, turns + 1):
+        add_turn(history, turn)
+        params = policy.apply({
+            "model": "claude-sonnet-4-20250514", "max_tokens": 1024,
+            "system": "You are a helpful agent.", "tools": TOOLS, "messages": history
+        })
+        if turn not in checkpoints:
+            encoder.encode(params)
+            continue
+        full = time_per_turn(lambda p: dumps(to_jsonable(p)), params)
+        # The first encode of a turn is what a live session pays
+        start = time.perf_counter()
+        encoder.encode(params)
+        first = (time.perf_counter() - start) * 1e6
+        incremental = time_per_turn(encoder.encode, params)
+        assert encoder.encode(params) == dumps(to_jsonable(params))
+        print(f"{turn:>6} {full:>12.0f} {incremental:>18.0f} {first:>20.0f}")
+    
+    print(f"\nencoder: {encoder.stats()}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 800)
@@ -1,9 +1,324 @@
 import sys
 import os
+import asyncio
+import json
+import socket
+import threading
+import tempfile
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import List, Literal, Optional
+
+import anthropic
+import httpx
+from anthropic.types import Message
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from common.config import Config
-from common.utils import format_messages
+from common.utils import format_messages, to_jsonable
+
+Config.ANTHROPIC_API_KEY = Config.ANTHROPIC_API_KEY or "test-key"
+
+from common.claude_client import ClaudeClient
+from common.async_client import AsyncClaudeClient
+from common.cache import AsyncReplayStream, ReplayStream, ResponseCache
+from common.semantic_cache import SemanticCache
+from common.prompt_caching import PromptCachePolicy
+from common import transport
+from common.coalescing import RequestCoalescer
+from common.rate_limiter import RateLimiter
+from common.hedging import HedgingPolicy
+from common.circuit_breaker import CircuitOpenError, ModelCircuitBreakers
+from common.key_pool import KeyPool, PoolMember
+from common.priority import Lane, PriorityDispatcher
+from common.routing import ModelCascade, escalate_on_max_tokens, invalid_output, tools_start_at
+from common.tokens import BudgetedHistory, ContextBudget, ContextBudgetExceeded, TokenEstimator, history_tally
+from common.compaction import SUMMARY_PREFIX, SUMMARY_SYSTEM, CompactionPolicy, session_stats
+from common.message_store import MessageStore, TextPool
+from common.serialization import RequestEncoder
+from common.sessions import SessionStore
+from common.history import History
+from common.tool_executor import ToolExecutor, tool_result
+from common.tool_cache import ToolCache
+from common.tool_registry import ToolInputError, ToolRegistry, ToolSchemas
+from common.calculator import CalculationError, Calculator
+from common.tool_sandbox import ToolSandbox, ToolTimeoutError
+
+def make_response(text, stop_reason="end_turn", **usage):
+    """Build an SDK Message as the API would return it"""
+    usage = {"input_tokens": 10, "output_tokens": 5, **usage}
+    return Message(
+        id="msg_test",
+        type="message",
+        role="assistant",
+        model="claude-test",
+        content=[{"type": "text", "text": text}],
+        stop_reason=stop_reason,
+        usage=usage
+    )
+
+class FakeMessages:
+    """Records create() calls and echoes the last user message"""
+    
+    def __init__(self):
+        self.calls = []
+    
+    def create(self, **params):
+        self.calls.append(params)
+        content = params["messages"][-1]["content"]
+        return make_response(f"echo: {content}")
+
+class FakeAsyncMessages(FakeMessages):
+    """Async variant of FakeMessages"""
+    
+    async def create(self, **params):
+        await asyncio.sleep(0)
+        return FakeMessages.create(self, **params)
+    
+    def stream(self, **params):
+        # A cached response replays the same way a live one streams
+        return AsyncReplayStream(FakeMessages.create(self, **params))
+
+class SlowMessages(FakeMessages):
+    """Sleeps per call, tracks peak concurrency and fails on request"""
+    
+    def __init__(self, delay=0.02):
+        super().__init__()
+        self.delay = delay
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+    
+    def create(self, **params):
+        with self.lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            if params["messages"][-1]["content"] == "fail":
+                raise RuntimeError("upstream error")
+            return FakeMessages.create(self, **params)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+class MessagesHandler(BaseHTTPRequestHandler):
+    """Keep-alive HTTP handler answering POST /v1/messages"""
+    
+    protocol_version = "HTTP/1.1"
+    
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.bodies.append(raw)
+        body = json.loads(raw)
+        reply = make_response(f"echo: {body['messages'][-1]['content']}")
+        payload = reply.model_dump_json().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def do_HEAD(self):
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+    
+    def log_message(self, *args):
+        pass
+
+class StreamingHandler(MessagesHandler):
+    """Streams the echo reply as server-sent events, one word per delta"""
+    
+    protocol_version = "HTTP/1.0"
+    
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.bodies.append(raw)
+        reply = make_response(f"echo: {json.loads(raw)['messages'][-1]['content']}")
+        message = json.loads(reply.model_dump_json())
+        words = message["content"][0]["text"].split(" ")
+        message.update(content=[], stop_reason=None)
+        events = [
+            ("message_start", {"message": message}),
+            ("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}}),
+            *(("content_block_delta", {"index": 0, "delta": {"type": "text_delta", "text": text}})
+              for text in [word + " " for word in words[:-1]] + words[-1:]),
+            ("content_block_stop", {"index": 0}),
+            ("message_delta", {"delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": 5}}),
+            ("message_stop", {})
+        ]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        try:
+            for event, data in events:
+                data = json.dumps({"type": event, **data})
+                self.wfile.write(f"event: {event}\ndata: {data}\n\n".encode("utf-8"))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class RateLimitedHandler(MessagesHandler):
+    """Reports an exhausted request budget on every response"""
+    
+    def send_header(self, keyword, value):
+        super().send_header(keyword, value)
+        if keyword == "Content-Type":
+            super().send_header("anthropic-ratelimit-requests-limit", "6000")
+            super().send_header("anthropic-ratelimit-requests-remaining", "0")
+            super().send_header("anthropic-ratelimit-input-tokens-limit", "100000")
+            super().send_header("anthropic-ratelimit-input-tokens-remaining", "99000")
+
+class RateLimitedStreamingHandler(RateLimitedHandler, StreamingHandler):
+    """Streams replies and reports an exhausted request budget"""
+
+class OverloadedHandler(MessagesHandler):
+    """Answers every request with a 529, non-retryable unless should_retry is set"""
+    
+    should_retry = "false"
+    
+    def do_POST(self):
+        self.server.bodies.append(self.rfile.read(int(self.headers["Content-Length"])))
+        payload = b'{"type":"error","error":{"type":"overloaded_error","message":"Overloaded"}}'
+        self.send_response(529)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("x-should-retry", self.should_retry)
+        self.end_headers()
+        self.wfile.write(payload)
+
+class RetryableOverloadedHandler(OverloadedHandler):
+    should_retry = "true"
+
+class BatchesHandler(MessagesHandler):
+    """Message Batches endpoints: create, retrieve (ends on the 3rd poll) and JSONL results"""
+    
+    polls_until_ended = 3
+    
+    def _send_json(self, payload, content_type="application/json"):
+        payload = payload.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def _batch(self, batch_id):
+        polls = self.server.polls.get(batch_id, 0)
+        ended = polls >= self.polls_until_ended
+        host, port = self.server.server_address
+        return json.dumps({
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {"processing": 0, "succeeded": 0, "errored": 0, "canceled": 0, "expired": 0},
+            "created_at": "2025-01-01T00:00:00Z",
+            "expires_at": "2025-01-02T00:00:00Z",
+            "ended_at": "2025-01-01T00:01:00Z" if ended else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"http://{host}:{port}/v1/messages/batches/{batch_id}/results" if ended else None
+        })
+    
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.bodies.append(raw)
+        batch_id = f"msgbatch_{len(self.server.batches) + 1}"
+        self.server.batches[batch_id] = json.loads(raw)["requests"]
+        self._send_json(self._batch(batch_id))
+    
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        batch_id = parts[3]
+        if parts[-1] == "results":
+            lines = []
+            for request in reversed(self.server.batches[batch_id]):
+                content = request["params"]["messages"][-1]["content"]
+                if content == "fail":
+                    result = {"type": "errored", "error": {
+                        "type": "error", "error": {"type": "invalid_request_error", "message": "bad"}
+                    }}
+                else:
+                    result = {"type": "succeeded",
+                              "message": json.loads(make_response(f"echo: {content}").model_dump_json())}
+                lines.append(json.dumps({"custom_id": request["custom_id"], "result": result}))
+            self._send_json("\n".join(lines) + "\n", content_type="application/binary")
+            return
+        self.server.polls[batch_id] = self.server.polls.get(batch_id, 0) + 1
+        self._send_json(self._batch(batch_id))
+
+@contextmanager
+def local_api(handler=MessagesHandler):
+    """Serve a fake Messages API on localhost and point the SDK at it"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.bodies = []
+    server.batches = {}
+    server.polls = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    previous = os.environ.get("ANTHROPIC_BASE_URL")
+    os.environ["ANTHROPIC_BASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+    try:
+        yield server
+    finally:
+        if previous is None:
+            os.environ.pop("ANTHROPIC_BASE_URL")
+        else:
+            os.environ["ANTHROPIC_BASE_URL"] = previous
+        server.shutdown()
+        server.server_close()
+
+class ModelLatencyMessages(FakeMessages):
+    """Answers with the model name after a per-model delay"""
+    
+    def __init__(self, delays):
+        super().__init__()
+        self.delays = delays
+    
+    def create(self, **params):
+        self.calls.append(params)
+        time.sleep(self.delays.get(params["model"], 0))
+        return make_response(params["model"])
+
+class AsyncModelLatencyMessages(ModelLatencyMessages):
+    """Async variant of ModelLatencyMessages that records cancellations"""
+    
+    def __init__(self, delays):
+        super().__init__(delays)
+        self.cancelled = 0
+    
+    async def create(self, **params):
+        self.calls.append(params)
+        try:
+            await asyncio.sleep(self.delays.get(params["model"], 0))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return make_response(params["model"])
+
+class OverloadedMessages(FakeMessages):
+    """Returns 529 overloaded errors for the given models"""
+    
+    def __init__(self, overloaded):
+        super().__init__()
+        self.overloaded = set(overloaded)
+    
+    def create(self, **params):
+        self.calls.append(params)
+        if params["model"] in self.overloaded:
+            request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+            raise anthropic.InternalServerError(
+                "Overloaded", response=httpx.Response(529, request=request), body=None
+            )
+        return make_response(params["model"])
+
+def make_client(messages=None, cls=ClaudeClient):
+    """Build a client wired to a fake messages endpoint"""
+    client = cls()
+    client.client = SimpleNamespace(messages=messages or FakeMessages())
+    return client
 
 def test_format_messages():
     """Test message formatting"""
@@ -17,5 +332,1109 @@ def test_format_messages():
     assert formatted[0]["role"] == "user"
     print("✓ test_format_messages passed")
 
+def test_async_client_chat():
+    """Test that many async chats can run on one event loop"""
+    client = make_client(FakeAsyncMessages(), cls=AsyncClaudeClient)
+    
+    async def run():
+        return await asyncio.gather(
+            *(client.chat(f"question {i}", system="Be brief") for i in range(20))
+        )
+    
+    results = asyncio.run(run())
+    assert len(results) == 20
+    reply, history = results[3]
+    assert reply == "echo: question 3"
+    assert [msg["role"] for msg in history] == ["user", "assistant"]
+    assert client.client.messages.calls[0]["system"] == "Be brief"
+    
+    # Streams are recorded in the response cache and replayed from it
+    client = make_client(FakeAsyncMessages(), cls=AsyncClaudeClient)
+    client.cache = ResponseCache()
+    messages = [{"role": "user", "content": "Hello"}]
+    
+    async def stream_twice():
+        texts = []
+        for _ in range(2):
+            async with client.send_message(messages, stream=True) as stream:
+                texts.append("".join([text async for text in stream.text_stream]))
+        return texts
+    
+    assert asyncio.run(stream_twice()) == ["echo: Hello", "echo: Hello"]
+    assert len(client.client.messages.calls) == 1
+    assert client.cache.stats()["memory_hits"] == 1
+    
+    # Without hooks the SDK's stream manager comes back as is; with them,
+    # a stream the consumer leaves early is neither drained nor cached
+    async def stream_live(manager, stop_after=None):
+        async with manager as stream:
+            texts = []
+            async for text in stream.text_stream:
+                texts.append(text)
+                if len(texts) == stop_after:
+                    break
+        return "".join(texts)
+    
+    with local_api(StreamingHandler):
+        client = AsyncClaudeClient()
+        manager = client.send_message(messages, stream=True)
+        assert isinstance(manager, anthropic.lib.streaming.AsyncMessageStreamManager)
+        assert asyncio.run(stream_live(manager)) == "echo: Hello"
+        
+        client.cache = ResponseCache()
+        manager = client.send_message(messages, stream=True)
+        assert asyncio.run(stream_live(manager, stop_after=1)) == "echo: "
+        assert client.cache.stats()["memory_size"] == 0
+        assert asyncio.run(stream_live(client.send_message(messages, stream=True))) == "echo: Hello"
+        assert client.cache.stats()["memory_size"] == 1
+    print("✓ test_async_client_chat passed")
+
+def test_send_many_ordered_with_errors():
+    """Test send_many keeps input order, bounds concurrency and isolates errors"""
+    fake = SlowMessages()
+    client = make_client(fake)
+    prompts = [f"prompt {i}" for i in range(16)]
+    prompts[5] = "fail"
+    
+    start = time.perf_counter()
+    results = client.send_many(prompts, concurrency=8)
+    elapsed = time.perf_counter() - start
+    
+    assert [r.index for r in results] == list(range(16))
+    assert results[0].response.content[0].text == "echo: prompt 0"
+    assert not results[5].ok and isinstance(results[5].error, RuntimeError)
+    assert fake.peak == 8
+    assert elapsed < 16 * fake.delay / 2
+    
+    streamed = list(client.send_many(prompts, concurrency=4, as_completed=True))
+    assert sorted(r.index for r in streamed) == list(range(16))
+    
+    # Stopping early cancels the requests that have not started
+    fake = SlowMessages()
+    client = make_client(fake)
+    iterator = client.send_many([f"p{i}" for i in range(40)], concurrency=4, as_completed=True)
+    next(iterator)
+    iterator.close()
+    time.sleep(fake.delay * 2)
+    assert len(fake.calls) < 10
+    print("✓ test_send_many_ordered_with_errors passed")
+
+def test_send_many_batch_mode():
+    """Test offloading send_many to the Message Batches API"""
+    sleeps = []
+    with local_api(BatchesHandler) as server:
+        client = ClaudeClient()
+        client.context_budget = ContextBudget(limit=20, estimator=TokenEstimator(chars_per_token=4))
+        results = client.send_many(
+            ["a", "fail", {"messages": [{"role": "user", "content": "c"}], "system": "S"},
+             [{"role": "user", "content": "old " * 40}, {"role": "assistant", "content": "ok"},
+              {"role": "user", "content": "d"}]],
+            batch=True,
+            custom_ids=["id-a", "id-b", "id-c", "id-d"],
+            sleep=sleeps.append
+        )
+    
+    assert [r.custom_id for r in results] == ["id-a", "id-b", "id-c", "id-d"]
+    assert results[0].response.content[0].text == "echo: a"
+    assert results[1].error.result_type == "errored"
+    submitted = server.batches["msgbatch_1"]
+    assert submitted[2]["params"]["system"] == "S"
+    # Batched requests are held to the context budget like interactive ones
+    assert submitted[3]["params"]["messages"] == [{"role": "user", "content": "d"}]
+    assert sleeps == [1.0, 2.0]
+    print("✓ test_send_many_batch_mode passed")
+
+def test_response_cache_tiers():
+    """Test memory and disk cache tiers, TTL eviction and stream replay"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "responses.sqlite3")
+        fake = FakeMessages()
+        client = make_client(fake)
+        client.cache = ResponseCache(max_size=2, path=path)
+        messages = [{"role": "user", "content": "Hello"}]
+        
+        first = client.send_message(messages, system="S")
+        second = client.send_message(list(messages), system="S")
+        client.send_message(messages, system="Other")
+        assert second is first
+        assert len(fake.calls) == 2
+        assert client.cache.stats()["memory_hits"] == 1
+        
+        # A second process-level cache sees the shared disk tier
+        other = make_client(fake)
+        other.cache = ResponseCache(path=path)
+        with other.send_message(messages, system="S", stream=True) as stream:
+            text = "".join(stream.text_stream)
+        assert text == "echo: Hello"
+        assert other.cache.stats()["disk_hits"] == 1
+        assert len(fake.calls) == 2
+        
+        expiring = ResponseCache(ttl=0.01)
+        expiring.set("k", first)
+        time.sleep(0.02)
+        assert expiring.get("k") is None
+        client.cache.disk.close()
+        other.cache.disk.close()
+    print("✓ test_response_cache_tiers passed")
+
+def test_semantic_cache_near_duplicates():
+    """Test near-duplicate prompts share a cached response, tool requests don't"""
+    fake = FakeMessages()
+    client = make_client(fake)
+    client.semantic_cache = SemanticCache(threshold=0.8)
+    
+    def ask(text, **kwargs):
+        return client.send_message([{"role": "user", "content": text}], **kwargs)
+    
+    first = ask("Hello! Explain what agentic AI is in 3 sentences.")
+    assert ask("hello,  explain what agentic AI is in 3 sentences") is first
+    assert ask("Hello! Explain what agentic AI is in 3 sentences.", system="Pirate") is not first
+    assert ask("Write a haiku about tide pools.") is not first
+    
+    tools = [{"name": "t", "description": "d", "input_schema": {"type": "object"}}]
+    ask("Hello! Explain what agentic AI is in 3 sentences.", tools=tools)
+    assert len(fake.calls) == 4
+    assert client.semantic_cache.stats()["hits"] == 1
+    
+    # Operators and numbers change the question, so they never share an answer
+    product = ask("Please work this out carefully for me and show your steps: 1234 * 5678?")
+    for other in ("Please work this out carefully for me and show your steps: 1234 + 5678?",
+                  "please work this out carefully for me and show your steps 1234 / 5678",
+                  "Please work this out carefully for me and show your steps: 1234 * 5679?",
+                  "Please work this out carefully for me and show your steps: 12.34 * 5678?"):
+        assert ask(other) is not product
+    assert ask("please work this out carefully for me, and show your steps: 1234 * 5678") is product
+    greater = ask("Is 5 > 3?")
+    assert ask("Is 5 < 3?") is not greater and ask("is 5 > 3") is greater
+    
+    # Bounded by default; eviction drops the oldest entry from every band
+    assert client.semantic_cache.max_size == 1024
+    cache = SemanticCache(max_size=2)
+    params = [{"model": "m", "messages": [{"role": "user", "content": f"question number {n}"}]}
+              for n in range(3)]
+    for n, request in enumerate(params):
+        cache.set(request, n)
+    assert len(cache) == 2 and cache.get(params[0]) is None and cache.get(params[2]) == 2
+    assert sum(len(bucket) for bucket in cache._buckets.values()) == 2 * cache.bands
+    print("✓ test_semantic_cache_near_duplicates passed")
+
+def test_prompt_cache_breakpoints():
+    """Test breakpoints land on tools, system and recent user turns"""
+    fake = FakeMessages()
+    client = make_client(fake)
+    client.prompt_cache = PromptCachePolicy(turns=2)
+    tools = [{"name": "a", "input_schema": {}}, {"name": "b", "input_schema": {}}]
+    messages = [
+        {"role": "user", "content": "first"},
+        {"role": "assistant", "content": "reply"},
+        {"role": "user", "content": "second"},
+        {"role": "assistant", "content": "reply"},
+        {"role": "user", "content": "third"}
+    ]
+    
+    response = make_response("ok", cache_read_input_tokens=900)
+    fake.create = lambda **params: fake.calls.append(params) or response
+    client.send_message(messages, system="Be brief", tools=tools)
+    
+    params = fake.calls[0]
+    assert params["tools"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in params["tools"][0]
+    assert params["system"][0]["cache_control"] == {"type": "ephemeral"}
+    marked = [i for i, m in enumerate(params["messages"]) if not isinstance(m["content"], str)]
+    assert marked == [2, 4]
+    assert messages[4]["content"] == "third" and "cache_control" not in tools[-1]
+    assert client.prompt_cache.stats()["last_call"]["cache_read_input_tokens"] == 900
+    
+    # A registry's ToolSchemas keeps one marked copy, payload and all
+    registry = ToolRegistry()
+    registry.register(lambda query: query, name="search", description="Search")
+    client.send_message(messages, tools=registry.tools)
+    client.send_message(messages, tools=registry.tools)
+    first, second = (call["tools"] for call in fake.calls[1:])
+    assert first is second and isinstance(first, ToolSchemas)
+    assert json.loads(first.payload)[-1]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in registry.tools[-1]
+    print("✓ test_prompt_cache_breakpoints passed")
+
+def test_shared_transport_reuses_connections():
+    """Test that separate clients share one warm keep-alive connection"""
+    registry = transport.TransportRegistry(http2=False)
+    previous, transport._registry = transport._registry, registry
+    try:
+        with local_api():
+            registry.warmup(connections=1)
+            assert registry.stats()["new_connections"] == 1
+            
+            for i in range(3):
+                client = ClaudeClient()
+                response = client.send_message([{"role": "user", "content": f"hi {i}"}])
+                assert response.content[0].text == f"echo: hi {i}"
+            
+            stats = registry.stats()
+            assert stats["requests"] == 4
+            assert stats["new_connections"] == 1
+            assert stats["reused_connections"] == 3
+        
+        # An unreachable API is logged, not raised
+        with socket.socket() as closed_port:
+            closed_port.bind(("127.0.0.1", 0))
+            registry.warmup(base_url=f"http://127.0.0.1:{closed_port.getsockname()[1]}")
+        
+        async def open_async_client():
+            return registry.async_http_client()
+        loop = asyncio.new_event_loop()
+        async_client = loop.run_until_complete(open_async_client())
+    finally:
+        registry.close()
+        transport._registry = previous
+    assert async_client.is_closed
+    loop.close()
+    print("✓ test_shared_transport_reuses_connections passed")
+
+def test_coalescing_identical_requests():
+    """Test identical concurrent requests share one upstream call"""
+    fake = SlowMessages(delay=0.1)
+    coalescer = RequestCoalescer()
+    client = make_client(fake)
+    client.coalescer = coalescer
+    
+    results = client.send_many(["same"] * 6 + ["other"], concurrency=7)
+    assert all(r.ok for r in results)
+    assert results[0].response is results[5].response
+    assert len(fake.calls) == 2
+    assert coalescer.stats()["coalesced"] == 5
+    
+    async_fake = FakeAsyncMessages()
+    async_client = make_client(async_fake, cls=AsyncClaudeClient)
+    async_client.coalescer = coalescer
+    
+    async def run():
+        return await async_client.send_many(["same"] * 4, concurrency=4)
+    
+    assert all(r.ok for r in asyncio.run(run()))
+    assert len(async_fake.calls) == 1
+    assert coalescer.stats()["coalesced"] == 8
+    print("✓ test_coalescing_identical_requests passed")
+
+def test_rate_limiter_learns_from_headers():
+    """Test the limiter adopts header limits and queues instead of overrunning"""
+    limiter = RateLimiter(requests_per_minute=60)
+    waits = [limiter._reserve({"messages": []}).wait for _ in range(61)]
+    assert waits[59] == 0 and abs(waits[60] - 1.0) < 0.05
+    
+    limiter = RateLimiter()
+    with local_api(RateLimitedHandler):
+        client = ClaudeClient(rate_limiter=limiter)
+        for i in range(3):
+            response = client.send_message([{"role": "user", "content": f"hi {i}"}])
+            assert response.content[0].text == f"echo: hi {i}"
+    
+    stats = limiter.stats()
+    assert stats["limits"]["requests"] == 6000
+    assert stats["limits"]["input_tokens"] == 100000
+    assert stats["queued"] == 2 and stats["total_wait"] > 0
+    assert limiter.average_output_tokens == 5
+    print("✓ test_rate_limiter_learns_from_headers passed")
+
+def test_hedging_fallback_model_wins():
+    """Test a slow request is hedged to a faster model within the load cap"""
+    fake = ModelLatencyMessages({"slow-model": 0.3, "fast-model": 0.0})
+    client = make_client(fake)
+    client.model = "slow-model"
+    client.hedging = HedgingPolicy(delay=0.02, max_hedge_ratio=0.5, hedge_model="fast-model")
+    
+    start = time.perf_counter()
+    replies = [client.send_message([{"role": "user", "content": "hi"}]) for _ in range(2)]
+    assert [r.content[0].text for r in replies] == ["slow-model", "fast-model"]
+    assert time.perf_counter() - start < 0.55
+    assert client.hedging.stats()["hedges"] == 1
+    assert client.hedging.stats()["hedge_wins"] == 1
+    
+    # Primaries are not capped by the hedge pool, and a primary that lost
+    # to its hedge still reports its latency
+    client.hedging = HedgingPolicy(delay=10, max_workers=1)
+    start = time.perf_counter()
+    results = client.send_many(["hi"] * 8, concurrency=8)
+    assert all(r.error is None for r in results)
+    assert time.perf_counter() - start < 0.55
+    client.hedging = HedgingPolicy(delay=0.02, max_hedge_ratio=1.0, hedge_model="fast-model")
+    assert client.send_message([{"role": "user", "content": "hi"}]).content[0].text == "fast-model"
+    time.sleep(0.4)
+    assert len(client.hedging.latencies) == 1 and client.hedging.latencies[0] >= 0.3
+    
+    async_fake = AsyncModelLatencyMessages({"slow-model": 0.3})
+    async_client = make_client(async_fake, cls=AsyncClaudeClient)
+    async_client.model = "slow-model"
+    async_client.hedging = HedgingPolicy(delay=0.02, max_hedge_ratio=1.0, hedge_model="fast-model")
+    reply = asyncio.run(async_client.send_message([{"role": "user", "content": "hi"}]))
+    assert reply.content[0].text == "fast-model"
+    assert async_fake.cancelled == 1
+    print("✓ test_hedging_fallback_model_wins passed")
+
+def test_circuit_breaker_fast_fail_and_fallback():
+    """Test the breaker opens on overload, routes to a fallback and half-opens"""
+    fake = OverloadedMessages({"primary"})
+    client = make_client(fake)
+    client.model = "primary"
+    client.circuit_breakers = ModelCircuitBreakers(failure_threshold=2, reset_timeout=0.05, retry_delay=0)
+    messages = [{"role": "user", "content": "hi"}]
+    
+    # The breaker retries, so both failed attempts of one call count; the
+    # retry that would follow finds the circuit open and the error surfaces
+    try:
+        client.send_message(messages)
+        assert False, "expected overload error"
+    except anthropic.InternalServerError:
+        pass
+    
+    try:
+        client.send_message(messages)
+        assert False, "expected fast failure"
+    except CircuitOpenError as e:
+        assert e.model == "primary"
+    assert len(fake.calls) == 2
+    
+    client.circuit_breakers.fallbacks["primary"] = "backup"
+    assert client.send_message(messages).content[0].text == "backup"
+    
+    time.sleep(0.06)
+    fake.overloaded.clear()
+    assert client.send_message(messages).content[0].text == "primary"
+    
+    stats = client.circuit_breakers.stats()
+    assert stats["models"]["primary"]["state"] == "closed"
+    assert stats["models"]["primary"]["transitions"] == {
+        "closed->open": 1, "open->half_open": 1, "half_open->closed": 1
+    }
+    assert stats["fallback_calls"] == {"backup": 1}
+    
+    # Over HTTP the SDK makes one attempt per breaker attempt, not three
+    with local_api(RetryableOverloadedHandler) as server:
+        client = ClaudeClient(circuit_breakers=ModelCircuitBreakers(failure_threshold=3, retry_delay=0))
+        try:
+            client.send_message(messages)
+            assert False, "expected overload error"
+        except anthropic.APIStatusError:
+            pass
+    assert len(server.bodies) == 3
+    assert client.circuit_breakers.stats()["models"][client.model]["state"] == "open"
+    print("✓ test_circuit_breaker_fast_fail_and_fallback passed")
+
+def test_key_pool_ejects_unhealthy_member():
+    """Test balancing moves traffic off a failing key/endpoint"""
+    with local_api(OverloadedHandler) as bad, local_api() as good:
+        pool = KeyPool([
+            PoolMember("key-aaaa", f"http://127.0.0.1:{bad.server_port}"),
+            PoolMember("key-bbbb", f"http://127.0.0.1:{good.server_port}")
+        ], eject_after=1)
+        client = ClaudeClient(key_pool=pool)
+        
+        replies = []
+        for i in range(4):
+            try:
+                replies.append(client.send_message([{"role": "user", "content": f"q{i}"}]))
+            except anthropic.APIStatusError:
+                replies.append(None)
+    
+    assert replies[0] is None
+    assert [r.content[0].text for r in replies[1:]] == ["echo: q1", "echo: q2", "echo: q3"]
+    stats = pool.stats()
+    bad_stats = stats[f"...aaaa@http://127.0.0.1:{bad.server_port}"]
+    good_stats = stats[f"...bbbb@http://127.0.0.1:{good.server_port}"]
+    assert bad_stats["errors"] == 1 and bad_stats["ejected"] and bad_stats["ejections"] == 1
+    assert good_stats["completed"] == 3 and good_stats["output_tokens"] == 15
+    assert good_stats["outstanding"] == 0
+    assert good_stats["mean_latency"] > 0 and good_stats["requests_per_second"] > 0
+    
+    # A stream's rate-limit headers reach its member like a request's
+    with local_api(RateLimitedStreamingHandler):
+        pool = KeyPool([PoolMember("key-dddd")])
+        with ClaudeClient(key_pool=pool).send_message([{"role": "user", "content": "s"}], stream=True) as stream:
+            assert "".join(stream.text_stream) == "echo: s"
+    stats = pool.stats()["...dddd@default"]
+    assert stats["ejected"] and stats["completed"] == 1 and stats["output_tokens"] == 5
+    
+    # Streams hold a member too; cancelled calls free their slot without an error
+    member = PoolMember("key-cccc")
+    member._client = SimpleNamespace(messages=SimpleNamespace(
+        stream=lambda **params: ReplayStream(make_response("streamed"))
+    ))
+    pool = KeyPool([member])
+    with ClaudeClient(key_pool=pool).send_message([{"role": "user", "content": "s"}], stream=True) as stream:
+        assert "".join(stream.text_stream) == "streamed"
+        assert member.outstanding == 1
+    
+    async def cancel_one():
+        task = asyncio.ensure_future(pool.acall(lambda member, params: asyncio.sleep(1), {}))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    
+    asyncio.run(cancel_one())
+    stats = member.stats()
+    assert stats["outstanding"] == 0 and stats["completed"] == 1
+    assert stats["cancelled"] == 1 and stats["errors"] == 0
+    print("✓ test_key_pool_ejects_unhealthy_member passed")
+
+def test_priority_lanes_interactive_jumps_queue():
+    """Test interactive calls overtake queued background work"""
+    dispatcher = PriorityDispatcher(
+        [Lane("interactive"), Lane("background", max_concurrency=2)],
+        max_concurrency=2,
+        strict=True
+    )
+    fake = SlowMessages(delay=0.05)
+    background = make_client(fake)
+    background.dispatcher, background.lane = dispatcher, "background"
+    interactive = make_client(fake)
+    interactive.dispatcher, interactive.lane = dispatcher, "interactive"
+    
+    batch = threading.Thread(
+        target=lambda: background.send_many([f"job {i}" for i in range(8)], concurrency=8)
+    )
+    batch.start()
+    time.sleep(0.02)
+    start = time.perf_counter()
+    interactive.send_message([{"role": "user", "content": "hi"}])
+    interactive_latency = time.perf_counter() - start
+    batch.join()
+    
+    stats = dispatcher.stats()
+    assert interactive_latency < 0.12
+    assert stats["interactive"]["granted"] == 1
+    assert stats["background"]["granted"] == 8
+    assert stats["background"]["p99_wait"] > stats["interactive"]["p99_wait"]
+    assert fake.peak == 2
+    
+    # A stream holds its lane slot until it is closed
+    streaming = make_client(FakeAsyncMessages(), cls=AsyncClaudeClient)
+    streaming.dispatcher, streaming.lane = dispatcher, "background"
+    
+    async def stream_in_lane():
+        async with streaming.send_message([{"role": "user", "content": "s"}], stream=True) as stream:
+            assert dispatcher.lanes["background"].in_flight == 1
+            return await stream.get_final_text()
+    
+    assert asyncio.run(stream_in_lane()) == "echo: s"
+    assert dispatcher.lanes["background"].in_flight == 0
+    assert dispatcher.stats()["background"]["granted"] == 9
+    print("✓ test_priority_lanes_interactive_jumps_queue passed")
+
+def test_model_cascade_escalates_on_rules():
+    """Test the cascade serves from the fast tier and escalates on failed checks"""
+    def create(**params):
+        fake.calls.append(params)
+        content = params["messages"][-1]["content"]
+        if params["model"] == "fast" and content == "hard":
+            return make_response("maybe", stop_reason="max_tokens")
+        if params["model"] == "fast" and content == "number":
+            return make_response("forty-two")
+        return make_response(f"{params['model']}: 42")
+    
+    fake = FakeMessages()
+    fake.create = create
+    client = make_client(fake)
+    client.router = ModelCascade(
+        ["fast", "strong"],
+        rules=[escalate_on_max_tokens, invalid_output(lambda text: any(c.isdigit() for c in text))],
+        route=tools_start_at(1)
+    )
+    
+    def ask(text, **kwargs):
+        return client.send_message([{"role": "user", "content": text}], **kwargs).content[0].text
+    
+    assert ask("easy") == "fast: 42"
+    assert ask("hard") == "strong: 42"
+    assert ask("number") == "strong: 42"
+    assert ask("easy", tools=[{"name": "t", "input_schema": {}}]) == "strong: 42"
+    assert [call["model"] for call in fake.calls] == ["fast", "fast", "strong", "fast", "strong", "strong"]
+    
+    tiers = client.router.stats()["tiers"]
+    assert tiers["fast"]["served"] == 1 and tiers["fast"]["escalated"] == 2
+    assert tiers["strong"]["share"] == 0.75
+    print("✓ test_model_cascade_escalates_on_rules passed")
+
+def test_token_budget_trims_and_rejects():
+    """Test running token totals and trimming with a pinned prefix"""
+    estimator = TokenEstimator(chars_per_token=4)
+    history = BudgetedHistory(estimator=estimator)
+    history.append({"role": "user", "content": "task " * 40})
+    for i in range(500):
+        history.append({"role": "assistant", "content": "x" * 400})
+        history.append({"role": "user", "content": "y" * 400})
+    assert history.tokens == sum(estimator.message(m) for m in history)
+    
+    start = time.perf_counter()
+    for _ in range(1000):
+        history.append({"role": "assistant", "content": "z" * 400})
+        history.pop()
+    assert (time.perf_counter() - start) / 1000 < 0.001
+    
+    fake = FakeMessages()
+    client = make_client(fake)
+    client.context_budget = ContextBudget(limit=5000, pinned=1, estimator=estimator)
+    client.send_message(history)
+    sent = fake.calls[0]["messages"]
+    assert sent[0] is history[0] and sent[-1] is history[-1]
+    assert sent[1]["role"] == "user"
+    assert estimator.messages(sent) <= 5000
+    assert len(history) == 1001
+    
+    client.context_budget = ContextBudget(limit=5000, policy="reject", estimator=estimator)
+    try:
+        client.send_message(history)
+        assert False, "expected budget rejection"
+    except ContextBudgetExceeded as e:
+        assert e.estimated > e.limit
+    
+    # When nothing can be cut, the error reports the untrimmed estimate
+    client.context_budget = ContextBudget(limit=50, estimator=estimator)
+    try:
+        client.send_message([{"role": "user", "content": "v" * 800}])
+        assert False, "expected budget rejection"
+    except ContextBudgetExceeded as e:
+        assert e.estimated > e.limit
+    
+    # chat() appends to the caller's list and keeps its running total beside it
+    client.context_budget = ContextBudget(limit=5000, estimator=estimator)
+    chat_history = []
+    client.chat("hello", chat_history)
+    reply, returned = client.chat("again", chat_history)
+    assert returned is chat_history and len(chat_history) == 4
+    tally = history_tally(chat_history)
+    assert tally.estimator is estimator
+    assert tally.tokens == sum(estimator.message(m) for m in chat_history)
+    chat_history[1:3] = []
+    assert history_tally(chat_history).tokens == sum(estimator.message(m) for m in chat_history)
+    
+    counted = []
+    fake.count_tokens = lambda **fields: counted.append(fields) or SimpleNamespace(input_tokens=50)
+    params = {"model": "m", "messages": [{"role": "user", "content": "w" * 396}]}
+    for _ in range(2):
+        assert estimator.calibrate(client.client, params, weight=1.0) == 50
+    assert len(counted) == 1
+    assert estimator.request(params) == 50
+    print("✓ test_token_budget_trims_and_rejects passed")
+
+def test_background_compaction_keeps_tool_pairs():
+    """Test older turns are summarized off the critical path without splitting tool pairs"""
+    def create(**params):
+        fake.calls.append(params)
+        if params.get("system") == SUMMARY_SYSTEM:
+            return make_response("user asked things; tool said 4")
+        return make_response("answer " * 40)
+    
+    fake = FakeMessages()
+    fake.create = create
+    client = make_client(fake)
+    client.compaction = CompactionPolicy(threshold=300, keep_recent=4)
+    history_start = [
+        {"role": "user", "content": "what is 2 + 2?"},
+        {"role": "assistant", "content": [{"type": "tool_use", "id": "t1", "name": "calc", "input": {}}]},
+        {"role": "user", "content": [{"type": "tool_result", "tool_use_id": "t1", "content": "4"}]},
+        {"role": "assistant", "content": "It is 4."}
+    ]
+    history = list(history_start)
+    
+    for i in range(4):
+        _, history = client.chat(f"question {i} " * 20, history)
+    history_tally(history).compaction_job.future.result()
+    _, history = client.chat("next", history)
+    
+    # The summary opens the first kept user turn, so roles still alternate
+    assert history[0]["content"].startswith(SUMMARY_PREFIX)
+    assert history[0]["content"].split("\n\n", 1)[1].startswith("question ")
+    assert [m["role"] for m in history] == ["user", "assistant"] * (len(history) // 2)
+    assert history[-1]["content"] == "answer " * 40
+    stats = session_stats(history)
+    assert stats["compactions"] >= 1 and stats["tokens_saved"] > 0
+    assert stats["compactions"] == client.compaction.stats()["compactions"]
+    assert stats["tokens"] == sum(history_tally(history).message_tokens)
+    
+    # Pinned messages ending on a tool_use keep their tool_result
+    client.compaction = CompactionPolicy(threshold=300, keep_recent=4, pinned=2)
+    history = list(history_start)
+    for i in range(4):
+        _, history = client.chat(f"question {i} " * 20, history)
+    history_tally(history).compaction_job.future.result()
+    _, history = client.chat("next", history)
+    assert history[:3] == history_start[:3]
+    assert history[4]["content"].startswith(SUMMARY_PREFIX)
+    assert [m["role"] for m in history] == ["user", "assistant"] * (len(history) // 2)
+    
+    # The summary request is held to the context budget, and failing it
+    # does not fail the turn
+    def enforce(messages, system=None, **options):
+        if system == SUMMARY_SYSTEM:
+            raise ContextBudgetExceeded(10 ** 6, 1000)
+        return messages
+    
+    client.compaction = CompactionPolicy(threshold=300, keep_recent=4)
+    client.context_budget = ContextBudget()
+    client.context_budget.enforce = enforce
+    calls = len(fake.calls)
+    history = list(history_start)
+    for i in range(4):
+        _, history = client.chat(f"question {i} " * 20, history)
+    assert isinstance(history_tally(history).compaction_job.future.exception(), ContextBudgetExceeded)
+    _, history = client.chat("next", history)
+    assert client.compaction.stats()["failures"] >= 1
+    assert not any(call.get("system") == SUMMARY_SYSTEM for call in fake.calls[calls:])
+    print("✓ test_background_compaction_keeps_tool_pairs passed")
+
+def test_message_store_compact_history():
+    """Test a MessageStore holds a long tool session in less memory and sends unchanged"""
+    import tracemalloc
+    result = "Python 3.13 is the latest stable version. " * 3
+    
+    def build(history):
+        history.append({"role": "user", "content": "Search for the latest Python version."})
+        for i in range(200):
+            response = make_response("Let me look that up with the search tool.")
+            response.content.append(anthropic.types.ToolUseBlock(
+                type="tool_use", id=f"toolu_{i:020d}", name="search_web", input={"query": "python"}
+            ))
+            history.append({"role": "assistant", "content": response.content})
+            history.append({"role": "user", "content": [
+                {"type": "tool_result", "tool_use_id": f"toolu_{i:020d}", "content": "".join(result)}
+            ]})
+        return history
+    
+    sizes = []
+    for history in ([], MessageStore(pool=TextPool())):
+        tracemalloc.start()
+        history = build(history)
+        sizes.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+    assert sizes[0] > 2 * sizes[1]
+    
+    assert isinstance(history[1:3], MessageStore)
+    assert history[2]["content"][0]["content"] is history[4]["content"][0]["content"]
+    assert format_messages(history) is history
+    assert json.loads(json.dumps(list(history[:2]), default=dict))[1]["content"][1]["name"] == "search_web"
+    
+    with local_api():
+        response = ClaudeClient().send_message(history)
+    assert response.content[0].text
+    print("✓ test_message_store_compact_history passed")
+
+def test_request_encoder_reuses_settled_turns():
+    """Test pre-encoded bodies match what the SDK sends and only new turns are encoded"""
+    tools = [{"name": f"tool_{i}", "description": "d", "input_schema": {"type": "object"}} for i in range(3)]
+    
+    def run(client):
+        history = [{"role": "user", "content": "hi"}]
+        for turn in range(8):
+            response = client.send_message(history, system="be brief", tools=tools)
+            history.append({"role": "assistant", "content": response.content})
+            history.append({"role": "user", "content": f"more {turn} ✓"})
+    
+    encoder = RequestEncoder()
+    with local_api() as server:
+        run(ClaudeClient(prompt_cache=PromptCachePolicy()))
+        run(ClaudeClient(prompt_cache=PromptCachePolicy(), encoder=encoder))
+        assert asyncio.run(AsyncClaudeClient(encoder=encoder).send_message(
+            [{"role": "user", "content": "async"}]
+        )).content[0].text == "echo: async"
+    
+    # The SDK sends unset pydantic fields as null; to_jsonable drops them
+    bodies = [json.loads(body, object_hook=lambda d: {k: v for k, v in d.items() if v is not None})
+              for body in server.bodies]
+    assert bodies[:8] == bodies[8:16]
+    stats = encoder.stats()
+    # Each turn encodes the new turns, the breakpoint copies and the originals they replace
+    assert stats["encoded"] <= 6 * 8 + 1 and stats["reused"] > stats["encoded"]
+    
+    # A history shortened in the middle (as compaction does) is re-encoded from the cut
+    history = [{"role": "user", "content": f"turn {i}"} for i in range(6)]
+    encoder.encode({"messages": history})
+    history[1:4] = [{"role": "user", "content": "summary"}]
+    history.append({"role": "user", "content": "new"})
+    assert json.loads(encoder.encode({"messages": history})) == {"messages": history}
+    
+    # Like messages.create, a request too long to run unstreamed is refused
+    try:
+        ClaudeClient(encoder=encoder, max_tokens=64000).send_message([{"role": "user", "content": "hi"}])
+        assert False, "expected the non-streaming check"
+    except ValueError as e:
+        assert "Streaming is required" in str(e)
+    print("✓ test_request_encoder_reuses_settled_turns passed")
+
+def test_session_store_spills_and_reloads():
+    """Test chat(session_id=...) keeps a bounded LRU over the disk log and reloads cold sessions"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SessionStore(os.path.join(tmp, "sessions.sqlite3"), max_sessions=2)
+        with local_api():
+            client = ClaudeClient(sessions=store)
+            for session_id in ("a", "b", "c"):
+                client.chat(f"hello {session_id}", session_id=session_id)
+            reply, history = client.chat("again", session_id="a")
+        
+        assert reply == "echo: again" and len(history) == 4
+        assert store.stats()["hot_sessions"] == 2 and store.stats()["disk_loads"] == 1
+        
+        # A long cold session reloads in one range scan
+        long = store.get("long")
+        for i in range(200):
+            long.append({"role": "user", "content": f"question {i} " * 20})
+            long.append({"role": "assistant", "content": [{"type": "text", "text": f"answer {i}"}]})
+        store.save("long", long)
+        for session_id in ("x", "y"):
+            store.get(session_id)
+        reloaded = SessionStore(store.path).get("long")
+        assert to_jsonable(reloaded[-1]) == {"role": "assistant", "content": [{"type": "text", "text": "answer 199"}]}
+        start = time.perf_counter()
+        store.get("long")
+        assert time.perf_counter() - start < 0.010
+        
+        # Replacing earlier turns (as compaction does) rewrites the log from there on
+        history = BudgetedHistory(store.get("long"))
+        history.replace_range(0, 398, [{"role": "user", "content": "summary"}])
+        store.save("long", history)
+        store.delete("x")
+        reopened = SessionStore(store.path)
+        assert [m["content"] for m in reopened.get("long")][0] == "summary" and len(reopened.get("long")) == 3
+        assert len(reopened.get("x")) == 0
+        
+        # Retained text is bounded by the hot sessions, not every session ever seen
+        bounded = SessionStore(os.path.join(tmp, "bounded.sqlite3"), max_sessions=2)
+        shared = SessionStore(os.path.join(tmp, "shared.sqlite3"), max_sessions=2,
+                              pool=TextPool(max_size=100))
+        for sessions in (bounded, shared):
+            for i in range(300):
+                history = sessions.get(f"s{i}")
+                history.append({"role": "user", "content": f"a long distinct question {i}"})
+                sessions.save(f"s{i}", history)
+        assert bounded.get("s299").pool is not bounded.get("s298").pool
+        assert len(bounded.get("s299").pool) == 1
+        assert len(shared.pool) == 100 and shared.get("s299").pool is shared.pool
+        
+        try:
+            make_client().chat("hi", session_id="a")
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+    print("✓ test_session_store_spills_and_reloads passed")
+
+def test_history_forks_share_prefix():
+    """Test forks of an immutable History share their prefix and chat accepts them"""
+    import copy
+    import tracemalloc
+    base = History()
+    for i in range(500):
+        base = base.append({"role": "user", "content": f"question {i} " * 20})
+        base = base.append({"role": "assistant", "content": [{"type": "text", "text": f"answer {i} " * 20}]})
+    
+    tracemalloc.start()
+    forks = [base.append({"role": "user", "content": f"what if {i}?"}) for i in range(1000)]
+    fork_bytes = tracemalloc.get_traced_memory()[0]
+    copies = [copy.deepcopy([dict(m) for m in base]) for _ in range(10)]
+    copy_bytes = (tracemalloc.get_traced_memory()[0] - fork_bytes) / 10
+    tracemalloc.stop()
+    # A thousand forks cost less than one deep copy of the shared prefix
+    assert fork_bytes < copy_bytes
+    assert len(forks[7]) == 1001 and forks[7][:1000] is base and forks[7][-1]["content"] == "what if 7?"
+    assert copy.deepcopy(base) is base and base[3] is forks[0][3]
+    
+    with local_api():
+        reply, retry = ClaudeClient().chat("again", base[:2])
+    assert reply == "echo: again" and len(retry) == 4 and len(base) == 1000
+    assert retry[:2] is base[:2] and format_messages(retry) is retry
+    print("✓ test_history_forks_share_prefix passed")
+
+def test_tool_executor_runs_turn_concurrently():
+    """Test a turn's tool calls overlap, keep their order and ids, and respect the cap"""
+    def slow_echo(text, delay=0.2):
+        time.sleep(delay)
+        return text
+    
+    async def async_echo(text):
+        await asyncio.sleep(0.2)
+        return {"echo": text}
+    
+    def broken():
+        raise RuntimeError("boom")
+    
+    executor = ToolExecutor(
+        {"slow_echo": slow_echo, "async_echo": async_echo, "broken": broken}, max_concurrency=4
+    )
+    content = [{"type": "text", "text": "working on it"}] + [
+        {"type": "tool_use", "id": "t1", "name": "slow_echo", "input": {"text": "a", "delay": 0.3}},
+        {"type": "tool_use", "id": "t2", "name": "async_echo", "input": {"text": "b"}},
+        {"type": "tool_use", "id": "t3", "name": "slow_echo", "input": {"text": "c"}},
+        {"type": "tool_use", "id": "t4", "name": "broken", "input": {}},
+        {"type": "tool_use", "id": "t5", "name": "missing", "input": {}}
+    ]
+    
+    for run in (executor.run, lambda blocks: asyncio.run(executor.arun(blocks))):
+        started = time.perf_counter()
+        results = run(content)
+        assert time.perf_counter() - started < 0.5
+        assert [r["tool_use_id"] for r in results] == ["t1", "t2", "t3", "t4", "t5"]
+        assert [r["content"] for r in results[:3]] == ["a", "{'echo': 'b'}", "c"]
+        assert results[3]["is_error"] and "boom" in results[3]["content"]
+        assert results[4]["is_error"] and "Unknown tool: missing" in results[4]["content"]
+    
+    # Lists pass through only as content blocks
+    blocks = [{"type": "text", "text": "a"}]
+    assert tool_result("t", blocks)["content"] is blocks
+    assert tool_result("t", ["a", 1])["content"] == "['a', 1]"
+    assert tool_result("t", [])["content"] == "[]"
+    
+    # With a cap of 2, four 0.2 s calls take two rounds
+    executor.max_concurrency = 2
+    started = time.perf_counter()
+    executor.run([{"type": "tool_use", "id": f"t{i}", "name": "slow_echo", "input": {"text": "x"}}
+                  for i in range(4)])
+    assert 0.35 < time.perf_counter() - started < 0.6
+    assert executor.stats()["errors"] == 4 and executor.stats()["seconds_saved"] > 0.5
+    print("✓ test_tool_executor_runs_turn_concurrently passed")
+
+def test_tool_cache_memoizes_per_tool():
+    """Test tool results are reused by canonical arguments, per-tool TTL and cacheability"""
+    calls = []
+    
+    def search(query, limit=5):
+        calls.append(("search", query, limit))
+        return {"results": [query] * limit}
+    
+    async def weather(location):
+        calls.append(("weather", location))
+        return f"Sunny in {location}"
+    
+    def send(to):
+        calls.append(("send", to))
+        return "sent"
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tools.sqlite3")
+        cache = ToolCache(ttl=60, path=path, tools={"weather": {"ttl": 0.05}, "send": {"cacheable": False}})
+        tools = cache.wrap_all({"search": search, "weather": weather, "send": send})
+        
+        assert tools["search"]("python") == tools["search"](query="python", limit=5)
+        assert tools["search"]("python", 2) != tools["search"]("python")
+        assert asyncio.run(tools["weather"]("Paris")) == asyncio.run(tools["weather"]("Paris"))
+        time.sleep(0.06)
+        asyncio.run(tools["weather"]("Paris"))
+        tools["send"]("bob"), tools["send"]("bob")
+        assert calls == [("search", "python", 5), ("search", "python", 2), ("weather", "Paris"),
+                         ("weather", "Paris"), ("send", "bob"), ("send", "bob")]
+        
+        # A fresh process sees the shared disk tier
+        other = ToolCache(ttl=60, path=path).wrap("search", search)
+        assert other("python") == {"results": ["python"] * 5} and len(calls) == 6
+        
+        stats = cache.stats()
+        assert stats["search"]["memory_hits"] == 2 and stats["search"]["hit_rate"] == 0.5
+        assert stats["weather"]["misses"] == 2 and stats["send"]["uncached"] == 2
+        cache.clear()
+        tools["search"]("python")
+        assert len(calls) == 7
+    print("✓ test_tool_cache_memoizes_per_tool passed")
+
+def test_tool_registry_schemas_and_validation():
+    """Test schemas come from signatures once and bad model input is rejected up front"""
+    registry = ToolRegistry()
+    
+    @registry.tool(params={"city": "City name"})
+    def forecast(city: str, days: int = 3, units: Literal["C", "F"] = "C",
+                 hours: Optional[List[float]] = None):
+        """Weather forecast for a city"""
+        return f"{city}:{days}{units}"
+    
+    schema = registry.tools[0]
+    assert schema == {
+        "name": "forecast",
+        "description": "Weather forecast for a city",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "city": {"type": "string", "description": "City name"},
+                "days": {"type": "integer"},
+                "units": {"type": "string", "enum": ["C", "F"]},
+                "hours": {"type": "array", "items": {"type": "number"}}
+            },
+            "required": ["city"]
+        }
+    }
+    tools = registry.tools
+    assert json.loads(tools.payload) == tools and tools.payload is tools.payload
+    assert TokenEstimator().request({"messages": [], "tools": tools}) > 0
+    
+    assert registry.call("forecast", {"city": "Oslo", "hours": [1, 2.5]}) == "Oslo:3C"
+    for bad, message in (({}, "missing required argument 'city'"),
+                         ({"city": "Oslo", "days": True}, "'days' must be integer"),
+                         ({"city": "Oslo", "units": "K"}, "'units'"),
+                         ({"city": "Oslo", "units": ["C"]}, "'units'"),
+                         ({"city": "Oslo", "hours": ["x"]}, "'hours'"),
+                         ({"city": "Oslo", "extra": 1}, "unexpected argument 'extra'")):
+        try:
+            registry.call("forecast", bad)
+            assert False, f"expected ToolInputError for {bad}"
+        except ToolInputError as e:
+            assert message in str(e)
+    
+    # Validation errors reach the model as is_error tool_results
+    results = ToolExecutor(registry.functions).run([
+        {"type": "tool_use", "id": "t1", "name": "forecast", "input": {"days": 2}}
+    ])
+    assert results[0]["is_error"] and "city" in results[0]["content"]
+    
+    @registry.tool(name="forecast_async")
+    async def forecast_async(city: str):
+        return city
+    assert registry.tools is not tools and len(registry.tools) == 2
+    assert asyncio.run(registry.functions["forecast_async"](city="Rome")) == "Rome"
+    print("✓ test_tool_registry_schemas_and_validation passed")
+
+def test_calculator_limits_cache_and_vectorized():
+    """Test the AST calculator refuses costly or unsafe input fast and caches compiled expressions"""
+    calculator = Calculator()
+    assert calculator.evaluate("15 * 24") == 360
+    assert calculator.evaluate("sqrt(16) + max(1, 2, 3) - pow(2, 3)") == -1.0
+    assert calculator.evaluate("x * y + 1", x=3, y=4) == 13
+    assert calculator.evaluate("sum([1, 2, 3]) + min((4, 5)) + max(6, 7)") == 17
+    
+    started = time.perf_counter()
+    for text in ("pow(10, 10**10)", "9**9**9", "2**5000", "round(5, -10**100)", "(-8)**0.5",
+                 "__import__('os')", "().__class__", "open('x')", "x + 1", "1/0", "'a' * 3",
+                 "[0]*9999*9999", "[0]*9999*9999*9999", "min([1], [2]) * 9999", "(1, 2)",
+                 "abs * 3", "-" * 900 + "1"):
+        try:
+            calculator.evaluate(text)
+            assert False, f"expected CalculationError for {text}"
+        except CalculationError:
+            pass
+    assert time.perf_counter() - started < 1.0
+    
+    # Compiled once per distinct expression
+    first = calculator.compile("2024 - 1991")
+    assert calculator.compile("2024 - 1991") is first
+    assert calculator.stats()["compiled_cached"] >= 1
+    
+    try:
+        import numpy as np
+    except ImportError:
+        print("✓ test_calculator_limits_cache_and_vectorized passed (NumPy not installed)")
+        return
+    values = calculator.evaluate_many("x * y + max(x, y) ** 2", x=[0, 1, 2], y=np.array([1, 2, 3]))
+    assert values.tolist() == [1.0, 6.0, 15.0]
+    print("✓ test_calculator_limits_cache_and_vectorized passed")
+
+def test_tool_sandbox_times_out_and_recycles():
+    """Test sandboxed tools run in warm workers, time out as is_error results, and recycle"""
+    registry = ToolRegistry()
+    
+    @registry.tool()
+    def add(a: int, b: int = 1):
+        """Add two numbers"""
+        return a + b
+    
+    @registry.tool()
+    def stall(seconds: float):
+        """Sleep, standing in for a stuck tool"""
+        time.sleep(seconds)
+        return "done"
+    
+    with ToolSandbox(registry.functions, workers=2, timeout=0.5, max_calls=20) as sandbox:
+        started = time.perf_counter()
+        for i in range(50):
+            assert sandbox.functions["add"](a=i) == i + 1
+        assert (time.perf_counter() - started) / 50 < 0.05
+        assert sandbox.stats()["recycled"] >= 2
+        
+        # Validation still happens, inside the worker
+        try:
+            sandbox.call("add", {"a": "x"})
+            assert False, "expected ToolInputError"
+        except ToolInputError:
+            pass
+        
+        started = time.perf_counter()
+        try:
+            sandbox.call("stall", {"seconds": 5})
+            assert False, "expected ToolTimeoutError"
+        except ToolTimeoutError:
+            pass
+        assert time.perf_counter() - started < 2
+        
+        # Through the executor a timeout is an is_error result; the other call completes
+        results = ToolExecutor(ToolCache().wrap_all(sandbox.functions)).run([
+            {"type": "tool_use", "id": "t1", "name": "stall", "input": {"seconds": 5}},
+            {"type": "tool_use", "id": "t2", "name": "add", "input": {"a": 2}}
+        ])
+        assert results[0]["is_error"] and "timed out" in results[0]["content"]
+        assert results[1] == {"type": "tool_result", "tool_use_id": "t2", "content": "3"}
+        
+        stats = sandbox.stats()
+        assert stats["timeouts"] == 2 and stats["workers"] == 2
+    assert sandbox.stats()["workers"] == 0
+    
+    # Waiting for a busy worker counts against the timeout, and close() wakes waiters
+    sandbox = ToolSandbox(registry.functions, workers=1, timeout=0.3, tools={"stall": {"timeout": 1}}).start()
+    spawned_by = []
+    spawn = sandbox._spawn
+    sandbox._spawn = lambda: spawned_by.append(threading.current_thread().name) or spawn()
+    errors = []
+    
+    def call(name, tool_input):
+        try:
+            sandbox.call(name, tool_input)
+        except Exception as e:
+            errors.append(e)
+    
+    stuck = threading.Thread(target=call, args=("stall", {"seconds": 5}))
+    stuck.start()
+    time.sleep(0.05)
+    started = time.perf_counter()
+    call("add", {"a": 1})
+    assert isinstance(errors[-1], ToolTimeoutError) and "waiting for a worker" in str(errors[-1])
+    assert time.perf_counter() - started < 0.5
+    stuck.join()
+    assert isinstance(errors[-1], ToolTimeoutError) and "after 1s" in str(errors[-1])
+    assert sandbox.functions["add"](a=1) == 2
+    assert spawned_by == ["tool-sandbox-spawner"]
+    
+    stuck = threading.Thread(target=call, args=("stall", {"seconds": 0.2}))
+    stuck.start()
+    time.sleep(0.05)
+    waiter = threading.Thread(target=call, args=("add", {"a": 1}))
+    waiter.start()
+    time.sleep(0.05)
+    sandbox.close()
+    stuck.join()
+    waiter.join(timeout=1)
+    assert not waiter.is_alive() and isinstance(errors[-1], RuntimeError)
+    assert sandbox.stats()["workers"] == 0
+    print("✓ test_tool_sandbox_times_out_and_recycles passed")
+
 if __name__ == "__main__":
     test_format_messages()
+    test_async_client_chat()
+    test_send_many_ordered_with_errors()
+    test_send_many_batch_mode()
+    test_response_cache_tiers()
+    test_semantic_cache_near_duplicates()
+    test_prompt_cache_breakpoints()
+    test_shared_transport_reuses_connections()
+    test_coalescing_identical_requests()
+    test_rate_limiter_learns_from_headers()
+    test_hedging_fallback_model_wins()
+    test_circuit_breaker_fast_fail_and_fallback()
+    test_key_pool_ejects_unhealthy_member()
+    test_priority_lanes_interactive_jumps_queue()
+    test_model_cascade_escalates_on_rules()
+    test_token_budget_trims_and_rejects()
+    test_background_compaction_keeps_tool_pairs()
+    test_message_store_compact_history()
+    test_request_encoder_reuses_settled_turns()
+    test_session_store_spills_and_reloads()
+    test_history_forks_share_prefix()
+    test_tool_executor_runs_turn_concurrently()
+    test_tool_cache_memoizes_per_tool()
+    test_tool_registry_schemas_and_validation()
+    test_calculator_limits_cache_and_vectorized()
+    test_tool_sandbox_times_out_and_recycles()